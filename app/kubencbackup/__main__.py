@@ -1,7 +1,24 @@
+import argparse
+
+from datetime import datetime
+
 from kubencbackup.kubencbackup import KubeNCBackup
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog="kubencbackup")
+    parser.add_argument("--resume", action="store_true",
+        help="resume the last run left incomplete, skipping the steps it already completed (requires STATE_PATH)")
+    parser.add_argument("--catalog", choices=["latest-complete", "sets-in-range", "missing-component"],
+        help="print the backup sets answering the query from the backup catalog as JSON, instead of running a backup (requires BACKUP_CATALOG_PATH)")
+    parser.add_argument("--since", type=datetime.fromisoformat,
+        help="start of the range of '--catalog sets-in-range', as an ISO 8601 date and time (default: 7 days ago)")
+    parser.add_argument("--until", type=datetime.fromisoformat,
+        help="end of the range of '--catalog sets-in-range', as an ISO 8601 date and time (default: now)")
+    args = parser.parse_args()
+
     try:
-        exit(KubeNCBackup().main())
+        if args.catalog != None:
+            exit(KubeNCBackup().query_catalog(query=args.catalog, since=args.since, until=args.until))
+        exit(KubeNCBackup().main(resume=args.resume))
     except:
         pass
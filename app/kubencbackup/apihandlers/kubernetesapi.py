@@ -1,15 +1,31 @@
+import binascii
 import os
+import re
+import shlex
+import sys
+import time
+import uuid
+
+from io import StringIO
+from threading import Lock, RLock
 
 from kubernetes import config
 from kubernetes.client import Configuration
 from kubernetes.client.api import core_v1_api
 from kubernetes.client.rest import ApiException
 from kubernetes.stream import stream
+from kubernetes.stream.ws_client import STDERR_CHANNEL, STDOUT_CHANNEL
 
 from kubencbackup.common.backupconfig import BackupConfig
 from kubencbackup.common.backupexceptions import ApiInstancesConfigException, ApiInstancesHandlerException
 from kubencbackup.common.loggable import Loggable
 
+# The commands end up in the logs and in the exception messages: the passwords given on the command line are hidden
+PASSWORD_OPTION_REGEX=re.compile(r"(--password=)('[^']*'|\"[^\"]*\"|\S+)")
+
+def hide_passwords(command):
+    return PASSWORD_OPTION_REGEX.sub(r"\1********", command)
+
 ### Config ###
 class K8sApiInstanceConfigException(ApiInstancesConfigException):
     def __init__(self,message):
@@ -17,8 +33,11 @@ class K8sApiInstanceConfigException(ApiInstancesConfigException):
 
 
 class K8sApiInstanceConfig:
-    def __init__(self, namespace):
+    def __init__(self, namespace, exec_timeout=None, exec_max_output_bytes=None, exec_sessions=False):
         self.namespace=namespace
+        self.exec_timeout=exec_timeout
+        self.exec_max_output_bytes=exec_max_output_bytes
+        self.exec_sessions=exec_sessions
 
     ### namespace getter and setter ###
     @property
@@ -32,6 +51,50 @@ class K8sApiInstanceConfig:
         else:
             self.__namespace=namespace
     ### END ###
+
+    ### exec_timeout getter and setter ###
+    @property
+    def exec_timeout(self):
+        return self.__exec_timeout
+    
+    @exec_timeout.setter
+    def exec_timeout(self,exec_timeout):
+        if exec_timeout == None:
+            self.__exec_timeout = BackupConfig.DEFAULT_EXEC_TIMEOUT
+        else:
+            try:
+                self.__exec_timeout = int(exec_timeout)
+            except (ValueError,TypeError) as e:
+                raise K8sApiInstanceConfigException(message="exec_timeout must be a integer number")
+    ### END ###
+
+    ### exec_max_output_bytes getter and setter ###
+    @property
+    def exec_max_output_bytes(self):
+        return self.__exec_max_output_bytes
+    
+    @exec_max_output_bytes.setter
+    def exec_max_output_bytes(self,exec_max_output_bytes):
+        if exec_max_output_bytes == None:
+            self.__exec_max_output_bytes = BackupConfig.DEFAULT_EXEC_MAX_OUTPUT_BYTES
+        else:
+            try:
+                self.__exec_max_output_bytes = int(exec_max_output_bytes)
+            except (ValueError,TypeError) as e:
+                raise K8sApiInstanceConfigException(message="exec_max_output_bytes must be a integer number")
+    ### END ###
+
+    ### exec_sessions getter and setter ###
+    @property
+    def exec_sessions(self):
+        return self.__exec_sessions
+    
+    @exec_sessions.setter
+    def exec_sessions(self,exec_sessions):
+        if type(exec_sessions) != bool:
+            raise K8sApiInstanceConfigException(message="exec_sessions must be a boolean")
+        self.__exec_sessions=exec_sessions
+    ### END ###
         
 ### END - Config ###
 
@@ -40,6 +103,270 @@ class K8sApiInstanceHandlerException(ApiInstancesHandlerException):
     def __init__(self,message):
         super().__init__(message)
 
+def discard_ws_client_capture(ws_client):
+    # WSClient keeps a copy of the whole output for read_all(), which is never used here
+    if isinstance(getattr(ws_client, "_all", None), StringIO):
+        ws_client._all.seek(0)
+        ws_client._all.truncate()
+
+
+class K8sExecStream:
+    # WSClient.update() passes its timeout to poll() (milliseconds) on Linux and macOS and to select() (seconds) elsewhere
+    __POLL_TIMEOUT = 1000 if sys.platform.startswith('linux') or sys.platform == 'darwin' else 1
+
+    def __init__(self, ws_client, command, timeout=None, max_output_bytes=None):
+        self.__ws_client=ws_client
+        self.__command=command
+        # A None or 0 timeout or output size limit means no limit
+        self.__deadline=time.monotonic() + timeout if timeout else None
+        self.__max_output_bytes=max_output_bytes if max_output_bytes else None
+        self.__output_bytes=0
+        self.__returncode=None
+
+    ### output_bytes and returncode getters ###
+    @property
+    def output_bytes(self):
+        return self.__output_bytes
+
+    @property
+    def returncode(self):
+        # Available once the stream has been fully consumed
+        return self.__returncode
+    ### END ###
+
+    def __iter__(self):
+        # Yields ("stdout"|"stderr", data) tuples as soon as the chunks arrive
+        try:
+            while self.__ws_client.is_open():
+                if self.__deadline != None and time.monotonic() > self.__deadline:
+                    raise K8sApiInstanceHandlerException(message="The command " + hide_passwords(self.__command) + " timed out")
+
+                self.__ws_client.update(timeout=K8sExecStream.__POLL_TIMEOUT)
+                for chunk in self.__read_chunks():
+                    yield chunk
+
+            for chunk in self.__read_chunks():
+                yield chunk
+
+            try:
+                self.__returncode=self.__ws_client.returncode
+            except (TypeError,KeyError,IndexError,ValueError):
+                # The connection has been closed without any exit status
+                self.__returncode=None
+        finally:
+            self.close()
+
+    def __read_chunks(self):
+        chunks=[]
+        for channel, channel_name in [(STDOUT_CHANNEL, "stdout"), (STDERR_CHANNEL, "stderr")]:
+            data=self.__ws_client.read_channel(channel)
+            if data:
+                self.__output_bytes+=len(data.encode("utf-8"))
+                if self.__max_output_bytes != None and self.__output_bytes > self.__max_output_bytes:
+                    raise K8sApiInstanceHandlerException(message="The command " + hide_passwords(self.__command) + " exceeded the output size limit of " + str(self.__max_output_bytes) + " bytes")
+                chunks.append((channel_name, data))
+
+        discard_ws_client_capture(self.__ws_client)
+        return chunks
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        self.close()
+
+    def close(self):
+        try:
+            self.__ws_client.close()
+        except BaseException:
+            pass
+
+
+class K8sExecSessionStream:
+    # WSClient.update() passes its timeout to poll() (milliseconds) on Linux and macOS and to select() (seconds) elsewhere
+    __POLL_TIMEOUT = 1000 if sys.platform.startswith('linux') or sys.platform == 'darwin' else 1
+
+    def __init__(self, session, command, timeout=None, max_output_bytes=None):
+        self.__session=session
+        self.__command=command
+        self.__timeout=timeout
+        self.__max_output_bytes=max_output_bytes if max_output_bytes else None
+        self.__output_bytes=0
+        self.__returncode=None
+        self.__generator=None
+
+    ### output_bytes and returncode getters ###
+    @property
+    def output_bytes(self):
+        return self.__output_bytes
+
+    @property
+    def returncode(self):
+        # Available once the stream has been fully consumed
+        return self.__returncode
+    ### END ###
+
+    # The session is locked from the first chunk read until the stream is consumed or closed: the callers not
+    # consuming the whole stream must close it (or use it in a 'with' block), the other commands of the pod wait
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        self.close()
+
+    def close(self):
+        # Closing the generator runs its finally block, releasing the session lock
+        if self.__generator != None:
+            self.__generator.close()
+
+    def __iter__(self):
+        self.__generator=self.__run()
+        return self.__generator
+
+    def __run(self):
+        # Yields ("stdout"|"stderr", data) tuples as soon as the chunks arrive. Each command is run in its own
+        # bash process of the session shell. When it ends, the shell prints a marker followed by the exit code on
+        # stdout and the same marker on stderr, so that the end of both the channels can be found
+        marker="__KNCB_" + uuid.uuid4().hex + "__"
+        ws_client=self.__session.ws_client
+        deadline=time.monotonic() + self.__timeout if self.__timeout else None
+
+        self.__session.lock.acquire()
+        completed=False
+        try:
+            ws_client.write_stdin(
+                "/bin/bash -c " + shlex.quote(self.__command) + " < /dev/null; " +
+                "echo \"" + marker + " $?\"; echo \"" + marker + "\" 1>&2\n")
+
+            pending={"stdout": "", "stderr": ""}
+            ended={"stdout": False, "stderr": False}
+            while not (ended["stdout"] and ended["stderr"]):
+                if deadline != None and time.monotonic() > deadline:
+                    raise K8sApiInstanceHandlerException(message="The command " + hide_passwords(self.__command) + " timed out")
+                if not ws_client.is_open():
+                    raise K8sApiInstanceHandlerException(message="The exec session has been closed while running the command " + hide_passwords(self.__command))
+
+                ws_client.update(timeout=K8sExecSessionStream.__POLL_TIMEOUT)
+                for channel, channel_name in [(STDOUT_CHANNEL, "stdout"), (STDERR_CHANNEL, "stderr")]:
+                    pending[channel_name]+=ws_client.read_channel(channel)
+                    if ended[channel_name] or pending[channel_name] == "":
+                        continue
+
+                    index=pending[channel_name].find(marker)
+                    if index < 0:
+                        # Keep back the tail that might be the beginning of a split marker
+                        safe_length=max(0, len(pending[channel_name]) - len(marker) + 1)
+                        data=pending[channel_name][:safe_length]
+                        pending[channel_name]=pending[channel_name][safe_length:]
+                    else:
+                        trailer=pending[channel_name][index + len(marker):]
+                        if channel_name == "stdout":
+                            # Wait for the whole exit code line
+                            if "\n" not in trailer:
+                                continue
+                            self.__returncode=int(trailer.split("\n")[0].strip())
+                        data=pending[channel_name][:index]
+                        pending[channel_name]=""
+                        ended[channel_name]=True
+
+                    if data != "":
+                        self.__output_bytes+=len(data.encode("utf-8"))
+                        if self.__max_output_bytes != None and self.__output_bytes > self.__max_output_bytes:
+                            raise K8sApiInstanceHandlerException(message="The command " + hide_passwords(self.__command) + " exceeded the output size limit of " + str(self.__max_output_bytes) + " bytes")
+                        yield channel_name, data
+                discard_ws_client_capture(ws_client)
+            completed=True
+        finally:
+            # A command not run to the end leaves the shell in an unknown state: the session cannot be reused
+            if not completed:
+                self.__session.close()
+            self.__session.lock.release()
+
+
+class K8sBinaryExecStream:
+    # The exec websocket carries text frames, decoded one by one by the kubernetes client: a multi-byte character
+    # split across two frames would be silently replaced. The command stdout is then base64 encoded in the pod and
+    # decoded here, yielding ("stdout", bytes) and ("stderr", str) tuples
+    def __init__(self, stream):
+        self.__stream=stream
+
+    ### output_bytes and returncode getters ###
+    @property
+    def output_bytes(self):
+        return self.__stream.output_bytes
+
+    @property
+    def returncode(self):
+        return self.__stream.returncode
+    ### END ###
+
+    @staticmethod
+    def wrap_command(command):
+        # pipefail keeps the exit code of the command instead of the base64 one
+        return "set -o pipefail; (" + command + ") | base64"
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        self.close()
+
+    def close(self):
+        self.__stream.close()
+
+    def __iter__(self):
+        pending=""
+        try:
+            for channel, data in self.__stream:
+                if channel != "stdout":
+                    yield channel, data
+                    continue
+                pending+="".join(data.split())
+                # Just the complete 4 characters groups can be decoded
+                length=len(pending) - len(pending) % 4
+                if length > 0:
+                    yield channel, binascii.a2b_base64(pending[:length])
+                    pending=pending[length:]
+            if pending != "":
+                yield "stdout", binascii.a2b_base64(pending)
+        except binascii.Error as e:
+            raise K8sApiInstanceHandlerException(message="Unable to decode the command output. The error message is:\n" + str(e))
+
+
+class K8sExecSession:
+    # A shell kept open in a pod to run several commands over the same exec websocket
+    def __init__(self, ws_client, pod_name):
+        self.__ws_client=ws_client
+        self.__pod_name=pod_name
+        self.__lock=RLock()
+
+    ### ws_client, pod_name and lock getters ###
+    @property
+    def ws_client(self):
+        return self.__ws_client
+
+    @property
+    def pod_name(self):
+        return self.__pod_name
+
+    @property
+    def lock(self):
+        return self.__lock
+    ### END ###
+
+    def is_open(self):
+        return self.__ws_client.is_open()
+
+    def run(self, command, timeout=None, max_output_bytes=None):
+        return K8sExecSessionStream(session=self, command=command, timeout=timeout, max_output_bytes=max_output_bytes)
+
+    def close(self):
+        try:
+            self.__ws_client.close()
+        except BaseException:
+            pass
+
+
 class K8sApiInstanceHandler(Loggable):
     def __init__(self,conf):
         super().__init__(name="KUBERNETES-API", log_level=2)
@@ -56,6 +383,16 @@ class K8sApiInstanceHandler(Loggable):
                 self.__in_cluster_mode = False
         except:
             self.__in_cluster_mode = True
+
+        # Run-scoped lookups cache, filled during the warm-up stage
+        self.__pv_names = None
+        # Reentrant: the cache is reloaded by get_pv_name_from_pvc_name while holding it
+        self.__pv_names_lock = RLock()
+        self.__pv_names_cache_hits = 0
+        self.__pv_names_cache_misses = 0
+        self.__running_pods = {}
+        self.__exec_sessions = {}
+        self.__exec_sessions_lock = Lock()
             
     def __enter__(self):
         self.log_info(msg="Initializing Kubernetes API...")
@@ -92,8 +429,14 @@ class K8sApiInstanceHandler(Loggable):
         self.free_resources()
 
     def free_resources(self):
+        try:
+            self.close_exec_sessions()
+        except (AttributeError,NameError):
+            pass
+
         try:
             del(self.k8s_api_instance)
+            self.log_info(msg="PV names cache statistics: " + str(self.pv_names_cache_hits) + " hits, " + str(self.pv_names_cache_misses) + " misses")
             self.log_info(msg="Kubernetes API resources succesfully cleaned up")
         except (AttributeError,NameError):
             pass
@@ -133,6 +476,16 @@ class K8sApiInstanceHandler(Loggable):
         return self.__in_cluster_mode
     ### END ###
 
+    ### pv_names_cache_hits and pv_names_cache_misses getters ###
+    @property
+    def pv_names_cache_hits(self):
+        return self.__pv_names_cache_hits
+
+    @property
+    def pv_names_cache_misses(self):
+        return self.__pv_names_cache_misses
+    ### END ###
+
     ### Methods implementation ###
     def get_pod_by_label(self, label):
         resp = None
@@ -152,40 +505,149 @@ class K8sApiInstanceHandler(Loggable):
         else:
             return resp.items.pop()
     
-    def get_pv_name_from_pvc_name(self,pvc_name):
+    def load_pv_names_cache(self):
+        # Resolve all the PVCs of the namespace with a single API call. The lock is held while loading, so that the
+        # concurrent lookups wait for the new cache instead of loading it again
+        with self.__pv_names_lock:
+            self.__load_pv_names_cache()
+
+    def __load_pv_names_cache(self):
         try:
-            self.log_info("Retrieving the PV by PVC name " + pvc_name)
-            pvc=self.k8s_api_instance.read_namespaced_persistent_volume_claim(namespace=self.conf.namespace, name=pvc_name)
+            self.log_info("Retrieving the PV names of all the PVCs in the namespace " + self.conf.namespace)
+            pvcs=self.k8s_api_instance.list_namespaced_persistent_volume_claim(namespace=self.conf.namespace)
         except BaseException:
+            self.log_err(err="Error retrieving the PVCs of the namespace " + self.conf.namespace)
+            raise K8sApiInstanceHandlerException(message="Error retrieving the Persistent Volume Claims of the namespace " + self.conf.namespace)
+
+        pv_names={}
+        for pvc in pvcs.items:
+            # Skip the PVCs not bound to any PV yet
+            if pvc.spec.volume_name != None:
+                pv_names[pvc.metadata.name]=pvc.spec.volume_name
+        self.__pv_names=pv_names
+
+    def get_pv_name_from_pvc_name(self,pvc_name):
+        with self.__pv_names_lock:
+            if self.__pv_names != None and pvc_name in self.__pv_names:
+                self.__pv_names_cache_hits+=1
+            else:
+                # Reload the whole cache just once per miss, then the PVC must be there. A PVC still missing or
+                # unbound is looked up again by the next call, so no explicit invalidation is needed
+                self.__pv_names_cache_misses+=1
+                self.load_pv_names_cache()
+            pv_name=self.__pv_names.get(pvc_name)
+
+        if pv_name == None:
             self.log_err(err="Error retrieving PV name by PVC name "+ pvc_name)
-            raise K8sApiInstanceHandlerException(message="Error retrieving Persistent Volume name from Persistent Volume Claim "+ pvc_name)
-        return pvc.spec.volume_name
+            raise K8sApiInstanceHandlerException(message="Error retrieving Persistent Volume name from Persistent Volume Claim "+ pvc_name + ". The PVC doesn't exist or it is not bound")
+        return pv_name
+
+    def get_running_pod_by_label(self, label):
+        if label in self.__running_pods:
+            return self.__running_pods[label]
 
-    def exec_container_command(self, pod_label, command):
         # Retrieving the pod and checking that is in "Running" state
         self.log_info(msg="Retrieving the pod and checking it is in Running state....")
-        pod = self.get_pod_by_label(label=pod_label)
+        pod = self.get_pod_by_label(label=label)
         if pod.status.phase != 'Running':
-            self.log_err(err="The pod with label " + pod_label + " is not in 'Running' state.")
-            raise K8sApiInstanceHandlerException(message="The pod with label " + pod_label + " is not in 'Running' state.")
+            self.log_err(err="The pod with label " + label + " is not in 'Running' state.")
+            raise K8sApiInstanceHandlerException(message="The pod with label " + label + " is not in 'Running' state.")
+        self.__running_pods[label]=pod
+        return pod
+
+    def open_exec_session(self, pod_label):
+        with self.__exec_sessions_lock:
+            session = self.__exec_sessions.get(pod_label)
+            if session != None and session.is_open():
+                return session
+
+            # Retrieving the pod (already checked to be in "Running" state)
+            pod = self.get_running_pod_by_label(label=pod_label)
+
+            self.log_info(msg="Opening an exec session inside the pod " + pod.metadata.name + "...")
+            try:
+                ws_client = stream(self.k8s_api_instance.connect_get_namespaced_pod_exec,
+                            pod.metadata.name,
+                            namespace=self.conf.namespace,
+                            command=['/bin/bash'],
+                            stderr=True, stdin=True,
+                            stdout=True, tty=False,
+                            _preload_content=False)
+            except BaseException as e:
+                self.log_err(err="Unable to open an exec session inside the pod " + pod.metadata.name)
+                raise K8sApiInstanceHandlerException(message="Unable to open an exec session inside the pod " + pod.metadata.name + ". The call returned this message:\n" + str(e))
+
+            session = K8sExecSession(ws_client=ws_client, pod_name=pod.metadata.name)
+            self.__exec_sessions[pod_label] = session
+            self.log_info(msg="DONE. Exec session successfully opened")
+            return session
+
+    def close_exec_sessions(self):
+        with self.__exec_sessions_lock:
+            for session in self.__exec_sessions.values():
+                session.close()
+            self.__exec_sessions = {}
+
+    def exec_container_command_stream(self, pod_label, command, timeout=None, max_output_bytes=None, binary_stdout=False):
+        # The returned stream has to be either fully consumed or closed: use it in a 'with' block
+        # With binary_stdout the command output is yielded as bytes, safe whatever its content
+        if binary_stdout:
+            return K8sBinaryExecStream(stream=self.exec_container_command_stream(
+                pod_label=pod_label, command=K8sBinaryExecStream.wrap_command(command), timeout=timeout, max_output_bytes=max_output_bytes))
+
+        timeout = self.conf.exec_timeout if timeout == None else timeout
+        max_output_bytes = self.conf.exec_max_output_bytes if max_output_bytes == None else max_output_bytes
+
+        # Run the command over the shell already open in the pod, if the sessions are enabled
+        if self.conf.exec_sessions:
+            session = self.open_exec_session(pod_label=pod_label)
+            self.log_info(msg="DONE. Executing the command inside the pod through the exec session...")
+            return session.run(command=command, timeout=timeout, max_output_bytes=max_output_bytes)
+
+        # Retrieving the pod (already checked to be in "Running" state)
+        pod = self.get_running_pod_by_label(label=pod_label)
         
         # Creating exec command
         exec_command = ['/bin/bash', '-c', command]
 
         self.log_info(msg="DONE. Executing the command inside the pod...")
-        # Calling exec and waiting for response
+        # Opening the exec websocket without waiting for the command to end
         try: 
-            resp = stream(self.k8s_api_instance.connect_get_namespaced_pod_exec,
+            ws_client = stream(self.k8s_api_instance.connect_get_namespaced_pod_exec,
                         pod.metadata.name,
                         namespace=self.conf.namespace,
                         command=exec_command,
                         stderr=True, stdin=False,
-                        stdout=True, tty=False)
+                        stdout=True, tty=False,
+                        _preload_content=False)
+        except BaseException as e:
+            self.log_err(err="Unable to execute the command " + hide_passwords(command))
+            raise K8sApiInstanceHandlerException(message="Unable to execute the command " + hide_passwords(command) +  ". The call returned this message:\n" + str(e))
+
+        return K8sExecStream(
+            ws_client=ws_client,
+            command=command,
+            timeout=timeout,
+            max_output_bytes=max_output_bytes)
+
+    def exec_container_command(self, pod_label, command, timeout=None):
+        # Returns stdout and stderr combined, as they arrived. A command exiting with a non-zero code is a failure
+        resp = []
+        try:
+            with self.exec_container_command_stream(pod_label=pod_label, command=command, timeout=timeout) as command_stream:
+                for channel, data in command_stream:
+                    resp.append(data)
+        except K8sApiInstanceHandlerException as e:
+            self.log_err(err="Unable to execute the command " + hide_passwords(command))
+            raise
         except BaseException as e:
-            self.log_err(err="Unable to execute the command " + command )
-            raise K8sApiInstanceHandlerException(message="Unable to execute the command " + command +  ". The call returned this message:\n" + e)
+            self.log_err(err="Unable to execute the command " + hide_passwords(command))
+            raise K8sApiInstanceHandlerException(message="Unable to execute the command " + hide_passwords(command) +  ". The call returned this message:\n" + str(e))
+        if command_stream.returncode != 0:
+            self.log_err(err="The command " + hide_passwords(command) + " exited with code " + str(command_stream.returncode))
+            raise K8sApiInstanceHandlerException(message="The command " + hide_passwords(command) + " exited with code " + str(command_stream.returncode) + ". Its output was:\n" + hide_passwords("".join(resp)))
         self.log_info(msg="Done. Command successfully executed")
-        return resp
+        return "".join(resp)
     ### END - Methods implementation ###
 
 ### END - Handler ###
@@ -1,10 +1,19 @@
+import hashlib
+import os
+import time
+
+from threading import Barrier, Lock
+
 from dateutil.parser import parse as dateutil_parse
+from requests.adapters import HTTPAdapter
 
 import kubencbackup.extlib.longhornlib as longhornlib
 
 from kubencbackup.common.backupconfig import BackupConfig
 from kubencbackup.common.backupexceptions import ApiInstancesConfigException, ApiInstancesHandlerException
 from kubencbackup.common.loggable import Loggable
+from kubencbackup.common.retention import select_over_retention, select_over_size_budget
+from kubencbackup.common.workerpool import WorkerPool, WorkerPoolException
 
 
 ### Config ###
@@ -14,10 +23,19 @@ class LonghornApiInstanceConfigException(ApiInstancesConfigException):
 
 
 class LonghornApiInstanceConfig:
-    def __init__(self, longhorn_url, nr_snapshots_to_retain, nr_backups_to_retain):
+    def __init__(self, longhorn_url, nr_snapshots_to_retain, nr_backups_to_retain, max_workers=None, backup_stall_timeout=None,
+            snapshots_retention_tiers=None, backups_retention_tiers=None, snapshots_size_budget=None,
+            schema_cache_path=None, schema_refresh=None):
         self.longhorn_url=longhorn_url
         self.nr_snapshots_to_retain=nr_snapshots_to_retain
         self.nr_backups_to_retain=nr_backups_to_retain
+        self.max_workers=max_workers
+        self.backup_stall_timeout=backup_stall_timeout
+        self.snapshots_retention_tiers=snapshots_retention_tiers
+        self.backups_retention_tiers=backups_retention_tiers
+        self.snapshots_size_budget=snapshots_size_budget
+        self.schema_cache_path=schema_cache_path
+        self.schema_refresh=schema_refresh
 
     ### longhorn_url getter and setter ###
     @property
@@ -63,14 +81,182 @@ class LonghornApiInstanceConfig:
                 raise LonghornApiInstanceConfigException(message="nr_backups_to_retain must be a integer number")
     ### END ###
 
+    ### max_workers getter and setter ###
+    @property
+    def max_workers(self):
+        return self.__max_workers
+    
+    @max_workers.setter
+    def max_workers(self,max_workers):
+        if max_workers == None:
+            self.__max_workers = BackupConfig.DEFAULT_LONGHORN_MAX_WORKERS
+        else:
+            try:
+                self.__max_workers = int(max_workers)
+            except (ValueError,TypeError) as e:
+                raise LonghornApiInstanceConfigException(message="max_workers must be a integer number")
+            if self.__max_workers < 1:
+                raise LonghornApiInstanceConfigException(message="max_workers must be greater than 0")
+    ### END ###
+
+    ### backup_stall_timeout getter and setter ###
+    @property
+    def backup_stall_timeout(self):
+        return self.__backup_stall_timeout
+    
+    @backup_stall_timeout.setter
+    def backup_stall_timeout(self,backup_stall_timeout):
+        if backup_stall_timeout == None:
+            self.__backup_stall_timeout = BackupConfig.DEFAULT_LONGHORN_BACKUP_STALL_TIMEOUT
+        else:
+            try:
+                self.__backup_stall_timeout = int(backup_stall_timeout)
+            except (ValueError,TypeError) as e:
+                raise LonghornApiInstanceConfigException(message="backup_stall_timeout must be a integer number")
+    ### END ###
+
+    ### snapshots_retention_tiers getter and setter ###
+    @property
+    def snapshots_retention_tiers(self):
+        return self.__snapshots_retention_tiers
+    
+    @snapshots_retention_tiers.setter
+    def snapshots_retention_tiers(self,snapshots_retention_tiers):
+        self.__snapshots_retention_tiers=LonghornApiInstanceConfig.__check_retention_tiers(name="snapshots_retention_tiers", tiers=snapshots_retention_tiers)
+    ### END ###
+
+    ### backups_retention_tiers getter and setter ###
+    @property
+    def backups_retention_tiers(self):
+        return self.__backups_retention_tiers
+    
+    @backups_retention_tiers.setter
+    def backups_retention_tiers(self,backups_retention_tiers):
+        self.__backups_retention_tiers=LonghornApiInstanceConfig.__check_retention_tiers(name="backups_retention_tiers", tiers=backups_retention_tiers)
+    ### END ###
+
+    ### snapshots_size_budget getter and setter ###
+    @property
+    def snapshots_size_budget(self):
+        return self.__snapshots_size_budget
+    
+    @snapshots_size_budget.setter
+    def snapshots_size_budget(self,snapshots_size_budget):
+        # Optional maximum size in bytes of the snapshots chain of each volume
+        if snapshots_size_budget == None:
+            self.__snapshots_size_budget = None
+        else:
+            try:
+                self.__snapshots_size_budget = int(snapshots_size_budget)
+            except (ValueError,TypeError) as e:
+                raise LonghornApiInstanceConfigException(message="snapshots_size_budget must be a integer number")
+            if self.__snapshots_size_budget <= 0:
+                raise LonghornApiInstanceConfigException(message="snapshots_size_budget must be greater than 0")
+    ### END ###
+
+    ### schema_cache_path getter and setter ###
+    @property
+    def schema_cache_path(self):
+        return self.__schema_cache_path
+    
+    @schema_cache_path.setter
+    def schema_cache_path(self,schema_cache_path):
+        # Optional directory where the API schema is cached between the runs
+        self.__schema_cache_path=schema_cache_path
+    ### END ###
+
+    ### schema_refresh getter and setter ###
+    @property
+    def schema_refresh(self):
+        return self.__schema_refresh
+    
+    @schema_refresh.setter
+    def schema_refresh(self,schema_refresh):
+        if schema_refresh == None:
+            self.__schema_refresh = BackupConfig.DEFAULT_LONGHORN_SCHEMA_REFRESH
+        elif schema_refresh not in ['ENABLED', 'DISABLED']:
+            raise LonghornApiInstanceConfigException(message="schema_refresh must be either ENABLED or DISABLED")
+        else:
+            self.__schema_refresh=schema_refresh
+    ### END ###
+
+    @staticmethod
+    def __check_retention_tiers(name, tiers):
+        # Optional dictionary {tier: number of periods to keep an item for}, on top of the last items retained
+        if tiers == None:
+            return {}
+        try:
+            tiers={tier: int(count) for tier, count in tiers.items()}
+        except (ValueError,TypeError,AttributeError) as e:
+            raise LonghornApiInstanceConfigException(message=name + " must be a dictionary {tier: integer number}")
+        for tier in tiers:
+            if tier not in BackupConfig.RETENTION_TIERS:
+                raise LonghornApiInstanceConfigException(message=name + " tiers must be one of " + ", ".join(BackupConfig.RETENTION_TIERS))
+        return tiers
+
 ### END - Config ###
 
+### Client ###
+class LonghornClient(longhornlib.Client):
+    # Longhorn client keeping a pool of keep-alive connections for the whole run and caching the API schema on disk.
+    # The cache is keyed by the Longhorn URL and expires after a day, so that a Longhorn upgrade is picked up without
+    # asking the server for its version at every run. A cached schema missing the types used here is downloaded again.
+    # The cache overrides or relies on these internal methods of the longhornlib revision pinned in the Dockerfile:
+    # they are checked before use, so that a library upgrade changing them fails clearly instead of silently not caching
+    __SCHEMA_CACHE_TIME=24 * 60 * 60
+    __REQUIRED_TYPES=["volume", "backupVolume"]
+    __LIBRARY_HOOKS=["_get_cached_schema", "_get_cached_schema_file_name", "_cache_schema", "reload_schema"]
+
+    def __init__(self, url, pool_size, schema_cache_path=None, schema_refresh=False):
+        missing_hooks=[hook for hook in LonghornClient.__LIBRARY_HOOKS if not callable(getattr(longhornlib.Client, hook, None))]
+        if len(missing_hooks) > 0:
+            raise LonghornApiInstanceHandlerException(message="Unsupported longhornlib revision, missing: " + ", ".join(missing_hooks))
+
+        self.__schema_cache_path=schema_cache_path
+        self.__schema_downloaded=False
+        # With the cache disabled the library doesn't read the cached schema, but it is still written by _cache_schema
+        super().__init__(url=url, cache=(schema_cache_path != None and not schema_refresh), cache_time=LonghornClient.__SCHEMA_CACHE_TIME)
+
+        # A schema cached before a Longhorn upgrade can lack some types: it is replaced by the current one
+        if not self.__schema_downloaded and (self.schema == None or any(schema_type not in self.schema.types for schema_type in LonghornClient.__REQUIRED_TYPES)):
+            self.reload_schema()
+
+        # Mounted once the schema is loaded, the pool is used by all the calls that follow
+        adapter=HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+
+    def _get_cached_schema_file_name(self):
+        if self.__schema_cache_path == None:
+            return None
+        os.makedirs(self.__schema_cache_path, exist_ok=True)
+        return os.path.join(self.__schema_cache_path, "longhorn-schema-" + hashlib.sha256(self._url.encode()).hexdigest()[:12] + ".json")
+
+    def _cache_schema(self, text):
+        # Called by the library with every downloaded schema. Written to a temporary file first, so that a concurrent
+        # run never reads a truncated schema
+        self.__schema_downloaded=True
+        cached_schema=self._get_cached_schema_file_name()
+        if cached_schema == None:
+            return
+        with open(cached_schema + ".part", "w") as schema_file:
+            schema_file.write(text)
+        os.replace(cached_schema + ".part", cached_schema)
+
+    def close(self):
+        self._session.close()
+### END - Client ###
+
 ### Handler ###
 class LonghornApiInstanceHandlerException(ApiInstancesHandlerException):
     def __init__(self,message):
         super().__init__(message)
 
 class LonghornApiInstanceHandler(Loggable):
+    # Backups status polling interval, doubled at every poll up to the max
+    __BACKUP_POLL_MIN_INTERVAL=1
+    __BACKUP_POLL_MAX_INTERVAL=30
+
     def __init__(self, config):
         super().__init__(name="LONGHORN-API##", log_level=2)
 
@@ -79,17 +265,31 @@ class LonghornApiInstanceHandler(Loggable):
             raise LonghornApiInstanceHandlerException(message="config must be of type LonghornApiInstanceConfig")
         self.config=config
 
+        # Run-scoped volumes cache, filled during the warm-up stage
+        self.__volumes={}
+        # Run-scoped snapshots cache: {volume name: {snapshot name: snapshot}}. The volumes whose full listing has
+        # been downloaded are tracked apart, since the snapshots created during the run are indexed directly
+        self.__snapshots={}
+        self.__listed_snapshots_volumes=set()
+        self.__snapshots_lock=Lock()
+
     def __enter__(self):
         try:
             self.log_info(msg="Initializing Longhorn API...")
 
-            self.client = longhornlib.Client(url=self.config.longhorn_url)
+            init_start=time.monotonic()
+            self.client = LonghornClient(
+                url=self.config.longhorn_url,
+                pool_size=self.config.max_workers,
+                schema_cache_path=self.config.schema_cache_path,
+                schema_refresh=(self.config.schema_refresh == "ENABLED")
+            )
 
-            self.log_info(msg="DONE. Longhorn API successfully initialized.")
+            self.log_info(msg="DONE. Longhorn API successfully initialized in " + "{:.3f}".format(time.monotonic() - init_start) + "s")
         except BaseException as e:
             self.log_err(err="Unable to create the Longhorn API client instance.")
             self.free_resources()
-            raise LonghornApiInstanceHandlerException(message="Error creating Longhorn API client instance. The error message is:\n" + e)
+            raise LonghornApiInstanceHandlerException(message="Error creating Longhorn API client instance. The error message is:\n" + str(e))
 
         return self
 
@@ -102,6 +302,7 @@ class LonghornApiInstanceHandler(Loggable):
 
     def free_resources(self):
         try:
+            self.client.close()
             del(self.client)
             self.log_info(msg="Longhorn API resources successfully cleaned up")
         except (AttributeError,NameError):
@@ -139,41 +340,137 @@ class LonghornApiInstanceHandler(Loggable):
     ### END ###
 
     ### Methods implementation ###
-    def create_volume_snapshot(self, snapshot_name, pv_name):
+    def get_volume(self, pv_name):
+        if pv_name in self.__volumes:
+            return self.__volumes[pv_name]
+
+        self.log_info(msg="Retrieving the volume " + pv_name + "...")
+        volume = self.client.by_id_volume(id=pv_name)
+        if volume == None:
+            self.log_err(err="Cannot find volume named " + pv_name)
+            raise LonghornApiInstanceHandlerException(message="Cannot find volume "+ pv_name)
+        self.__volumes[pv_name]=volume
+        return volume
+
+    def get_snapshots(self, pv_name):
+        with self.__snapshots_lock:
+            if pv_name in self.__listed_snapshots_volumes:
+                return dict(self.__snapshots[pv_name])
+
+        # Download the snapshots listing just once per run
+        self.log_info(msg="Retrieving the snapshots list for the volume " + pv_name + "...")
+        try:
+            snaps=self.get_volume(pv_name=pv_name).snapshotList().data
+        except LonghornApiInstanceHandlerException:
+            raise
+        except BaseException as e:
+            self.log_err(err="Cannot find the snapshot list for the volume " + pv_name + ". Unable to continue")
+            raise LonghornApiInstanceHandlerException(message="Cannot find the snapshot list for the volume " + pv_name + ". The error message is:\n" + str(e))
+
+        with self.__snapshots_lock:
+            snapshots=self.__snapshots.setdefault(pv_name, {})
+            for snap in snaps:
+                snapshots[snap.name]=snap
+            self.__listed_snapshots_volumes.add(pv_name)
+            return dict(snapshots)
+
+    def has_snapshot(self, pv_name, snapshot_name):
+        with self.__snapshots_lock:
+            if snapshot_name in self.__snapshots.get(pv_name, {}):
+                return True
+        return snapshot_name in self.get_snapshots(pv_name=pv_name)
+
+    def __index_snapshot(self, pv_name, snapshot_name, snapshot):
+        with self.__snapshots_lock:
+            self.__snapshots.setdefault(pv_name, {})[snapshot_name]=snapshot
+
+    def __unindex_snapshot(self, pv_name, snapshot_name):
+        with self.__snapshots_lock:
+            self.__snapshots.get(pv_name, {}).pop(snapshot_name, None)
+
+    def invalidate_cache(self):
+        with self.__snapshots_lock:
+            self.__volumes={}
+            self.__snapshots={}
+            self.__listed_snapshots_volumes=set()
+
+    def check_volume_health(self, pv_name):
+        self.log_info(msg="Checking the volume " + pv_name + " health...")
+        try:
+            volume = self.get_volume(pv_name=pv_name)
+        except LonghornApiInstanceHandlerException:
+            raise
+        except BaseException as e:
+            self.log_err(err="Unable to retrieve the volume " + pv_name)
+            raise LonghornApiInstanceHandlerException(message="Unable to retrieve the volume " + pv_name + ". The error message is:\n" + str(e))
+
+        # A snapshot can be taken only on an attached volume having at least one working replica
+        if volume.state != "attached":
+            self.log_err(err="The volume " + pv_name + " is not attached. Its state is '" + str(volume.state) + "'")
+            raise LonghornApiInstanceHandlerException(message="The volume " + pv_name + " is not attached. Its state is '" + str(volume.state) + "'")
+        if volume.robustness == "faulted":
+            self.log_err(err="The volume " + pv_name + " is faulted")
+            raise LonghornApiInstanceHandlerException(message="The volume " + pv_name + " is faulted")
+        if volume.robustness != "healthy":
+            self.log_info(msg="WARNING: the volume " + pv_name + " robustness is '" + str(volume.robustness) + "'")
+
+        self.log_info(msg="DONE. Volume " + pv_name + " is ready to be snapshotted")
+
+    def create_volume_snapshot(self, snapshot_name, pv_name, start_barrier=None):
         self.log_info(msg="Creating the "+ pv_name + " volume snapshot...")
         try:
-            # Retrieve the volume to snapshot
-            self.log_info(msg="Retrieving the volume to snapshot...")
-            volume = self.client.by_id_volume(id=pv_name)
-            if volume == None:
-                self.log_err(err="Cannot find volume named " + pv_name)
-                raise LonghornApiInstanceHandlerException(message="Cannot find volume "+ pv_name)
+            # Retrieve the volume to snapshot (already retrieved if the warm-up stage has been done)
+            volume = self.get_volume(pv_name=pv_name)
+
+            # Wait for the other concurrent snapshots to be ready to be sent, if any
+            if start_barrier != None:
+                start_barrier.wait()
 
             # Create the snapshot
             self.log_info(msg="DONE. Creating the snapshot...")
-            volume.snapshotCreate(name=snapshot_name)
+            snapshot=volume.snapshotCreate(name=snapshot_name)
+            self.__index_snapshot(pv_name=pv_name, snapshot_name=snapshot_name, snapshot=snapshot)
             self.log_info(msg="DONE. Snapshot named " + snapshot_name + " for " + pv_name + " volume successfully created")
 
         except BaseException as e:
+            # Release the other concurrent snapshots waiting for this one, so that they fail fast
+            if start_barrier != None:
+                start_barrier.abort()
             self.log_err(err="Unable to create the snapshot for the volume " + pv_name)
-            raise LonghornApiInstanceHandlerException(message="Unable to create the snapshot for the volume " + pv_name +". The error message is:\n" + e)
+            raise LonghornApiInstanceHandlerException(message="Unable to create the snapshot for the volume " + pv_name +". The error message is:\n" + str(e))
+
+    def create_volume_snapshots(self, snapshot_name, pv_names):
+        self.log_info(msg="Creating the snapshot " + snapshot_name + " for the volumes " + ", ".join(pv_names) + " concurrently...")
+
+        # The snapshot requests are released all together only when every volume has been retrieved. The barrier is
+        # used only when the pool can run all the workers at the same time, otherwise it would never be released
+        start_barrier=None
+        if len(pv_names) <= self.config.max_workers:
+            start_barrier=Barrier(len(pv_names), timeout=60)
+
+        functions={}
+        for pv_name in pv_names:
+            functions[pv_name]=(lambda pv_name=pv_name: self.create_volume_snapshot(snapshot_name=snapshot_name, pv_name=pv_name, start_barrier=start_barrier))
+
+        try:
+            tasks=WorkerPool(max_workers=self.config.max_workers).run(functions)
+        except WorkerPoolException as e:
+            self.log_err(err="Unable to create the snapshot " + snapshot_name + " for all the volumes")
+            raise LonghornApiInstanceHandlerException(message="Unable to create the snapshot " + snapshot_name + " for all the volumes. The workers returned the following issues:\n" + e.message)
+
+        self.log_info(msg="DONE. Snapshot " + snapshot_name + " successfully created for all the volumes. Time spread between the first and the last snapshot: " + "{:.3f}".format(WorkerPool.spread(tasks)) + "s")
+        return tasks
 
     def create_volume_backup(self, snapshot_name, pv_name):
         self.log_info(msg="Creating the "+ pv_name + " volume backup from snapshot " + snapshot_name + "...")
         try:
             # Retrieve the volume to backup
-            self.log_info(msg="Retrieving the volume to backup...")
-            volume = self.client.by_id_volume(id=pv_name)
-            if volume == None:
-                self.log_err(err="Cannot find volume named " + pv_name)
-                raise LonghornApiInstanceHandlerException(message="Cannot find volume "+ pv_name)
+            volume = self.get_volume(pv_name=pv_name)
 
-            # Check the snapshot existence
+            # Check the snapshot existence. The snapshots created during the run are already indexed
             self.log_info(msg="Checking the snapshot " + snapshot_name + " existence...")
-            for snap in volume.snapshotList().data:
-                if snap.name == snapshot_name:
-                    self.log_info(msg="DONE. Snapshot " + snapshot_name + " successfully found")
-                    break
+            if self.has_snapshot(pv_name=pv_name, snapshot_name=snapshot_name):
+                self.log_info(msg="DONE. Snapshot " + snapshot_name + " successfully found")
             else:
                 self.log_err(err="Unable to find the snapshot named " + snapshot_name +". The backup cannot be done")
                 raise LonghornApiInstanceHandlerException(message="Unable to find the snapshot named " + snapshot_name +". The backup cannot be done.")
@@ -184,9 +481,103 @@ class LonghornApiInstanceHandler(Loggable):
             self.log_info(msg="DONE. Backup from snapshot " + snapshot_name + " for " + pv_name + " volume successfully created")
         except BaseException as e:
             self.log_err(err="Unable to create the backup for the volume " + pv_name)
-            raise LonghornApiInstanceHandlerException(message="Unable to create the backup for the volume " + pv_name +". The error message is:\n" + e)
+            raise LonghornApiInstanceHandlerException(message="Unable to create the backup for the volume " + pv_name +". The error message is:\n" + str(e))
     
 
+    def get_backup_status(self, pv_name, snapshot_name):
+        # Always downloaded again, the cached volume would hold an old status
+        volume = self.client.by_id_volume(id=pv_name)
+        if volume == None:
+            raise LonghornApiInstanceHandlerException(message="Cannot find volume "+ pv_name)
+        for status in (volume.backupStatus or []):
+            if status.snapshot == snapshot_name:
+                return status
+        return None
+
+    def wait_for_volume_backups(self, backups):
+        # backups is a dictionary {volume name: snapshot name}. All the backups are polled in the same loop
+        self.log_info(msg="Waiting for the backups of the volumes " + ", ".join(backups) + " to complete...")
+        started_at=time.monotonic()
+        pending={pv_name: {"snapshot": snapshot_name, "progress": 0, "changed_at": started_at} for pv_name, snapshot_name in backups.items()}
+        results={}
+        failures={}
+        interval=LonghornApiInstanceHandler.__BACKUP_POLL_MIN_INTERVAL
+
+        while len(pending) > 0:
+            now=time.monotonic()
+            for pv_name, backup in list(pending.items()):
+                try:
+                    status=self.get_backup_status(pv_name=pv_name, snapshot_name=backup["snapshot"])
+                except BaseException as e:
+                    failures[pv_name]="unable to retrieve the backup status: " + str(e)
+                    del pending[pv_name]
+                    continue
+
+                # The status shows up only once the backup has been started by Longhorn
+                progress=int(status.progress) if status != None and status.progress != None else 0
+                if status != None and status.error not in [None, ""]:
+                    failures[pv_name]=str(status.error)
+                    del pending[pv_name]
+                elif progress >= 100:
+                    duration=now - started_at
+                    size=self.__parse_size(status.size)
+                    results[pv_name]={"duration": duration, "size": size, "throughput": size / duration if duration > 0 else 0.0, "id": status.id, "url": status.backupURL}
+                    self.log_info(msg="DONE. Backup of the volume " + pv_name + " completed in " + "{:.3f}".format(duration) + "s: " + str(size) + " bytes, " +
+                        "{:.2f}".format(results[pv_name]["throughput"] / 1048576) + " MiB/s")
+                    del pending[pv_name]
+                else:
+                    if progress > backup["progress"]:
+                        backup["progress"]=progress
+                        backup["changed_at"]=now
+                    elif self.config.backup_stall_timeout > 0 and now - backup["changed_at"] > self.config.backup_stall_timeout:
+                        failures[pv_name]="stalled at " + str(progress) + "% for more than " + str(self.config.backup_stall_timeout) + "s"
+                        del pending[pv_name]
+
+            if len(pending) > 0:
+                elapsed=time.monotonic() - started_at
+                self.log_info(msg="Backups progress after " + "{:.0f}".format(elapsed) + "s: " + ", ".join([
+                    pv_name + " " + str(backup["progress"]) + "%" +
+                    (" (ETA " + "{:.0f}".format(elapsed * (100 - backup["progress"]) / backup["progress"]) + "s)" if backup["progress"] > 0 else "")
+                    for pv_name, backup in pending.items()
+                ]))
+                time.sleep(interval)
+                interval=min(interval * 2, LonghornApiInstanceHandler.__BACKUP_POLL_MAX_INTERVAL)
+
+        if len(failures) > 0:
+            self.log_err(err="Some backups failed: " + "; ".join([pv_name + ": " + failure for pv_name, failure in failures.items()]))
+            raise LonghornApiInstanceHandlerException(message="Some backups failed: " + "; ".join([pv_name + ": " + failure for pv_name, failure in failures.items()]))
+
+        total_size=sum([result["size"] for result in results.values()])
+        duration=time.monotonic() - started_at
+        self.log_info(msg="DONE. All the backups completed in " + "{:.3f}".format(duration) + "s: " + str(total_size) + " bytes, " +
+            "{:.2f}".format(total_size / duration / 1048576 if duration > 0 else 0.0) + " MiB/s overall")
+        return results
+
+    def list_volume_backups(self, pv_name):
+        # Completed backups of the volume in the backupstore, as {"name", "snapshot_name", "created", "size", "url"}
+        try:
+            vol = self.client.by_id_backupVolume(id=pv_name)
+            # No backup volume until the first backup of the volume
+            if vol == None:
+                return []
+            backs=vol.backupList().data
+            return [{
+                "name": back.name,
+                "snapshot_name": back.snapshotName,
+                "created": dateutil_parse(back.snapshotCreated),
+                "size": self.__parse_size(back.size),
+                "url": back.url
+            } for back in backs if back.progress == 100]
+        except BaseException as e:
+            self.log_err(err="Cannot list the backups of the volume " + pv_name)
+            raise LonghornApiInstanceHandlerException(message="Cannot list the backups of the volume " + pv_name + " due to the following issue:\n" + str(e))
+
+    def __parse_size(self, size):
+        try:
+            return int(size)
+        except (ValueError,TypeError):
+            return 0
+
     def create_volume_snapshot_and_backup(self, backup_name, pv_name):
         # Create the snapshot
         self.create_volume_snapshot(snapshot_name=backup_name, pv_name=pv_name)
@@ -194,47 +585,66 @@ class LonghornApiInstanceHandler(Loggable):
         self.create_volume_backup(snapshot_name=backup_name, pv_name=pv_name)
 
 
+    @staticmethod
+    def __snapshot_size(snap):
+        try:
+            return int(snap.size)
+        except (AttributeError,ValueError,TypeError):
+            return 0
+
+    def delete_items_concurrently(self, kind, pv_name, delete_functions):
+        # delete_functions is a dictionary {item name: callable deleting it}. The errors are reported all together
+        try:
+            return WorkerPool(max_workers=self.config.max_workers).run(delete_functions)
+        except WorkerPoolException as e:
+            deleted=len([task for task in e.tasks.values() if task.error == None]) if e.tasks != None else 0
+            self.log_err(err="Unable to delete some " + kind + " of the volume " + pv_name + " (" + str(deleted) + " of " + str(len(delete_functions)) + " deleted)")
+            raise LonghornApiInstanceHandlerException(message="Unable to delete some " + kind + " of the volume " + pv_name + ". The workers returned the following issues:\n" + e.message)
+
     def delete_snapshots_over_retain_count(self, pv_name):
-        self.log_info("Deleting the snapshots older than the last " + str(self.config.nr_snapshots_to_retain) + "...")
+        self.log_info("Deleting the snapshots older than the last " + str(self.config.nr_snapshots_to_retain) + " and out of the retention tiers...")
         try:
             #Retrieve volume by name
-            self.log_info(msg="Retrieving the volume " + pv_name + "...")
-            vol = self.client.by_id_volume(id=pv_name)
-            if vol == None:
-                self.log_err(err="Cannot find volume named " + pv_name)
-                raise LonghornApiInstanceHandlerException(message="Cannot find volume "+ pv_name)
-
-            #Retrieve snapshots list
-            self.log_info(msg="DONE. Retrieving the snapshots list for the volume " + pv_name)
-            try:
-                snaps=vol.snapshotList().data
-            except:
-                self.log_err(err="Cannot find the snapshot list for the volume " + pv_name + ". Unable to continue")
-                raise LonghornApiInstanceHandlerException(message="Cannot find the snapshot list.")
-
-            self.log_info(msg="DONE. Retrieving the snapshots to remove...")
-            if len(snaps) > self.config.nr_snapshots_to_retain:
-                # Polulate a dictionary with the snapshot creation time as a key
-                snaps_dict={}
-                for snap in snaps:
-                    snaps_dict[dateutil_parse(snap.created)]=snap.name
-                
-                # Retrieve the dictionary keys and sort them chronologically
-                keys=[*snaps_dict]
-                keys.sort()
-
-                self.log_info(msg="DONE. Removing old snapshots for the volume " + pv_name + "...")
-                # Remove the older snapshots
-                while len(keys) > self.config.nr_snapshots_to_retain:
-                    vol.snapshotDelete(name=snaps_dict[keys.pop(0)])
-                self.log_info(msg="DONE. successfully removed the older snapshots for the volume " + pv_name)
+            vol = self.get_volume(pv_name=pv_name)
+
+            #Retrieve snapshots list (reusing the listing already downloaded during the run, if any). The volume head
+            #is not a real snapshot and the removed snapshots are already waiting to be purged
+            all_snaps=[snap for snap in self.get_snapshots(pv_name=pv_name).values() if snap != None]
+            snaps=[(dateutil_parse(snap.created), snap.name) for snap in all_snaps
+                if snap.name != "volume-head" and snap.removed != True and snap.created not in [None, ""]]
+            sizes={snap.name: LonghornApiInstanceHandler.__snapshot_size(snap) for snap in all_snaps}
+        except LonghornApiInstanceHandlerException:
+            raise
         except BaseException as e:
             self.log_err(err="Cannot delete snapshots over retain count")
-            raise LonghornApiInstanceHandlerException(message="Cannot delete snapshots over retain count due to the following issue:\n" +e)
+            raise LonghornApiInstanceHandlerException(message="Cannot delete snapshots over retain count due to the following issue:\n" + str(e))
+
+        self.log_info(msg="DONE. Retrieving the snapshots to remove...")
+        to_delete=select_over_retention(items=snaps, retain_count=self.config.nr_snapshots_to_retain, tiers=self.config.snapshots_retention_tiers)
+
+        # The snapshots retained are further cut down, from the oldest, until the chain fits the size budget
+        if self.config.snapshots_size_budget != None:
+            kept=[snap for snap in snaps if snap not in to_delete]
+            over_budget=select_over_size_budget(items=kept, sizes=sizes, budget=self.config.snapshots_size_budget)
+            if len(over_budget) > 0:
+                self.log_info(msg="DONE. " + str(len(over_budget)) + " more snapshots of the volume " + pv_name
+                    + " don't fit the " + str(self.config.snapshots_size_budget) + " bytes budget (" + str(sum([sizes.get(snap[1], 0) for snap in kept])) + " bytes used)")
+            to_delete=sorted(to_delete + over_budget)
+
+        if len(to_delete) == 0:
+            return
+
+        self.log_info(msg="DONE. Removing " + str(len(to_delete)) + " old snapshots for the volume " + pv_name + "...")
+        def delete_snapshot(snap_name):
+            vol.snapshotDelete(name=snap_name)
+            self.__unindex_snapshot(pv_name=pv_name, snapshot_name=snap_name)
+        self.delete_items_concurrently(kind="snapshots", pv_name=pv_name,
+            delete_functions={snap_name: (lambda snap_name=snap_name: delete_snapshot(snap_name)) for created, snap_name in to_delete})
+        self.log_info(msg="DONE. successfully removed the older snapshots for the volume " + pv_name)
 
 
     def delete_backups_over_retain_count(self, pv_name):
-        self.log_info("Deleting the backups older than the last " + str(self.config.nr_backups_to_retain) + "...")
+        self.log_info("Deleting the backups older than the last " + str(self.config.nr_backups_to_retain) + " and out of the retention tiers...")
         try:
             #Retrieve volume by name
             self.log_info(msg="Retrieving the volume " + pv_name + "...")
@@ -251,27 +661,23 @@ class LonghornApiInstanceHandler(Loggable):
                 self.log_err(err="Cannot find the backups list for the volume " + pv_name + ". Unable to continue")
                 raise LonghornApiInstanceHandlerException(message="Cannot find the backups list.")
 
-            self.log_info(msg="DONE. Retrieving the backups to remove...")
-            if len(backs) > self.config.nr_backups_to_retain:
-                # Polulate a dictionary with the snapshot (linked to the backup) creation time as a key
-                backs_dict={}
-                for back in backs:
-                    # Check if the backup is already completed, otherwise it will be skipped
-                    if back.progress == 100:
-                        backs_dict[dateutil_parse(back.snapshotCreated)]=back.name
-                
-                # Retrieve the dictionary keys and sort them chronologically
-                keys=[*backs_dict]
-                keys.sort()
-
-                self.log_info(msg="DONE. Removing old backups for the volume " + pv_name + "...")
-                # Remove the older backups
-                while len(keys) > self.config.nr_backups_to_retain:
-                    vol.backupDelete(name=backs_dict[keys.pop(0)])
-                self.log_info(msg="DONE. successfully removed the older backups for the volume " + pv_name)
+            # The backups not completed yet are skipped
+            backs=[(dateutil_parse(back.snapshotCreated), back.name) for back in backs if back.progress == 100]
+        except LonghornApiInstanceHandlerException:
+            raise
         except BaseException as e:
             self.log_err(err="Cannot delete backups over retain count")
-            raise LonghornApiInstanceHandlerException(message="Cannot delete backups over retain count due to the following issue:\n" +e)
+            raise LonghornApiInstanceHandlerException(message="Cannot delete backups over retain count due to the following issue:\n" + str(e))
+
+        self.log_info(msg="DONE. Retrieving the backups to remove...")
+        to_delete=select_over_retention(items=backs, retain_count=self.config.nr_backups_to_retain, tiers=self.config.backups_retention_tiers)
+        if len(to_delete) == 0:
+            return
+
+        self.log_info(msg="DONE. Removing " + str(len(to_delete)) + " old backups for the volume " + pv_name + "...")
+        self.delete_items_concurrently(kind="backups", pv_name=pv_name,
+            delete_functions={back_name: (lambda back_name=back_name: vol.backupDelete(name=back_name)) for created, back_name in to_delete})
+        self.log_info(msg="DONE. successfully removed the older backups for the volume " + pv_name)
 
     
     def delete_backups_and_snapshots_over_retain_count(self, pv_name):
@@ -1,5 +1,10 @@
 import mariadb
+import time
 
+from contextlib import contextmanager
+from threading import Lock, Semaphore
+
+from kubencbackup.common.backupconfig import BackupConfig
 from kubencbackup.common.backupexceptions import ApiInstancesConfigException, ApiInstancesHandlerException
 from kubencbackup.common.loggable import Loggable
 
@@ -10,10 +15,11 @@ class MariaDBApiInstanceConfigException(ApiInstancesConfigException):
 
 
 class MariaDBApiInstanceConfig:
-    def __init__(self, db_url, db_port, db_root_password):
+    def __init__(self, db_url, db_port, db_root_password, pool_size=None):
         self.db_root_password=db_root_password
         self.db_url=db_url
         self.db_port=db_port
+        self.pool_size=pool_size
 
     ### db_root_password getter and setter ###
     @property
@@ -51,6 +57,24 @@ class MariaDBApiInstanceConfig:
         self.__db_port=db_port
     ### END ###
 
+    ### pool_size getter and setter ###
+    @property
+    def pool_size(self):
+        return self.__pool_size
+    
+    @pool_size.setter
+    def pool_size(self,pool_size):
+        if pool_size == None:
+            self.__pool_size = BackupConfig.DEFAULT_MARIADB_POOL_SIZE
+        else:
+            try:
+                self.__pool_size = int(pool_size)
+            except (ValueError,TypeError) as e:
+                raise MariaDBApiInstanceConfigException(message='pool_size must be a integer number')
+            if self.__pool_size < 1:
+                raise MariaDBApiInstanceConfigException(message='pool_size must be greater than 0')
+    ### END ###
+
 ### END - Config ###
 
 ### Handler ###
@@ -59,6 +83,8 @@ class MariaDBApiInstanceHandlerException(ApiInstancesHandlerException):
         super().__init__(message)
         
 class MariaDBApiInstanceHandler (Loggable):
+    __POOL_NAME="kube-nc-backup"
+
     def __init__(self, config):
         super().__init__(name="MARIADB-API###", log_level=2)
 
@@ -67,6 +93,17 @@ class MariaDBApiInstanceHandler (Loggable):
             raise MariaDBApiInstanceHandlerException(message="Config type not valid. Must be MariaDBApiInstanceConfig and not None")
         self.__config=config
 
+        # The pinned connection and cursor are shared, the pool connections are given out one per borrower
+        self.__pinned_lock=Lock()
+        self.__pool=None
+        self.__pool_semaphore=Semaphore(config.pool_size)
+        self.__pool_stats_lock=Lock()
+        self.__pool_borrowed=0
+        self.__pool_in_use=0
+        self.__pool_peak_in_use=0
+        self.__pool_wait_time=0.0
+        self.__pool_max_wait_time=0.0
+
     def __enter__(self):
         self.log_info(msg="Initializing MariaDB API...")
         try:
@@ -80,7 +117,7 @@ class MariaDBApiInstanceHandler (Loggable):
             self.log_info(msg="DONE. Connection to MariaDB successfully initialized.")
         except mariadb.Error as e:
             self.log_err(err="Unable to connect to MariaDB")
-            raise MariaDBApiInstanceHandlerException(message="Error connecting to the database. The error message is:\n" + e)
+            raise MariaDBApiInstanceHandlerException(message="Error connecting to the database. The error message is:\n" + str(e))
         
         try:
             self.log_info(msg="Retrieving the cursor from connection...")
@@ -89,7 +126,24 @@ class MariaDBApiInstanceHandler (Loggable):
         except BaseException as e:
             self.log_err(err="Unable to retrieve the cursor")
             self.clean_conn()
-            raise MariaDBApiInstanceHandlerException(message="Unable to retrieve the cursor. The error message is:\n" + e)
+            raise MariaDBApiInstanceHandlerException(message="Unable to retrieve the cursor. The error message is:\n" + str(e))
+
+        try:
+            self.log_info(msg="Initializing the connection pool with " + str(self.__config.pool_size) + " connections...")
+            self.__pool = mariadb.ConnectionPool(
+                # The pool names must be unique, there is one pool per handler
+                pool_name=MariaDBApiInstanceHandler.__POOL_NAME + "-" + str(id(self)),
+                pool_size=self.__config.pool_size,
+                host=self.__config.db_url,
+                port=self.__config.db_port,
+                user="root",
+                password=self.__config.db_root_password,
+                autocommit=True)
+            self.log_info(msg="DONE. Connection pool successfully initialized.")
+        except mariadb.Error as e:
+            self.log_err(err="Unable to initialize the connection pool")
+            self.clean_resources()
+            raise MariaDBApiInstanceHandlerException(message="Unable to initialize the connection pool. The error message is:\n" + str(e))
 
         self.log_info(msg="MariaDB API successfully initialized")
 
@@ -103,6 +157,11 @@ class MariaDBApiInstanceHandler (Loggable):
         self.clean_resources()
 
     def clean_resources(self):
+        try:
+            self.clean_pool()
+        except:
+            self.log_err(err="Unable to close the MariaDB connection pool")
+
         try:
             self.clean_cur()
             self.log_info(msg="MariaDB cursor successfully closed")
@@ -128,6 +187,17 @@ class MariaDBApiInstanceHandler (Loggable):
         self.conn.close()
         del(self.conn)
 
+    def clean_pool(self):
+        if self.__pool == None:
+            return
+        pool=self.__pool
+        self.__pool=None
+        stats=self.pool_stats
+        self.log_info(msg="Connection pool stats: " + str(stats["borrowed"]) + " connections borrowed, peak " + str(stats["peak_in_use"]) +
+            " in use out of " + str(stats["size"]) + ", " + "{:.3f}".format(stats["wait_time"]) + "s total wait, " + "{:.3f}".format(stats["max_wait_time"]) + "s max wait")
+        pool.close()
+        self.log_info(msg="MariaDB connection pool successfully closed")
+
    ### conn getter and setter ###
     @property
     def conn(self):
@@ -162,15 +232,85 @@ class MariaDBApiInstanceHandler (Loggable):
         del(self.__cur)
     ### END ###
 
+    ### pool_stats getter ###
+    @property
+    def pool_stats(self):
+        with self.__pool_stats_lock:
+            return {
+                "size": self.__config.pool_size,
+                "borrowed": self.__pool_borrowed,
+                "in_use": self.__pool_in_use,
+                "peak_in_use": self.__pool_peak_in_use,
+                "wait_time": self.__pool_wait_time,
+                "max_wait_time": self.__pool_max_wait_time
+            }
+    ### END ###
+
     ### Methods implementation ###
+    @contextmanager
+    def connection(self):
+        # Borrow a connection from the pool, waiting for one to be released if all of them are in use.
+        # The connection goes back to the pool, reset, when the 'with' block ends
+        if self.__pool == None:
+            raise MariaDBApiInstanceHandlerException(message="The connection pool is not initialized")
+
+        wait_start=time.monotonic()
+        self.__pool_semaphore.acquire()
+        wait_time=time.monotonic() - wait_start
+        try:
+            try:
+                conn=self.__pool.get_connection()
+            except mariadb.Error as e:
+                raise MariaDBApiInstanceHandlerException(message="Unable to get a connection from the pool. The error message is:\n" + str(e))
+            if conn == None:
+                raise MariaDBApiInstanceHandlerException(message="Unable to get a connection from the pool. No connection available")
+
+            with self.__pool_stats_lock:
+                self.__pool_borrowed+=1
+                self.__pool_in_use+=1
+                self.__pool_peak_in_use=max(self.__pool_peak_in_use, self.__pool_in_use)
+                self.__pool_wait_time+=wait_time
+                self.__pool_max_wait_time=max(self.__pool_max_wait_time, wait_time)
+            try:
+                yield conn
+            finally:
+                with self.__pool_stats_lock:
+                    self.__pool_in_use-=1
+                try:
+                    conn.close()
+                except mariadb.Error as e:
+                    self.log_err(err="Unable to give the connection back to the pool: " + str(e))
+        finally:
+            self.__pool_semaphore.release()
+
     def exec_sql_command(self, command):
+        # The commands run on the pinned session, since the backup stages belong to the session that started them
         self.log_info(msg="Executing the SQL command '" + command + "' on MariaDB...")
         try:
-            res = self.cur.execute(command)
+            with self.__pinned_lock:
+                res = self.cur.execute(command)
             self.log_info(msg="DONE. SQL command successfully executed")
             return res
         except BaseException as e:
             self.log_err(err="Unable to execute the SQL command '" + command + "'")
-            raise MariaDBApiInstanceHandlerException(message="Unable to execute command '" + command + "' . The error message is:\n" + e)
+            raise MariaDBApiInstanceHandlerException(message="Unable to execute command '" + command + "' . The error message is:\n" + str(e))
+
+    def exec_sql_query(self, query, params=(), dictionary=False):
+        # The queries run on a pooled connection, so that they can be run in parallel from several threads.
+        # With dictionary the rows are returned as {column name: value}
+        self.log_info(msg="Executing the SQL query '" + query + "' on MariaDB...")
+        try:
+            with self.connection() as conn:
+                cur = conn.cursor(dictionary=dictionary)
+                try:
+                    cur.execute(query, params)
+                    rows = cur.fetchall()
+                finally:
+                    cur.close()
+            self.log_info(msg="DONE. SQL query successfully executed")
+            return rows
+        except BaseException as e:
+            self.log_err(err="Unable to execute the SQL query '" + query + "'")
+            raise MariaDBApiInstanceHandlerException(message="Unable to execute query '" + query + "' . The error message is:\n" + str(e))
     ### END ###
 ### END - Handler ###
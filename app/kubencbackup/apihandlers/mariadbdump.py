@@ -0,0 +1,368 @@
+import datetime
+import decimal
+import json
+import os
+import time
+
+from contextlib import ExitStack
+from queue import Empty, Queue
+
+from kubencbackup.apihandlers.mariadbapi import MariaDBApiInstanceHandler, MariaDBApiInstanceHandlerException
+from kubencbackup.common.backupexceptions import ApiInstancesHandlerException
+from kubencbackup.common.compressedsink import CompressedSink, CompressedSinkException
+from kubencbackup.common.loggable import Loggable
+from kubencbackup.common.workerpool import WorkerPool, WorkerPoolException
+
+class MariaDBDumpEngineException(ApiInstancesHandlerException):
+    def __init__(self,message):
+        super().__init__(message)
+
+
+def quote_identifier(identifier):
+    return "`" + identifier.replace("`", "``") + "`"
+
+SQL_STRING_ESCAPES = str.maketrans({"\\": "\\\\", "'": "\\'", "\0": "\\0", "\n": "\\n", "\r": "\\r", "\x1a": "\\Z"})
+
+def sql_literal(value):
+    if value == None:
+        return "NULL"
+    if isinstance(value, bool):
+        return str(int(value))
+    if isinstance(value, (int, decimal.Decimal)):
+        return str(value)
+    if isinstance(value, float):
+        return repr(value)
+    if isinstance(value, (bytes, bytearray)):
+        return "0x" + value.hex() if len(value) > 0 else "''"
+    if isinstance(value, datetime.datetime):
+        return "'" + value.isoformat(sep=" ") + "'"
+    if isinstance(value, datetime.date):
+        return "'" + value.isoformat() + "'"
+    if isinstance(value, datetime.timedelta):
+        # TIME columns
+        sign="-" if value < datetime.timedelta(0) else ""
+        microseconds=abs(value) // datetime.timedelta(microseconds=1)
+        seconds, microseconds=divmod(microseconds, 1000000)
+        minutes, seconds=divmod(seconds, 60)
+        hours, minutes=divmod(minutes, 60)
+        return "'" + sign + "%02d:%02d:%02d" % (hours, minutes, seconds) + (".%06d" % microseconds if microseconds else "") + "'"
+    return "'" + str(value).translate(SQL_STRING_ESCAPES) + "'"
+
+def get_order_by_columns(unique_keys, columns):
+    # Columns giving a stable rows order: the first unique key without nullable columns (the primary key when
+    # there is one), as several rows can have NULL in a unique key, otherwise all the columns
+    keys={}
+    for index_name, column_name, nullable in unique_keys:
+        keys.setdefault(index_name, []).append((column_name, nullable))
+    for key_columns in keys.values():
+        if all(nullable != 'YES' for column_name, nullable in key_columns):
+            return [quote_identifier(column_name) for column_name, nullable in key_columns]
+    return list(columns)
+
+
+class MariaDBDumpTable:
+    def __init__(self, schema, name, data_length):
+        self.schema=schema
+        self.name=name
+        self.data_length=data_length
+        self.file_path=None
+        self.rows=0
+        self.bytes_in=0
+        self.bytes_out=0
+        self.duration=None
+        self.previous_digest=None
+        self.digest=None
+        self.unchanged=False
+
+
+class MariaDBDumpEngine(Loggable):
+    # Tables not dumped, as mysqldump does
+    __SKIPPED_SCHEMAS=('information_schema', 'performance_schema', 'sys')
+    __SKIPPED_TABLES=(('mysql', 'general_log'), ('mysql', 'slow_log'), ('mysql', 'transaction_registry'))
+
+    __TABLES_QUERY="SELECT TABLE_SCHEMA, TABLE_NAME, IFNULL(DATA_LENGTH, 0) FROM information_schema.TABLES " \
+        "WHERE TABLE_TYPE = 'BASE TABLE' AND TABLE_SCHEMA NOT IN ('information_schema', 'performance_schema', 'sys') ORDER BY DATA_LENGTH DESC"
+    __VIEWS_QUERY="SELECT TABLE_SCHEMA, TABLE_NAME FROM information_schema.VIEWS " \
+        "WHERE TABLE_SCHEMA NOT IN ('information_schema', 'performance_schema', 'sys', 'mysql')"
+    __COLUMNS_QUERY="SELECT COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS " \
+        "WHERE TABLE_SCHEMA = ? AND TABLE_NAME = ? AND EXTRA NOT LIKE '%GENERATED%' ORDER BY ORDINAL_POSITION"
+    # The primary key first, then the other unique keys
+    __UNIQUE_KEYS_QUERY="SELECT INDEX_NAME, COLUMN_NAME, NULLABLE FROM information_schema.STATISTICS " \
+        "WHERE TABLE_SCHEMA = ? AND TABLE_NAME = ? AND NON_UNIQUE = 0 ORDER BY INDEX_NAME = 'PRIMARY' DESC, INDEX_NAME, SEQ_IN_INDEX"
+
+    # Rows fetched at a time from the server-side cursor and size limit of a multi-row INSERT
+    __FETCH_ROWS=1000
+    __MAX_STATEMENT_BYTES=1048576
+
+    # Dumped as text, so the zero dates, that the connector can't convert, and the TIMESTAMP values in UTC are kept as they are
+    __TEMPORAL_TYPES=('date', 'datetime', 'timestamp')
+    # The workers read the TIMESTAMP values in UTC and the files restore them in UTC. The SQL mode without the
+    # strict and NO_ZERO_DATE modes restores the zero dates, NO_AUTO_VALUE_ON_ZERO the zero AUTO_INCREMENT values
+    __SESSION_TIME_ZONE="+00:00"
+    __FILE_HEADER="SET NAMES utf8mb4;\nSET TIME_ZONE='+00:00';\nSET SQL_MODE='NO_AUTO_VALUE_ON_ZERO';\nSET FOREIGN_KEY_CHECKS=0;\nSET UNIQUE_CHECKS=0;\n"
+    __MANIFEST_FILE_NAME="manifest.json"
+
+    def __init__(self, mariadb_api, workers, compression='gzip'):
+        super().__init__(name="MARIADB-DUMP##", log_level=2)
+
+        if mariadb_api == None or type(mariadb_api) != MariaDBApiInstanceHandler:
+            self.log_err(err='"mariadb_api" variable is mandatory and must be of type "MariaDBApiInstanceHandler"')
+            raise MariaDBDumpEngineException(message='"mariadb_api" variable is mandatory and must be of type "MariaDBApiInstanceHandler"')
+        if compression not in CompressedSink.COMPRESSIONS:
+            raise MariaDBDumpEngineException(message='"compression" must be one of ' + ", ".join(CompressedSink.COMPRESSIONS))
+        try:
+            self.workers=int(workers)
+        except (ValueError,TypeError):
+            raise MariaDBDumpEngineException(message='"workers" must be a integer number')
+        if self.workers < 1:
+            raise MariaDBDumpEngineException(message='"workers" must be greater than 0')
+
+        self.mariadb_api=mariadb_api
+        self.compression=compression
+
+    ### Methods implementation ###
+    def dump(self, output_dir):
+        self.log_info(msg="Dumping MariaDB to " + output_dir + " with " + str(self.workers) + " workers...")
+        start=time.monotonic()
+        extension=".sql" + CompressedSink.COMPRESSIONS[self.compression]
+        databases_file_path=os.path.join(output_dir, "databases" + extension)
+        views_file_path=os.path.join(output_dir, "views" + extension)
+
+        # The files whose content didn't change since the previous dump are left untouched
+        previous_digests=self.__load_previous_digests(output_dir)
+
+        # The coordinator and the workers connections are all borrowed from the pool for the whole dump,
+        # so the workers are limited to the pool size minus the coordinator
+        workers=min(self.workers, self.mariadb_api.pool_stats["size"] - 1)
+        if workers < 1:
+            raise MariaDBDumpEngineException(message="The MariaDB connection pool must have at least 2 connections to run the parallel dump")
+        if workers < self.workers:
+            self.log_info(msg="The connection pool allows just " + str(workers) + " workers")
+
+        try:
+            with ExitStack() as pooled_connections:
+                coordinator=pooled_connections.enter_context(self.mariadb_api.connection())
+                tables, views=self.__list_objects(coordinator)
+
+                # Borrow the workers connections and make them share the same consistent snapshot
+                connections=[]
+                for i in range(min(workers, max(1, len(tables)))):
+                    connections.append(pooled_connections.enter_context(self.mariadb_api.connection()))
+                binlog_position=self.__start_consistent_snapshot(coordinator, connections)
+
+                # Databases and views definitions
+                schemas=sorted(set([table.schema for table in tables] + [view[0] for view in views]))
+                files={}
+                files[os.path.relpath(databases_file_path, output_dir)]=self.__dump_databases(coordinator, schemas, databases_file_path,
+                    previous_digests.get(os.path.relpath(databases_file_path, output_dir))).digest
+                files[os.path.relpath(views_file_path, output_dir)]=self.__dump_views(connections[0], views, views_file_path,
+                    previous_digests.get(os.path.relpath(views_file_path, output_dir))).digest
+
+                # Tables data, the largest tables first so that the workers end at about the same time
+                queue=Queue()
+                for table in tables:
+                    table.file_path=os.path.join(output_dir, table.schema, table.name + extension)
+                    table.previous_digest=previous_digests.get(os.path.relpath(table.file_path, output_dir))
+                    queue.put(table)
+
+                functions={}
+                for i, connection in enumerate(connections):
+                    functions["worker-" + str(i)]=(lambda connection=connection: self.__dump_tables_worker(connection, queue))
+                WorkerPool(max_workers=len(connections)).run(functions)
+
+                self.__remove_stale_files(output_dir, previous_digests, list(files) + [os.path.relpath(table.file_path, output_dir) for table in tables])
+                manifest=self.__write_manifest(output_dir, tables, files, binlog_position)
+        except (MariaDBApiInstanceHandlerException,WorkerPoolException,CompressedSinkException,OSError) as e:
+            self.log_err(err="Unable to dump MariaDB")
+            raise MariaDBDumpEngineException(message="Unable to dump MariaDB. The issue is the following:\n" + str(e))
+        except BaseException as e:
+            self.log_err(err="Unable to dump MariaDB")
+            raise MariaDBDumpEngineException(message="Unable to dump MariaDB. The error message is:\n" + str(e))
+
+        duration=time.monotonic() - start
+        bytes_in=sum([table.bytes_in for table in tables])
+        self.log_info(msg="DONE. " + str(len(tables)) + " tables and " + str(sum([table.rows for table in tables])) + " rows dumped: " +
+            str(bytes_in) + " bytes dumped, " + str(sum([table.bytes_out for table in tables])) + " bytes written (" + self.compression + ") in " +
+            "{:.3f}".format(duration) + "s, " + "{:.2f}".format(bytes_in / duration / 1048576 if duration > 0 else 0.0) + " MiB/s. " +
+            str(len([table for table in tables if table.unchanged])) + " tables unchanged since the previous dump")
+        return manifest
+
+    def __load_previous_digests(self, output_dir):
+        # {file path relative to output_dir: sha256 of its uncompressed content} from the previous manifest
+        file_path=os.path.join(output_dir, MariaDBDumpEngine.__MANIFEST_FILE_NAME)
+        try:
+            with open(file_path, "r") as manifest_file:
+                manifest=json.load(manifest_file)
+            digests=dict(manifest.get("files", {}))
+            for table in manifest.get("tables", []):
+                digests[table["file"]]=table["sha256"]
+            return digests
+        except (OSError,ValueError,KeyError,TypeError,AttributeError):
+            return {}
+
+    def __list_objects(self, connection):
+        cur=connection.cursor()
+        try:
+            cur.execute(MariaDBDumpEngine.__TABLES_QUERY)
+            tables=[MariaDBDumpTable(schema=row[0], name=row[1], data_length=int(row[2])) for row in cur.fetchall()
+                if (row[0], row[1]) not in MariaDBDumpEngine.__SKIPPED_TABLES]
+            cur.execute(MariaDBDumpEngine.__VIEWS_QUERY)
+            views=[(row[0], row[1]) for row in cur.fetchall()]
+        finally:
+            cur.close()
+        return tables, views
+
+    def __start_consistent_snapshot(self, coordinator, connections):
+        # Every worker starts its transaction while the global read lock is held, so all of them see the same data
+        cur=coordinator.cursor()
+        try:
+            cur.execute("FLUSH TABLES WITH READ LOCK")
+            try:
+                for connection in connections:
+                    worker_cur=connection.cursor()
+                    worker_cur.execute("SET SESSION time_zone='" + MariaDBDumpEngine.__SESSION_TIME_ZONE + "'")
+                    worker_cur.execute("SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+                    worker_cur.execute("START TRANSACTION WITH CONSISTENT SNAPSHOT")
+                    worker_cur.close()
+
+                # Binary log position matching the snapshot, if the binary log is enabled
+                cur.execute("SHOW MASTER STATUS")
+                row=cur.fetchone()
+                cur.execute("SELECT @@GLOBAL.gtid_binlog_pos")
+                gtid=cur.fetchone()[0]
+            finally:
+                cur.execute("UNLOCK TABLES")
+        finally:
+            cur.close()
+
+        if row == None:
+            return None
+        return {"file": row[0], "position": int(row[1]), "gtid": gtid}
+
+    def __dump_databases(self, connection, schemas, file_path, previous_digest):
+        cur=connection.cursor()
+        try:
+            with CompressedSink(file_path=file_path, compression=self.compression, previous_digest=previous_digest) as sink:
+                sink.write(MariaDBDumpEngine.__FILE_HEADER)
+                for schema in schemas:
+                    cur.execute("SHOW CREATE DATABASE " + quote_identifier(schema))
+                    create=cur.fetchone()[1].replace("CREATE DATABASE", "CREATE DATABASE IF NOT EXISTS", 1)
+                    sink.write(create + ";\n")
+        finally:
+            cur.close()
+        return sink
+
+    def __dump_views(self, connection, views, file_path, previous_digest):
+        cur=connection.cursor()
+        try:
+            with CompressedSink(file_path=file_path, compression=self.compression, previous_digest=previous_digest) as sink:
+                sink.write(MariaDBDumpEngine.__FILE_HEADER)
+                for schema, name in views:
+                    cur.execute("SHOW CREATE VIEW " + quote_identifier(schema) + "." + quote_identifier(name))
+                    sink.write("USE " + quote_identifier(schema) + ";\nDROP VIEW IF EXISTS " + quote_identifier(name) + ";\n" + cur.fetchone()[1] + ";\n")
+        finally:
+            cur.close()
+        return sink
+
+    def __dump_tables_worker(self, connection, queue):
+        while True:
+            try:
+                table=queue.get_nowait()
+            except Empty:
+                return
+            self.__dump_table(connection, table)
+
+    def __dump_table(self, connection, table):
+        start=time.monotonic()
+        table_name=quote_identifier(table.schema) + "." + quote_identifier(table.name)
+
+        cur=connection.cursor()
+        try:
+            cur.execute(MariaDBDumpEngine.__COLUMNS_QUERY, (table.schema, table.name))
+            column_types=[(quote_identifier(row[0]), row[1].lower()) for row in cur.fetchall()]
+            columns=[column for column, data_type in column_types]
+            cur.execute(MariaDBDumpEngine.__UNIQUE_KEYS_QUERY, (table.schema, table.name))
+            order_by=get_order_by_columns(cur.fetchall(), columns)
+            cur.execute("SHOW CREATE TABLE " + table_name)
+            create=cur.fetchone()[1]
+        finally:
+            cur.close()
+
+        os.makedirs(os.path.dirname(table.file_path), exist_ok=True)
+        insert_prefix="INSERT INTO " + quote_identifier(table.name) + " (" + ",".join(columns) + ") VALUES\n"
+
+        # Unbuffered cursor: the rows are streamed from the server instead of being loaded all in memory
+        cur=connection.cursor(buffered=False)
+        try:
+            with CompressedSink(file_path=table.file_path, compression=self.compression, previous_digest=table.previous_digest) as sink:
+                sink.write(MariaDBDumpEngine.__FILE_HEADER + "USE " + quote_identifier(table.schema) + ";\n" +
+                    "DROP TABLE IF EXISTS " + quote_identifier(table.name) + ";\n" + create + ";\n")
+
+                # A stable rows order gives the same file for the same data. Ordering by the primary key is free with InnoDB
+                select=[("CAST(" + column + " AS CHAR)" if data_type in MariaDBDumpEngine.__TEMPORAL_TYPES else column) for column, data_type in column_types]
+                cur.execute("SELECT " + ",".join(select) + " FROM " + table_name + (" ORDER BY " + ",".join(order_by) if len(order_by) > 0 else ""))
+                values=[]
+                statement_bytes=0
+                while True:
+                    rows=cur.fetchmany(MariaDBDumpEngine.__FETCH_ROWS)
+                    if not rows:
+                        break
+                    for row in rows:
+                        value="(" + ",".join([sql_literal(column) for column in row]) + ")"
+                        # Flush the multi-row INSERT before it gets too big
+                        if len(values) > 0 and statement_bytes + len(value) > MariaDBDumpEngine.__MAX_STATEMENT_BYTES:
+                            sink.write(insert_prefix + ",\n".join(values) + ";\n")
+                            values=[]
+                            statement_bytes=0
+                        values.append(value)
+                        statement_bytes+=len(value) + 2
+                    table.rows+=len(rows)
+                if len(values) > 0:
+                    sink.write(insert_prefix + ",\n".join(values) + ";\n")
+        finally:
+            cur.close()
+
+        table.bytes_in=sink.bytes_in
+        table.bytes_out=sink.bytes_out
+        table.digest=sink.digest
+        table.unchanged=sink.unchanged
+        table.duration=time.monotonic() - start
+        self.log_info(msg="Table " + table_name + " dumped: " + str(table.rows) + " rows in " + "{:.3f}".format(table.duration) + "s" + (", unchanged" if table.unchanged else ""))
+
+    def __remove_stale_files(self, output_dir, previous_digests, file_names):
+        # Remove the files of the previous dump not written anymore, as the ones of the dropped tables
+        for file_name in set(previous_digests) - set(file_names):
+            file_path=os.path.join(output_dir, file_name)
+            if os.path.isfile(file_path):
+                self.log_info(msg="Removing the stale dump file " + file_path)
+                os.remove(file_path)
+
+    def __write_manifest(self, output_dir, tables, files, binlog_position):
+        manifest={
+            "compression": self.compression,
+            "binlog_position": binlog_position,
+            # Restore order: databases, tables, views
+            "files": files,
+            "tables": [{
+                "schema": table.schema,
+                "name": table.name,
+                "file": os.path.relpath(table.file_path, output_dir),
+                "rows": table.rows,
+                "bytes": table.bytes_in,
+                "sha256": table.digest
+            } for table in sorted(tables, key=lambda table: (table.schema, table.name))]
+        }
+        # Rewritten just when something changed, as the dump files
+        file_path=os.path.join(output_dir, MariaDBDumpEngine.__MANIFEST_FILE_NAME)
+        content=json.dumps(manifest, indent=2, sort_keys=True)
+        try:
+            with open(file_path, "r") as manifest_file:
+                if manifest_file.read() == content:
+                    return manifest
+        except OSError:
+            pass
+        with open(file_path + ".part", "w") as manifest_file:
+            manifest_file.write(content)
+        os.replace(file_path + ".part", file_path)
+        return manifest
+    ### END - Methods implementation ###
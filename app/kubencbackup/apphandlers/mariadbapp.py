@@ -1,8 +1,21 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+from contextlib import contextmanager
+
 from kubencbackup.apihandlers.kubernetesapi import K8sApiInstanceHandler, K8sApiInstanceHandlerException
 from kubencbackup.apihandlers.longhornapi import LonghornApiInstanceHandler, LonghornApiInstanceHandlerException
 from kubencbackup.apihandlers.mariadbapi import MariaDBApiInstanceHandler, MariaDBApiInstanceHandlerException
+from kubencbackup.apihandlers.mariadbdump import MariaDBDumpEngine, MariaDBDumpEngineException, quote_identifier
+from kubencbackup.common.backupconfig import BackupConfig
 from kubencbackup.common.backupexceptions import AppConfigException, AppHandlerException
+from kubencbackup.common.compressedsink import CompressedSink, CompressedSinkException
 from kubencbackup.common.loggable import Loggable
+from kubencbackup.common.runstate import RunState, RunStateException
+from kubencbackup.common.workerpool import WorkerPool, WorkerPoolException
 
 ### Config ###
 class MariaDBAppConfigException(AppConfigException):
@@ -11,12 +24,29 @@ class MariaDBAppConfigException(AppConfigException):
 
 
 class MariaDBAppConfig:
-    def __init__(self, db_app_name, db_root_password, db_actual_volume_name, db_backup_volume_name, db_backup_file_path):
+    def __init__(self, db_app_name, db_root_password, db_actual_volume_name, db_backup_volume_name, db_backup_file_path,
+            dump_timeout=None, dump_mode=None, dump_local_path=None, dump_compression=None, dump_workers=None,
+            long_trx_threshold=None, preflight_timeout=None, preflight_action=None, replica_app_name=None, replica_catchup_timeout=None,
+            dump_strategy=None, full_dump_interval=None, change_detection=None, fingerprint_tables=None):
         self.db_app_name=db_app_name
         self.db_root_password=db_root_password
         self.db_actual_volume_name=db_actual_volume_name
         self.db_backup_volume_name=db_backup_volume_name
+        self.dump_mode=dump_mode
         self.db_backup_file_path=db_backup_file_path
+        self.dump_timeout=dump_timeout
+        self.dump_local_path=dump_local_path
+        self.dump_compression=dump_compression
+        self.dump_workers=dump_workers
+        self.long_trx_threshold=long_trx_threshold
+        self.preflight_timeout=preflight_timeout
+        self.preflight_action=preflight_action
+        self.replica_app_name=replica_app_name
+        self.replica_catchup_timeout=replica_catchup_timeout
+        self.dump_strategy=dump_strategy
+        self.full_dump_interval=full_dump_interval
+        self.change_detection=change_detection
+        self.fingerprint_tables=fingerprint_tables
 
     ### db_app_name getter and setter ###
     @property
@@ -73,10 +103,226 @@ class MariaDBAppConfig:
     
     @db_backup_file_path.setter
     def db_backup_file_path(self,db_backup_file_path):
-        if db_backup_file_path == None:
+        if db_backup_file_path == None and self.dump_mode == 'FILE':
             raise MariaDBAppConfigException(message='"db_backup_file_path" variable is mandatory')
         self.__db_backup_file_path=db_backup_file_path
     ### END ###
+
+    ### dump_timeout getter and setter ###
+    @property
+    def dump_timeout(self):
+        return self.__dump_timeout
+    
+    @dump_timeout.setter
+    def dump_timeout(self,dump_timeout):
+        if dump_timeout == None:
+            self.__dump_timeout = BackupConfig.DEFAULT_MARIADB_DUMP_TIMEOUT
+        else:
+            try:
+                self.__dump_timeout = int(dump_timeout)
+            except (ValueError,TypeError) as e:
+                raise MariaDBAppConfigException(message='"dump_timeout" must be a integer number')
+    ### END ###
+
+    ### dump_mode getter and setter ###
+    @property
+    def dump_mode(self):
+        return self.__dump_mode
+    
+    @dump_mode.setter
+    def dump_mode(self,dump_mode):
+        if dump_mode == None:
+            self.__dump_mode = BackupConfig.DEFAULT_MARIADB_DUMP_MODE
+        elif dump_mode not in ['FILE', 'STREAM', 'PARALLEL']:
+            raise MariaDBAppConfigException(message='"dump_mode" must be one of "FILE", "STREAM" or "PARALLEL"')
+        else:
+            self.__dump_mode=dump_mode
+    ### END ###
+
+    ### dump_local_path getter and setter ###
+    @property
+    def dump_local_path(self):
+        return self.__dump_local_path
+    
+    @dump_local_path.setter
+    def dump_local_path(self,dump_local_path):
+        if dump_local_path == None and self.dump_mode != 'FILE':
+            raise MariaDBAppConfigException(message='"dump_local_path" variable is mandatory when "dump_mode" is "' + self.dump_mode + '"')
+        self.__dump_local_path=dump_local_path
+    ### END ###
+
+    ### dump_compression getter and setter ###
+    @property
+    def dump_compression(self):
+        return self.__dump_compression
+    
+    @dump_compression.setter
+    def dump_compression(self,dump_compression):
+        if dump_compression == None:
+            self.__dump_compression = BackupConfig.DEFAULT_MARIADB_DUMP_COMPRESSION
+        elif dump_compression not in CompressedSink.COMPRESSIONS:
+            raise MariaDBAppConfigException(message='"dump_compression" must be one of ' + ", ".join(CompressedSink.COMPRESSIONS))
+        else:
+            self.__dump_compression=dump_compression
+    ### END ###
+
+    ### dump_workers getter and setter ###
+    @property
+    def dump_workers(self):
+        return self.__dump_workers
+    
+    @dump_workers.setter
+    def dump_workers(self,dump_workers):
+        if dump_workers == None:
+            self.__dump_workers = BackupConfig.DEFAULT_MARIADB_DUMP_WORKERS
+        else:
+            try:
+                self.__dump_workers = int(dump_workers)
+            except (ValueError,TypeError) as e:
+                raise MariaDBAppConfigException(message='"dump_workers" must be a integer number')
+            if self.__dump_workers < 1:
+                raise MariaDBAppConfigException(message='"dump_workers" must be greater than 0')
+    ### END ###
+
+    ### long_trx_threshold getter and setter ###
+    @property
+    def long_trx_threshold(self):
+        return self.__long_trx_threshold
+    
+    @long_trx_threshold.setter
+    def long_trx_threshold(self,long_trx_threshold):
+        if long_trx_threshold == None:
+            self.__long_trx_threshold = BackupConfig.DEFAULT_MARIADB_LONG_TRX_THRESHOLD
+        else:
+            try:
+                self.__long_trx_threshold = int(long_trx_threshold)
+            except (ValueError,TypeError) as e:
+                raise MariaDBAppConfigException(message='"long_trx_threshold" must be a integer number')
+    ### END ###
+
+    ### preflight_timeout getter and setter ###
+    @property
+    def preflight_timeout(self):
+        return self.__preflight_timeout
+    
+    @preflight_timeout.setter
+    def preflight_timeout(self,preflight_timeout):
+        if preflight_timeout == None:
+            self.__preflight_timeout = BackupConfig.DEFAULT_MARIADB_PREFLIGHT_TIMEOUT
+        else:
+            try:
+                self.__preflight_timeout = int(preflight_timeout)
+            except (ValueError,TypeError) as e:
+                raise MariaDBAppConfigException(message='"preflight_timeout" must be a integer number')
+    ### END ###
+
+    ### preflight_action getter and setter ###
+    @property
+    def preflight_action(self):
+        return self.__preflight_action
+    
+    @preflight_action.setter
+    def preflight_action(self,preflight_action):
+        if preflight_action == None:
+            self.__preflight_action = BackupConfig.DEFAULT_MARIADB_PREFLIGHT_ACTION
+        elif preflight_action not in ['WAIT', 'ABORT']:
+            raise MariaDBAppConfigException(message='"preflight_action" must be either "WAIT" or "ABORT"')
+        else:
+            self.__preflight_action=preflight_action
+    ### END ###
+
+    ### replica_app_name getter and setter ###
+    @property
+    def replica_app_name(self):
+        return self.__replica_app_name
+    
+    @replica_app_name.setter
+    def replica_app_name(self,replica_app_name):
+        # Optional. In FILE mode the dump would be written on the replica volume, which is not snapshotted
+        if replica_app_name != None and self.dump_mode == 'FILE':
+            raise MariaDBAppConfigException(message='"dump_mode" must be "STREAM" or "PARALLEL" when "replica_app_name" is set')
+        self.__replica_app_name=replica_app_name
+    ### END ###
+
+    ### replica_catchup_timeout getter and setter ###
+    @property
+    def replica_catchup_timeout(self):
+        return self.__replica_catchup_timeout
+    
+    @replica_catchup_timeout.setter
+    def replica_catchup_timeout(self,replica_catchup_timeout):
+        if replica_catchup_timeout == None:
+            self.__replica_catchup_timeout = BackupConfig.DEFAULT_MARIADB_REPLICA_CATCHUP_TIMEOUT
+        else:
+            try:
+                self.__replica_catchup_timeout = int(replica_catchup_timeout)
+            except (ValueError,TypeError) as e:
+                raise MariaDBAppConfigException(message='"replica_catchup_timeout" must be a integer number')
+    ### END ###
+
+    ### dump_strategy getter and setter ###
+    @property
+    def dump_strategy(self):
+        return self.__dump_strategy
+    
+    @dump_strategy.setter
+    def dump_strategy(self,dump_strategy):
+        if dump_strategy == None:
+            self.__dump_strategy = BackupConfig.DEFAULT_MARIADB_DUMP_STRATEGY
+        elif dump_strategy not in ['FULL', 'INCREMENTAL']:
+            raise MariaDBAppConfigException(message='"dump_strategy" must be either "FULL" or "INCREMENTAL"')
+        elif dump_strategy == 'INCREMENTAL' and self.dump_mode == 'FILE':
+            # The binlog segments are written to the local dump directory
+            raise MariaDBAppConfigException(message='"dump_mode" must not be "FILE" when "dump_strategy" is "INCREMENTAL"')
+        else:
+            self.__dump_strategy=dump_strategy
+    ### END ###
+
+    ### full_dump_interval getter and setter ###
+    @property
+    def full_dump_interval(self):
+        # Hours between two full dumps, the runs in between stream just the binlog
+        return self.__full_dump_interval
+    
+    @full_dump_interval.setter
+    def full_dump_interval(self,full_dump_interval):
+        if full_dump_interval == None:
+            self.__full_dump_interval = BackupConfig.DEFAULT_MARIADB_FULL_DUMP_INTERVAL
+        else:
+            try:
+                self.__full_dump_interval = int(full_dump_interval)
+            except (ValueError,TypeError) as e:
+                raise MariaDBAppConfigException(message='"full_dump_interval" must be a integer number')
+    ### END ###
+
+    ### change_detection getter and setter ###
+    @property
+    def change_detection(self):
+        return self.__change_detection
+    
+    @change_detection.setter
+    def change_detection(self,change_detection):
+        if change_detection == None:
+            self.__change_detection = BackupConfig.DEFAULT_MARIADB_CHANGE_DETECTION
+        elif change_detection not in ['ENABLED', 'DISABLED']:
+            raise MariaDBAppConfigException(message='"change_detection" must be either "ENABLED" or "DISABLED"')
+        else:
+            self.__change_detection=change_detection
+    ### END ###
+
+    ### fingerprint_tables getter and setter ###
+    @property
+    def fingerprint_tables(self):
+        return self.__fingerprint_tables
+    
+    @fingerprint_tables.setter
+    def fingerprint_tables(self,fingerprint_tables):
+        # List of "schema.table" to be checksummed as part of the change fingerprint
+        if fingerprint_tables == None:
+            self.__fingerprint_tables = []
+        else:
+            self.__fingerprint_tables = list(fingerprint_tables)
+    ### END ###
 ### END - Config ###
 
 ### Handler ###
@@ -86,15 +332,57 @@ class MariaDBAppHandlerException(AppHandlerException):
 
 
 class MariaDBAppHandler(Loggable):
-    __BACKUP_STAGE_START_CMD="BACKUP STAGE START"
-    __BACKUP_STAGE_BLOCK_COMMIT_CMD="BACKUP STAGE BLOCK_COMMIT"
-    __BACKUP_STAGE_END_CMD="BACKUP STAGE END"
-
+    # Placeholders replaced at run time in the commands below: they have to be defined first
     __PASSWORD_ESCAPE="____PASSWORD____"
     __FILE_PATH_ESCAPE="____FILE_PATH____"
-    __MYSQLDUMP_CMD="mysqldump --add-drop-database --add-drop-table --lock-all-tables --result-file=" + __FILE_PATH_ESCAPE + " --password=" + __PASSWORD_ESCAPE + " --all-databases"
+    __OPTIONS_ESCAPE="____OPTIONS____"
+
+    __BACKUP_STAGE_CMD="BACKUP STAGE "
+
+    # Work still running on the server which BACKUP STAGE BLOCK_COMMIT would have to wait for
+    __LONG_TRX_QUERY="SELECT COUNT(*), IFNULL(MAX(TIMESTAMPDIFF(SECOND, trx_started, NOW())), 0) FROM information_schema.INNODB_TRX " \
+        "WHERE TIMESTAMPDIFF(SECOND, trx_started, NOW()) >= ?"
+    __LONG_QUERIES_QUERY="SELECT COUNT(*), IFNULL(MAX(TIME), 0) FROM information_schema.PROCESSLIST " \
+        "WHERE COMMAND NOT IN ('Sleep', 'Daemon', 'Binlog Dump', 'Slave_IO', 'Slave_SQL', 'Slave_worker') AND TIME >= ?"
+    __PREFLIGHT_POLL_INTERVAL=1
+
+    __PRIMARY_GTID_QUERY="SELECT @@GLOBAL.gtid_binlog_pos"
+    __REPLICA_GTID_WAIT_QUERY="SELECT MASTER_GTID_WAIT(?, ?)"
+    __REPLICA_GTID_QUERY="SELECT @@GLOBAL.gtid_slave_pos"
+    __REPLICA_STOP_SQL_THREAD_CMD="STOP SLAVE SQL_THREAD"
+    __REPLICA_START_SQL_THREAD_CMD="START SLAVE SQL_THREAD"
+    # Position in the primary binlog of the last event applied by the replica
+    __REPLICA_STATUS_QUERY="SHOW SLAVE STATUS"
 
-    def __init__(self,config, k8s_api, mariadb_api, longhorn_api):
+    # The MariaDB connector doesn't speak the replication protocol, so the binlog is read by mysqlbinlog in the MariaDB pod
+    __MASTER_STATUS_QUERY="SHOW MASTER STATUS"
+    __BINARY_LOGS_QUERY="SHOW BINARY LOGS"
+    __BINLOG_FILE_ESCAPE="____BINLOG_FILE____"
+    # One mysqlbinlog per binlog file, so that the start and stop positions apply just to the file they belong to
+    __MYSQLBINLOG_CMD="mysqlbinlog --read-from-remote-server --host=127.0.0.1 --user=root --password=" + __PASSWORD_ESCAPE + \
+        __OPTIONS_ESCAPE + " " + __BINLOG_FILE_ESCAPE
+    __BINLOG_DIR_NAME="binlog"
+    # With --master-data=2 mysqldump writes the binlog position of its locked snapshot as a comment in the dump header
+    __MASTER_DATA_OPTION="--master-data=2"
+    __MASTER_DATA_REGEX=re.compile(r"CHANGE MASTER TO MASTER_LOG_FILE='([^']+)', MASTER_LOG_POS=([0-9]+)")
+    __MASTER_DATA_HEAD_BYTES=1048576
+    __MASTER_DATA_GREP_CMD="grep -m 1 -a -o -E \"CHANGE MASTER TO MASTER_LOG_FILE='[^']+', MASTER_LOG_POS=[0-9]+\" " + __FILE_PATH_ESCAPE
+
+    # Cheap change fingerprint sources: the GTID moves at every transaction written to the binlog, the tables
+    # update times at every change (since the server start for InnoDB), the checksums cover the configured tables.
+    # The InnoDB update times are lost at every restart and are not reliable on their own: without binlog the
+    # fingerprint is only trusted when it includes the checksums
+    __FINGERPRINT_GTID_QUERY="SELECT @@GLOBAL.log_bin, @@GLOBAL.gtid_binlog_pos"
+    __FINGERPRINT_TABLES_QUERY="SELECT COUNT(*), MAX(CREATE_TIME), MAX(UPDATE_TIME) FROM information_schema.TABLES " \
+        "WHERE TABLE_SCHEMA NOT IN ('information_schema', 'performance_schema', 'sys')"
+    __RUN_STATE_SECTION="mariadb"
+
+    __MYSQLDUMP_CMD="mysqldump --add-drop-database --add-drop-table --lock-all-tables " + __OPTIONS_ESCAPE + " --result-file=" + __FILE_PATH_ESCAPE + " --password=" + __PASSWORD_ESCAPE + " --all-databases"
+    # The dump is sent to stdout, read as binary data. --hex-blob keeps the dump a plain text file anyway
+    __MYSQLDUMP_STREAM_CMD="mysqldump --add-drop-database --add-drop-table --lock-all-tables --hex-blob " + __OPTIONS_ESCAPE + " --password=" + __PASSWORD_ESCAPE + " --all-databases"
+    __DUMP_FILE_NAME="all-databases.sql"
+
+    def __init__(self,config, k8s_api, mariadb_api, longhorn_api, replica_api=None, run_state=None):
         super().__init__(name="MARIADB-APP###", log_level=1)
 
         self.log_info(msg="Initializing MariaDB App Handler...")
@@ -103,8 +391,18 @@ class MariaDBAppHandler(Loggable):
             self.k8s_api=k8s_api
             self.mariadb_api=mariadb_api
             self.longhorn_api=longhorn_api
+            self.replica_api=replica_api
+            self.run_state=run_state
 
             self.__backup_mode=False
+            self.__backup_stage=None
+            self.__backup_stage_entered_at=None
+            self.__backup_stage_timings={}
+            self.__fingerprint=None
+            self.__dump_skipped=False
+            self.__unreliable_fingerprint_logged=False
+            self.__dump_master_data=False
+            self.__dump_binlog_position=None
         except:
             self.log_err(err="Unable to initialize MariaDB App Handler")
 
@@ -187,60 +485,599 @@ class MariaDBAppHandler(Loggable):
         self.__longhorn_api=longhorn_api
     ### END ###
 
+    ### replica_api getter and setter ###
+    @property
+    def replica_api(self):
+        return self.__replica_api
+    
+    @replica_api.setter
+    def replica_api(self,replica_api):
+        # Mandatory just when the db backup in SQL format is created on a replica
+        if replica_api == None:
+            if self.config.replica_app_name != None:
+                self.log_err(err='"replica_api" variable is mandatory when the replica is configured')
+                raise MariaDBAppHandlerException(message='"replica_api" variable is mandatory when the replica is configured')
+        elif type(replica_api) != MariaDBApiInstanceHandler:
+            self.log_err(err='"replica_api" variable must be of type "MariaDBApiInstanceHandler"')
+            raise MariaDBAppHandlerException(message='"replica_api" variable must be of type "MariaDBApiInstanceHandler"')
+        self.__replica_api=replica_api
+    ### END ###
+
+    ### run_state getter and setter ###
+    @property
+    def run_state(self):
+        return self.__run_state
+    
+    @run_state.setter
+    def run_state(self,run_state):
+        # Mandatory just for the incremental db backups and the change detection, which depend on the previous run
+        if run_state == None:
+            if self.config.dump_strategy == 'INCREMENTAL' or self.config.change_detection == 'ENABLED':
+                self.log_err(err='"run_state" variable is mandatory when the dump strategy is "INCREMENTAL" or the change detection is enabled')
+                raise MariaDBAppHandlerException(message='"run_state" variable is mandatory when the dump strategy is "INCREMENTAL" or the change detection is enabled')
+        elif type(run_state) != RunState:
+            self.log_err(err='"run_state" variable must be of type "RunState"')
+            raise MariaDBAppHandlerException(message='"run_state" variable must be of type "RunState"')
+        self.__run_state=run_state
+    ### END ###
+
+    ### dump_skipped getter ###
+    @property
+    def dump_skipped(self):
+        return self.__dump_skipped
+    ### END ###
+
     ### backup_mode getter ###
     @property
     def backup_mode(self):
         return self.__backup_mode
     ### END ###
 
+    ### backup_stage and backup_stage_timings getters ###
+    @property
+    def backup_stage(self):
+        return self.__backup_stage
+
+    @property
+    def backup_stage_timings(self):
+        # {stage: {"wait": seconds taken to enter the stage, "held": seconds spent in the stage}}
+        return self.__backup_stage_timings
+    ### END ###
+
     ### Methods implementation ###
+    def get_actual_volume_pv_name(self):
+        try:
+            return self.k8s_api.get_pv_name_from_pvc_name(pvc_name=self.config.db_actual_volume_name)
+        except K8sApiInstanceHandlerException as e:
+            self.log_err(err="Unable to retrieve the MariaDB actual volume name")
+            raise MariaDBAppHandlerException(message="Unable to retrieve the MariaDB actual volume name. The issue is the following:\n" + str(e))
+
+    def get_backup_volume_pv_name(self):
+        try:
+            return self.k8s_api.get_pv_name_from_pvc_name(pvc_name=self.config.db_backup_volume_name)
+        except K8sApiInstanceHandlerException as e:
+            self.log_err(err="Unable to retrieve the MariaDB backup volume name")
+            raise MariaDBAppHandlerException(message="Unable to retrieve the MariaDB backup volume name. The issue is the following:\n" + str(e))
+
+    def get_warm_up_tasks(self):
+        # Lookups to be done before entering Nextcloud maintenance mode, so that the maintenance window contains just the snapshots
+        tasks={
+            "mariadb-actual-volume": self.warm_up_actual_volume,
+            "mariadb-backup-volume": self.warm_up_backup_volume,
+            "mariadb-pod": self.warm_up_pod
+        }
+        if self.config.replica_app_name != None:
+            tasks["mariadb-replica-pod"]=self.warm_up_replica_pod
+        return tasks
+
+    def warm_up_actual_volume(self):
+        pv_name=self.get_actual_volume_pv_name()
+        try:
+            self.longhorn_api.check_volume_health(pv_name=pv_name)
+        except LonghornApiInstanceHandlerException as e:
+            self.log_err(err="The MariaDB actual volume is not ready to be snapshotted")
+            raise MariaDBAppHandlerException(message="The MariaDB actual volume is not ready to be snapshotted. The issue is the following:\n" + str(e))
+
+    def warm_up_backup_volume(self):
+        pv_name=self.get_backup_volume_pv_name()
+        try:
+            self.longhorn_api.check_volume_health(pv_name=pv_name)
+        except LonghornApiInstanceHandlerException as e:
+            self.log_err(err="The MariaDB backup volume is not ready to be snapshotted")
+            raise MariaDBAppHandlerException(message="The MariaDB backup volume is not ready to be snapshotted. The issue is the following:\n" + str(e))
+
+    def warm_up_pod(self):
+        try:
+            self.k8s_api.get_running_pod_by_label(label="app="+self.config.db_app_name)
+        except K8sApiInstanceHandlerException as e:
+            self.log_err(err="Unable to retrieve the MariaDB pod")
+            raise MariaDBAppHandlerException(message="Unable to retrieve the MariaDB pod. The issue is the following:\n" + str(e))
+
+    def warm_up_replica_pod(self):
+        try:
+            self.k8s_api.get_running_pod_by_label(label="app="+self.config.replica_app_name)
+        except K8sApiInstanceHandlerException as e:
+            self.log_err(err="Unable to retrieve the MariaDB replica pod")
+            raise MariaDBAppHandlerException(message="Unable to retrieve the MariaDB replica pod. The issue is the following:\n" + str(e))
+
+    def get_dump_app_name(self):
+        # The db backup in SQL format is created on the replica, when there is one
+        if self.config.replica_app_name != None:
+            return self.config.replica_app_name
+        return self.config.db_app_name
+
+    def get_change_fingerprint(self):
+        # The queries are run in parallel on the pooled connections
+        queries={
+            "gtid": lambda: self.mariadb_api.exec_sql_query(MariaDBAppHandler.__FINGERPRINT_GTID_QUERY),
+            "tables": lambda: self.mariadb_api.exec_sql_query(MariaDBAppHandler.__FINGERPRINT_TABLES_QUERY)
+        }
+        if len(self.config.fingerprint_tables) > 0:
+            checksum_cmd="CHECKSUM TABLE " + ", ".join([".".join([quote_identifier(part) for part in table.split(".")]) for table in self.config.fingerprint_tables])
+            queries["checksums"]=lambda: self.mariadb_api.exec_sql_query(checksum_cmd)
+        try:
+            tasks=WorkerPool(max_workers=len(queries)).run(queries)
+        except WorkerPoolException as e:
+            self.log_err(err="Unable to compute the MariaDB change fingerprint")
+            raise MariaDBAppHandlerException(message="Unable to compute the MariaDB change fingerprint. The issue is the following:\n" + str(e))
+
+        if int(tasks["gtid"].result[0][0]) == 0 and len(self.config.fingerprint_tables) == 0:
+            if not self.__unreliable_fingerprint_logged:
+                self.log_err(err="The MariaDB binlog is disabled and MARIADB_FINGERPRINT_TABLES is not set: the changes can't be reliably detected, the db backup in SQL format is never skipped")
+                self.__unreliable_fingerprint_logged=True
+            return None
+
+        components={name: [[str(column) for column in row] for row in task.result] for name, task in tasks.items()}
+        return hashlib.sha256(json.dumps(components, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def is_backup_volume_unchanged(self, full_backup):
+        # The backup volume snapshot and backup are not needed when the dump was skipped, unless a backup is
+        # requested and the last backed up dump is older than the current one
+        if not self.dump_skipped:
+            return False
+        return not full_backup or self.__fingerprint == self.run_state.get(MariaDBAppHandler.__RUN_STATE_SECTION, "backed_up_fingerprint")
+
+    def save_change_fingerprint(self, full_backup):
+        # To be called once the run completed: the next run compares its fingerprint with this one
+        if self.__fingerprint == None:
+            return
+        self.run_state.set(MariaDBAppHandler.__RUN_STATE_SECTION, "fingerprint", self.__fingerprint)
+        if full_backup:
+            self.run_state.set(MariaDBAppHandler.__RUN_STATE_SECTION, "backed_up_fingerprint", self.__fingerprint)
+        self.__save_run_state()
+
+    def create_mariadb_dump(self):
+        # Taken before the dump, so that the changes done while dumping are seen by the next run
+        if self.config.change_detection == 'ENABLED':
+            self.__fingerprint=self.get_change_fingerprint()
+            if self.__fingerprint != None and self.__fingerprint == self.run_state.get(MariaDBAppHandler.__RUN_STATE_SECTION, "fingerprint"):
+                self.log_info("DONE. MariaDB unchanged since the previous run. Skipping the db backup in SQL format")
+                self.__dump_skipped=True
+                return None
+            self.__dump_skipped=False
+
+        if self.config.dump_strategy == 'INCREMENTAL' and self.is_incremental_dump_due():
+            try:
+                return self.create_mariadb_binlog_segment()
+            except MariaDBAppHandlerException as e:
+                self.log_err(err="Unable to create the incremental db backup, creating a full one. The issue is the following: " + str(e))
+        return self.create_mariadb_full_dump()
+
+    def create_mariadb_full_dump(self):
+        # The next incremental db backups start from the binlog position of the dump snapshot itself: any position
+        # read outside of the dump lock would make the events committed in between be both in the dump and in the
+        # next binlog segment
+        incremental=self.config.dump_strategy == 'INCREMENTAL'
+        position=None
+        self.__dump_master_data=False
+        self.__dump_binlog_position=None
+
+        if self.config.replica_app_name != None:
+            with self.paused_replica() as replica_gtid_pos:
+                # The replica data doesn't move while the replication is paused
+                if incremental:
+                    position=self.get_replica_applied_position(gtid=replica_gtid_pos)
+                result=self.__create_mariadb_dump()
+        else:
+            # mysqldump fails asking for the position when the binlog is disabled
+            self.__dump_master_data=incremental and self.get_binlog_position() != None
+            result=self.__create_mariadb_dump()
+            # The parallel dump records the position in its manifest, mysqldump in its header
+            if type(result) == dict:
+                position=result.get("binlog_position")
+            else:
+                position=self.__dump_binlog_position
+            if self.__dump_master_data and position == None:
+                raise MariaDBAppHandlerException(message="Unable to find the binlog position in the mysqldump header")
+
+        if incremental:
+            self.__record_full_dump(position)
+        return result
+
+    def __create_mariadb_dump(self):
+        if self.config.dump_mode == 'STREAM':
+            return self.create_mariadb_mysqldump_stream()
+        if self.config.dump_mode == 'PARALLEL':
+            return self.create_mariadb_parallel_dump()
+        return self.create_mariadb_mysqldump()
+
+    def get_binlog_position(self):
+        try:
+            rows=self.mariadb_api.exec_sql_query(MariaDBAppHandler.__MASTER_STATUS_QUERY)
+            gtid=self.mariadb_api.exec_sql_query(MariaDBAppHandler.__PRIMARY_GTID_QUERY)[0][0]
+        except MariaDBApiInstanceHandlerException as e:
+            self.log_err(err="Unable to retrieve the MariaDB binlog position")
+            raise MariaDBAppHandlerException(message="Unable to retrieve the MariaDB binlog position. The issue is the following:\n" + str(e))
+        # No rows when the binlog is disabled
+        if len(rows) == 0:
+            return None
+        return {"file": rows[0][0], "position": int(rows[0][1]), "gtid": gtid}
+
+    def get_replica_applied_position(self, gtid):
+        # To be called while the replication is paused: the primary binlog position of the replica data
+        try:
+            rows=self.replica_api.exec_sql_query(MariaDBAppHandler.__REPLICA_STATUS_QUERY, dictionary=True)
+        except MariaDBApiInstanceHandlerException as e:
+            self.log_err(err="Unable to retrieve the MariaDB replica status")
+            raise MariaDBAppHandlerException(message="Unable to retrieve the MariaDB replica status. The issue is the following:\n" + str(e))
+        if len(rows) == 0:
+            raise MariaDBAppHandlerException(message="The MariaDB replica is not replicating from any primary")
+        return {"file": rows[0]["Relay_Master_Log_File"], "position": int(rows[0]["Exec_Master_Log_Pos"]), "gtid": gtid}
+
+    def __parse_master_data(self, text):
+        match=MariaDBAppHandler.__MASTER_DATA_REGEX.search(text)
+        if match == None:
+            return None
+        return {"file": match.group(1), "position": int(match.group(2)), "gtid": None}
+
+    def is_incremental_dump_due(self):
+        last_full_dump=self.run_state.get(MariaDBAppHandler.__RUN_STATE_SECTION, "last_full_dump")
+        last_position=self.run_state.get(MariaDBAppHandler.__RUN_STATE_SECTION, "last_position")
+        if last_full_dump == None or last_position == None:
+            self.log_info("No previous full db backup with a binlog position. Creating a full one")
+            return False
+        if time.time() - last_full_dump["created_at"] >= self.config.full_dump_interval * 3600:
+            self.log_info("The last full db backup is older than " + str(self.config.full_dump_interval) + " hours. Creating a full one")
+            return False
+        return True
+
+    def get_binlog_files(self, start, stop):
+        # The binlog files from the start file to the stop file, in order. A file already purged makes the segment impossible
+        try:
+            files=[row[0] for row in self.mariadb_api.exec_sql_query(MariaDBAppHandler.__BINARY_LOGS_QUERY)]
+        except MariaDBApiInstanceHandlerException as e:
+            self.log_err(err="Unable to list the MariaDB binlog files")
+            raise MariaDBAppHandlerException(message="Unable to list the MariaDB binlog files. The issue is the following:\n" + str(e))
+        if start["file"] not in files or stop["file"] not in files or files.index(start["file"]) > files.index(stop["file"]):
+            raise MariaDBAppHandlerException(message="The binlog files from " + start["file"] + " to " + stop["file"] + " are not all available anymore")
+        return files[files.index(start["file"]):files.index(stop["file"]) + 1]
+
+    @staticmethod
+    def get_mysqlbinlog_command(files, start_position, stop_position, password):
+        # The start position applies to the first file, the stop position to the last one, both to the same file
+        # when there's just one. The files in between are read whole
+        commands=[]
+        for index, file in enumerate(files):
+            options=""
+            if index == 0:
+                options+=" --start-position=" + str(start_position)
+            if index == len(files) - 1:
+                options+=" --stop-position=" + str(stop_position)
+            commands.append(MariaDBAppHandler.__MYSQLBINLOG_CMD\
+                .replace(MariaDBAppHandler.__PASSWORD_ESCAPE,password)\
+                .replace(MariaDBAppHandler.__OPTIONS_ESCAPE,options)\
+                .replace(MariaDBAppHandler.__BINLOG_FILE_ESCAPE,file))
+        return " && ".join(commands)
+
+    def check_binlog_segments(self, segments):
+        # Each segment has to cover its files from its start to its stop position and to start where the previous one stopped
+        for index, segment in enumerate(segments):
+            files=segment.get("files")
+            if files == None or len(files) == 0 or files[0] != segment["start"]["file"] or files[-1] != segment["stop"]["file"]:
+                raise MariaDBAppHandlerException(message="The binlog segment " + segment["file"] + " doesn't cover the files from its start to its stop position")
+            if index > 0 and (segments[index - 1]["stop"]["file"] != segment["start"]["file"] or
+                    segments[index - 1]["stop"]["position"] != segment["start"]["position"]):
+                raise MariaDBAppHandlerException(message="The binlog segment " + segment["file"] + " doesn't start where the previous one stopped")
+
+    def create_mariadb_binlog_segment(self):
+        start=self.run_state.get(MariaDBAppHandler.__RUN_STATE_SECTION, "last_position")
+        stop=self.get_binlog_position()
+        if stop == None:
+            raise MariaDBAppHandlerException(message="The MariaDB binlog is disabled")
+        if stop["file"] == start["file"] and stop["position"] == start["position"]:
+            self.log_info("DONE. No changes since the last db backup, no binlog segment to create")
+            return None
+
+        segments=self.run_state.get(MariaDBAppHandler.__RUN_STATE_SECTION, "segments", [])
+        file_name="{:06d}".format(len(segments) + 1) + "_" + start["file"] + "_" + str(start["position"]) + ".sql" + CompressedSink.COMPRESSIONS[self.config.dump_compression]
+        files=self.get_binlog_files(start, stop)
+        segment={"file": file_name, "start": start, "stop": stop, "files": files}
+        self.check_binlog_segments(segments + [segment])
+        file_path=os.path.join(self.config.dump_local_path, MariaDBAppHandler.__BINLOG_DIR_NAME, file_name)
+        self.log_info("Streaming the binlog from " + start["file"] + ":" + str(start["position"]) + " to " + stop["file"] + ":" + str(stop["position"]) +
+            " (" + str(len(files)) + " files) into " + file_path + "...")
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with CompressedSink(file_path=file_path, compression=self.config.dump_compression) as sink:
+                with self.k8s_api.exec_container_command_stream(
+                    pod_label="app="+self.config.db_app_name,
+                    command=MariaDBAppHandler.get_mysqlbinlog_command(files=files, start_position=start["position"], stop_position=stop["position"],
+                        password=self.config.db_root_password),
+                    timeout=self.config.dump_timeout,
+                    max_output_bytes=0,
+                    binary_stdout=True) as binlog_stream:
+                    for channel, data in binlog_stream:
+                        if channel == "stdout":
+                            sink.write(data)
+                        else:
+                            for line in data.splitlines():
+                                if line != "":
+                                    self.log_err(err="mysqlbinlog stderr: " + line)
+
+                    if binlog_stream.returncode != 0:
+                        raise MariaDBAppHandlerException(message="mysqlbinlog exited with code " + str(binlog_stream.returncode))
+        except (K8sApiInstanceHandlerException,CompressedSinkException,MariaDBAppHandlerException,OSError) as e:
+            self.log_err(err="Unable to stream the binlog")
+            raise MariaDBAppHandlerException(message="Unable to stream the binlog. The issue is the following:\n" + str(e))
+
+        segment["created_at"]=time.time()
+        segments.append(segment)
+        self.run_state.set(MariaDBAppHandler.__RUN_STATE_SECTION, "segments", segments)
+        self.run_state.set(MariaDBAppHandler.__RUN_STATE_SECTION, "last_position", stop)
+        self.__save_run_state()
+
+        self.log_info("DONE. Binlog segment successfully streamed: " + str(sink.bytes_in) + " bytes dumped, " + str(sink.bytes_out) + " bytes written (" + self.config.dump_compression + ") in " +
+            "{:.3f}".format(sink.duration) + "s")
+        return sink
+
+    def __record_full_dump(self, position):
+        if position == None:
+            self.log_info("The MariaDB binlog is disabled, the next db backups will be full ones")
+            self.run_state.delete(MariaDBAppHandler.__RUN_STATE_SECTION, "last_full_dump")
+            self.run_state.delete(MariaDBAppHandler.__RUN_STATE_SECTION, "last_position")
+        else:
+            self.run_state.set(MariaDBAppHandler.__RUN_STATE_SECTION, "last_full_dump", {"created_at": time.time(), "position": position})
+            self.run_state.set(MariaDBAppHandler.__RUN_STATE_SECTION, "last_position", position)
+
+        # The binlog segments of the previous full dump are not needed anymore
+        self.run_state.set(MariaDBAppHandler.__RUN_STATE_SECTION, "segments", [])
+        self.__save_run_state()
+        binlog_dir=os.path.join(self.config.dump_local_path, MariaDBAppHandler.__BINLOG_DIR_NAME)
+        try:
+            if os.path.isdir(binlog_dir):
+                for entry in os.scandir(binlog_dir):
+                    if entry.is_file():
+                        os.remove(entry.path)
+        except OSError as e:
+            self.log_err(err="Unable to remove the old binlog segments: " + str(e))
+
+    def __save_run_state(self):
+        try:
+            self.run_state.save()
+        except RunStateException as e:
+            self.log_err(err="Unable to save the db backups state")
+            raise MariaDBAppHandlerException(message="Unable to save the db backups state. The issue is the following:\n" + str(e))
+
+    @contextmanager
+    def paused_replica(self):
+        # Wait for the replica to apply everything the primary has written so far, then stop applying the changes
+        # so that the replica data doesn't move while dumping. The replication restarts once the 'with' block ends
+        self.log_info("Pausing the replication on the MariaDB replica...")
+        try:
+            gtid_pos=self.mariadb_api.exec_sql_query(MariaDBAppHandler.__PRIMARY_GTID_QUERY)[0][0]
+            self.log_info("Waiting for the replica to reach the primary GTID position '" + gtid_pos + "'...")
+            if int(self.replica_api.exec_sql_query(MariaDBAppHandler.__REPLICA_GTID_WAIT_QUERY, (gtid_pos, self.config.replica_catchup_timeout))[0][0]) != 0:
+                raise MariaDBAppHandlerException(message="The replica did not reach the primary GTID position '" + gtid_pos + "' in " + str(self.config.replica_catchup_timeout) + "s")
+            self.replica_api.exec_sql_command(MariaDBAppHandler.__REPLICA_STOP_SQL_THREAD_CMD)
+        except (MariaDBApiInstanceHandlerException,MariaDBAppHandlerException) as e:
+            self.log_err(err="Unable to pause the replication on the MariaDB replica")
+            raise MariaDBAppHandlerException(message="Unable to pause the replication on the MariaDB replica. The issue is the following:\n" + str(e))
+
+        try:
+            replica_gtid_pos=self.replica_api.exec_sql_query(MariaDBAppHandler.__REPLICA_GTID_QUERY)[0][0]
+            self.log_info("DONE. Replication paused at the GTID position '" + replica_gtid_pos + "'")
+            yield replica_gtid_pos
+        finally:
+            self.log_info("Resuming the replication on the MariaDB replica...")
+            try:
+                self.replica_api.exec_sql_command(MariaDBAppHandler.__REPLICA_START_SQL_THREAD_CMD)
+                self.log_info("DONE. Replication resumed")
+            except MariaDBApiInstanceHandlerException as e:
+                self.log_err(err="Unable to resume the replication on the MariaDB replica. Run 'START SLAVE SQL_THREAD' on it")
+
+    def create_mariadb_parallel_dump(self):
+        # The dump is taken over the SQL connection, one compressed file per table, by several workers sharing the same consistent snapshot
+        self.log_info("Creating the parallel dump in " + self.config.dump_local_path + "...")
+        try:
+            manifest=MariaDBDumpEngine(
+                mariadb_api=self.replica_api if self.config.replica_app_name != None else self.mariadb_api,
+                workers=self.config.dump_workers,
+                compression=self.config.dump_compression
+            ).dump(output_dir=self.config.dump_local_path)
+        except MariaDBDumpEngineException as e:
+            self.log_err(err="Unable to create the parallel dump")
+            raise MariaDBAppHandlerException(message="Unable to create the parallel dump. The issue is the following:\n" + str(e))
+        self.log_info("DONE. Parallel dump successfully created")
+        return manifest
+
+    def create_mariadb_mysqldump_stream(self):
+        file_path=os.path.join(self.config.dump_local_path, MariaDBAppHandler.__DUMP_FILE_NAME + CompressedSink.COMPRESSIONS[self.config.dump_compression])
+        self.log_info("Streaming the mysqldump backup to " + file_path + "...")
+        try:
+            with CompressedSink(file_path=file_path, compression=self.config.dump_compression) as sink:
+                with self.k8s_api.exec_container_command_stream(
+                    pod_label="app="+self.get_dump_app_name(),
+                    command=(MariaDBAppHandler.__MYSQLDUMP_STREAM_CMD)\
+                        .replace(MariaDBAppHandler.__PASSWORD_ESCAPE,self.config.db_root_password)\
+                        .replace(MariaDBAppHandler.__OPTIONS_ESCAPE,self.__get_mysqldump_options()),
+                    timeout=self.config.dump_timeout,
+                    max_output_bytes=0,
+                    binary_stdout=True) as dump_stream:
+                    # The dump comes on stdout and goes straight to the compressing sink, the messages on stderr are logged.
+                    # The binlog position, if requested, is looked for in the dump header
+                    head=b"" if self.__dump_master_data else None
+                    for channel, data in dump_stream:
+                        if channel == "stdout":
+                            sink.write(data)
+                            if head != None:
+                                head+=data
+                                self.__dump_binlog_position=self.__parse_master_data(head.decode("utf-8", "replace"))
+                                if self.__dump_binlog_position != None or len(head) > MariaDBAppHandler.__MASTER_DATA_HEAD_BYTES:
+                                    head=None
+                        else:
+                            for line in data.splitlines():
+                                if line != "":
+                                    self.log_err(err="mysqldump stderr: " + line)
+
+                if dump_stream.returncode != 0:
+                    raise MariaDBAppHandlerException(message="mysqldump exited with code " + str(dump_stream.returncode))
+        except (K8sApiInstanceHandlerException,CompressedSinkException,MariaDBAppHandlerException) as e:
+            self.log_err(err="Unable to stream the mysqldump backup")
+            raise MariaDBAppHandlerException(message="Unable to stream the mysql dump. The issue is the following:\n" + str(e))
+
+        self.log_info("DONE. mysqldump backup successfully streamed: " + str(sink.bytes_in) + " bytes dumped, " + str(sink.bytes_out) + " bytes written (" + self.config.dump_compression + ") in " +
+            "{:.3f}".format(sink.duration) + "s, " + "{:.2f}".format(sink.throughput / 1048576) + " MiB/s")
+        return sink
+
     def create_mariadb_mysqldump(self):
         self.log_info("Creating mysqldump backup file...")
         try:
-            resp = self.k8s_api.exec_container_command(
+            with self.k8s_api.exec_container_command_stream(
                 pod_label="app="+self.config.db_app_name, 
                 command=(MariaDBAppHandler.__MYSQLDUMP_CMD)\
                     .replace(MariaDBAppHandler.__PASSWORD_ESCAPE,self.config.db_root_password)\
-                    .replace(MariaDBAppHandler.__FILE_PATH_ESCAPE,self.config.db_backup_file_path))
+                    .replace(MariaDBAppHandler.__OPTIONS_ESCAPE,self.__get_mysqldump_options())\
+                    .replace(MariaDBAppHandler.__FILE_PATH_ESCAPE,self.config.db_backup_file_path),
+                timeout=self.config.dump_timeout) as dump_stream:
+                # The dump is written to the result file, so just the messages are streamed back. Log them as they arrive
+                for channel, data in dump_stream:
+                    for line in data.splitlines():
+                        if line == "":
+                            continue
+                        if channel == "stderr":
+                            self.log_err(err="mysqldump " + channel + ": " + line)
+                        else:
+                            self.log_info(msg="mysqldump " + channel + ": " + line)
         except K8sApiInstanceHandlerException as e:
             self.log_err(err="Unable to create mysqldump backup file")
-            raise MariaDBAppHandlerException(message="Unable to create mysql dumpfile. The issue is the following:\n" + e)
+            raise MariaDBAppHandlerException(message="Unable to create mysql dumpfile. The issue is the following:\n" + str(e))
 
-        if resp != "":
+        if dump_stream.returncode != 0:
             self.log_err(err="Unable to create mysqldump backup file")
-            raise MariaDBAppHandlerException(message="Unable to create mysql dumpfile. The issue is the following:\n" + resp)
+            raise MariaDBAppHandlerException(message="Unable to create mysql dumpfile. mysqldump exited with code " + str(dump_stream.returncode))
+
+        # The binlog position, if requested, is in the dump file header, in the MariaDB pod
+        if self.__dump_master_data:
+            try:
+                self.__dump_binlog_position=self.__parse_master_data(self.k8s_api.exec_container_command(
+                    pod_label="app="+self.config.db_app_name,
+                    command=(MariaDBAppHandler.__MASTER_DATA_GREP_CMD).replace(MariaDBAppHandler.__FILE_PATH_ESCAPE,self.config.db_backup_file_path)))
+            except K8sApiInstanceHandlerException as e:
+                self.log_err(err="Unable to read the binlog position from the mysqldump backup file")
+                raise MariaDBAppHandlerException(message="Unable to read the binlog position from the mysqldump backup file. The issue is the following:\n" + str(e))
         self.log_info("DONE. mysqldump backup file successfully created")
 
+    def __get_mysqldump_options(self):
+        return MariaDBAppHandler.__MASTER_DATA_OPTION if self.__dump_master_data else ""
+
+    def get_long_running_work(self):
+        try:
+            trx=self.mariadb_api.exec_sql_query(MariaDBAppHandler.__LONG_TRX_QUERY, (self.config.long_trx_threshold,))[0]
+            queries=self.mariadb_api.exec_sql_query(MariaDBAppHandler.__LONG_QUERIES_QUERY, (self.config.long_trx_threshold,))[0]
+        except MariaDBApiInstanceHandlerException as e:
+            self.log_err(err="Unable to check the long running transactions and queries")
+            raise MariaDBAppHandlerException(message="Unable to check the long running transactions and queries. The issue is the following:\n" + str(e))
+        return {
+            "transactions": int(trx[0]),
+            "transactions_max_age": int(trx[1]),
+            "queries": int(queries[0]),
+            "queries_max_time": int(queries[1])
+        }
+
+    def wait_for_long_running_work(self):
+        # Entering the backup stages while a long transaction is running would make BLOCK_COMMIT wait for it, blocking every writer meanwhile.
+        # To be run before entering Nextcloud maintenance mode, so that the wait is not part of the maintenance window
+        self.log_info(msg="Checking for transactions and queries running for more than " + str(self.config.long_trx_threshold) + "s...")
+        deadline=time.monotonic() + self.config.preflight_timeout
+        while True:
+            work=self.get_long_running_work()
+            if work["transactions"] == 0 and work["queries"] == 0:
+                self.log_info(msg="DONE. No long running transactions or queries")
+                return
+
+            msg=str(work["transactions"]) + " long running transactions (oldest " + str(work["transactions_max_age"]) + "s) and " + \
+                str(work["queries"]) + " long running queries (longest " + str(work["queries_max_time"]) + "s)"
+            if self.config.preflight_action == 'ABORT' or time.monotonic() >= deadline:
+                self.log_err(err=msg + ". Not entering MariaDB backup mode")
+                raise MariaDBAppHandlerException(message=msg + ". Not entering MariaDB backup mode")
+            self.log_info(msg=msg + ". Waiting for them to complete...")
+            time.sleep(MariaDBAppHandler.__PREFLIGHT_POLL_INTERVAL)
+
+    def __run_backup_stage(self, stage):
+        # The backup stages are run on the pinned MariaDB session, the same for all of them
+        requested_at=time.monotonic()
+        self.mariadb_api.exec_sql_command(MariaDBAppHandler.__BACKUP_STAGE_CMD + stage)
+        entered_at=time.monotonic()
+
+        if self.__backup_stage != None:
+            self.__backup_stage_timings[self.__backup_stage]["held"]=entered_at - self.__backup_stage_entered_at
+        self.__backup_stage_timings[stage]={"wait": entered_at - requested_at, "held": None}
+        self.__backup_stage=stage
+        self.__backup_stage_entered_at=entered_at
+        self.log_info(msg="BACKUP STAGE " + stage + " entered in " + "{:.3f}".format(entered_at - requested_at) + "s")
+
     def enter_backup_mode(self):
+        # BLOCK_COMMIT is not entered here: it must be held just for the MariaDB actual volume snapshot, see block_commit()
         self.log_info(msg="Enabling MariaDB backup mode...")
+        if self.backup_mode == True:
+            self.log_info("MariaDB backup mode already enabled")
+            return
+
         try:
-            if self.backup_mode == False:
-                self.mariadb_api.exec_sql_command(MariaDBAppHandler.__BACKUP_STAGE_START_CMD)
-                self.mariadb_api.exec_sql_command(MariaDBAppHandler.__BACKUP_STAGE_BLOCK_COMMIT_CMD)
-                self.__backup_mode=True
-            else:
-                self.log_info("MariaDB backup mode already enabled")
-        except:
+            self.__backup_stage_timings={}
+            self.__run_backup_stage("START")
+            self.__backup_mode=True
+            self.__run_backup_stage("FLUSH")
+            self.__run_backup_stage("BLOCK_DDL")
+        except MariaDBApiInstanceHandlerException as e:
             self.log_err(err="Unable to enable MariaDB backup mode")
-            raise MariaDBAppHandlerException(message="Unable to enter backup mode")
+            raise MariaDBAppHandlerException(message="Unable to enter backup mode. The issue is the following:\n" + str(e))
         self.log_info(msg="DONE. successfully enabled MariaDB backup mode")
 
+    def block_commit(self):
+        self.log_info(msg="Blocking the MariaDB commits...")
+        if self.backup_stage != "BLOCK_DDL":
+            self.log_err(err="MariaDB backup mode not enabled. Cannot block the commits")
+            raise MariaDBAppHandlerException(message="MariaDB backup mode not enabled. Cannot block the commits")
+        try:
+            self.__run_backup_stage("BLOCK_COMMIT")
+        except MariaDBApiInstanceHandlerException as e:
+            self.log_err(err="Unable to block the MariaDB commits")
+            raise MariaDBAppHandlerException(message="Unable to block the commits. The issue is the following:\n" + str(e))
+        self.log_info(msg="DONE. MariaDB commits blocked")
+
     def exit_backup_mode(self):
         self.log_info(msg="Disabling MariaDB backup mode...")
         try:
             if self.backup_mode == True:
-                self.mariadb_api.exec_sql_command(MariaDBAppHandler.__BACKUP_STAGE_END_CMD)
+                self.__run_backup_stage("END")
                 self.__backup_mode=False
+                self.__backup_stage=None
             else:
                 self.log_info("MariaDB backup mode already disabled")
+                return
         except:
             self.log_err(err="Unable to disable backup mode. Check that the DB works well after the end of this process")
             raise MariaDBAppHandlerException(message="Unable to disable backup mode. Check that the DB works well after the end of this process")
-        self.log_info(msg="DONE. successfully disabled MariaDB backup mode")
+
+        self.log_info(msg="DONE. successfully disabled MariaDB backup mode. Stages timings: " + ", ".join([
+            stage + " entered in " + "{:.3f}".format(timing["wait"]) + "s" + (" and held for " + "{:.3f}".format(timing["held"]) + "s" if timing["held"] != None else "")
+            for stage, timing in self.__backup_stage_timings.items()
+        ]))
 
     def create_actual_volume_snapshot(self, snapshot_name):
         self.log_info(msg="Creating the MariaDB volume snapshot with name " + snapshot_name + "...")
-        if self.backup_mode:
+        if self.backup_stage == "BLOCK_COMMIT":
             try:
                 self.longhorn_api.create_volume_snapshot(
                     snapshot_name=snapshot_name,
@@ -248,26 +1085,22 @@ class MariaDBAppHandler(Loggable):
                 )
             except (K8sApiInstanceHandlerException,LonghornApiInstanceHandlerException) as e:
                 self.log_err(err="Unable to create the snapshot")
-                raise MariaDBAppHandlerException(message="Unable to create the snapshot. The issue is the following:\n" + e)
+                raise MariaDBAppHandlerException(message="Unable to create the snapshot. The issue is the following:\n" + str(e))
         else:
-            self.log_err(err="MariaDB backup mode not enabled. Cannot continue with the snapshot creation")
-            raise MariaDBAppHandlerException(message="MariaDB backup mode not enabled. Cannot continue with the snapshot creation")
+            self.log_err(err="MariaDB commits not blocked. Cannot continue with the snapshot creation")
+            raise MariaDBAppHandlerException(message="MariaDB commits not blocked. Cannot continue with the snapshot creation")
         self.log_info(msg="DONE. MariaDB volume snapshot " + snapshot_name + " successfully created")
 
     def create_actual_volume_backup(self, snapshot_name):
         self.log_info(msg="Creating the MariaDB volume backup from the snapshot" + snapshot_name + "...")
-        if self.backup_mode:
-            try:
-                self.longhorn_api.create_volume_backup(
-                    snapshot_name=snapshot_name,
-                    pv_name=self.k8s_api.get_pv_name_from_pvc_name(pvc_name=self.config.db_actual_volume_name)
-                )
-            except (K8sApiInstanceHandlerException,LonghornApiInstanceHandlerException) as e:
-                self.log_err(err="Unable to create the backup")
-                raise MariaDBAppHandlerException(message="Unable to create the backup. The issue is the following:\n" + e)
-        else:
-            self.log_err(err="MariaDB backup mode not enabled. Cannot continue with the backup creation")
-            raise MariaDBAppHandlerException(message="MariaDB backup mode not enabled. Cannot continue with the backup creation")
+        try:
+            self.longhorn_api.create_volume_backup(
+                snapshot_name=snapshot_name,
+                pv_name=self.k8s_api.get_pv_name_from_pvc_name(pvc_name=self.config.db_actual_volume_name)
+            )
+        except (K8sApiInstanceHandlerException,LonghornApiInstanceHandlerException) as e:
+            self.log_err(err="Unable to create the backup")
+            raise MariaDBAppHandlerException(message="Unable to create the backup. The issue is the following:\n" + str(e))
         self.log_info(msg="DONE. MariaDB volume backup from snapshot " + snapshot_name + " successfully created")
 
     def create_backup_volume_snapshot(self, snapshot_name):
@@ -280,7 +1113,7 @@ class MariaDBAppHandler(Loggable):
                 )
             except (K8sApiInstanceHandlerException,LonghornApiInstanceHandlerException) as e:
                 self.log_err(err="Unable to create the snapshot")
-                raise MariaDBAppHandlerException(message="Unable to create the snapshot. The issue is the following:\n" + e)
+                raise MariaDBAppHandlerException(message="Unable to create the snapshot. The issue is the following:\n" + str(e))
         else:
             self.log_err(err="MariaDB backup mode not enabled. Cannot continue with the snapshot creation")
             raise MariaDBAppHandlerException(message="MariaDB backup mode not enabled. Cannot continue with the snapshot creation")
@@ -288,39 +1121,42 @@ class MariaDBAppHandler(Loggable):
 
     def create_backup_volume_backup(self, snapshot_name):
         self.log_info(msg="Creating the MariaDB backup volume backup from the snapshot" + snapshot_name + "...")
-        if self.backup_mode:
-            try:
-                self.longhorn_api.create_volume_backup(
-                    snapshot_name=snapshot_name,
-                    pv_name=self.k8s_api.get_pv_name_from_pvc_name(pvc_name=self.config.db_backup_volume_name)
-                )
-            except (K8sApiInstanceHandlerException,LonghornApiInstanceHandlerException) as e:
-                self.log_err(err="Unable to create the backup")
-                raise MariaDBAppHandlerException(message="Unable to create the backup. The issue is the following:\n" + e)
-        else:
-            self.log_err(err="MariaDB backup mode not enabled. Cannot continue with the backup creation")
-            raise MariaDBAppHandlerException(message="MariaDB backup mode not enabled. Cannot continue with the backup creation")
+        try:
+            self.longhorn_api.create_volume_backup(
+                snapshot_name=snapshot_name,
+                pv_name=self.k8s_api.get_pv_name_from_pvc_name(pvc_name=self.config.db_backup_volume_name)
+            )
+        except (K8sApiInstanceHandlerException,LonghornApiInstanceHandlerException) as e:
+            self.log_err(err="Unable to create the backup")
+            raise MariaDBAppHandlerException(message="Unable to create the backup. The issue is the following:\n" + str(e))
         self.log_info(msg="DONE. MariaDB backup volume backup from snapshot " + snapshot_name + " successfully created")
 
 
+    def get_retention_tasks(self):
+        # Cleanups to be run once the apps are online again, concurrently with the other volumes ones
+        return {
+            "mariadb-actual-volume": self.delete_actual_volume_backups_and_snapshots_over_retain_count,
+            "mariadb-backup-volume": self.delete_backup_volume_backups_and_snapshots_over_retain_count
+        }
+
     def delete_backups_and_snapshots_over_retain_count(self):
         self.log_info(msg="Deleting the MariaDB old backups and snapshots...")
-        if self.backup_mode:
-            try:
-                self.longhorn_api.delete_backups_and_snapshots_over_retain_count(
-                    pv_name=self.k8s_api.get_pv_name_from_pvc_name(pvc_name=self.config.db_actual_volume_name)
-                )
+        self.delete_actual_volume_backups_and_snapshots_over_retain_count()
+        self.delete_backup_volume_backups_and_snapshots_over_retain_count()
+        self.log_info(msg="DONE. MariaDB oldest volume backups and snapshots successfully deleted")
 
-                self.longhorn_api.delete_backups_and_snapshots_over_retain_count(
-                    pv_name=self.k8s_api.get_pv_name_from_pvc_name(pvc_name=self.config.db_backup_volume_name)
-                )
+    def delete_actual_volume_backups_and_snapshots_over_retain_count(self):
+        try:
+            self.longhorn_api.delete_backups_and_snapshots_over_retain_count(pv_name=self.get_actual_volume_pv_name())
+        except LonghornApiInstanceHandlerException as e:
+            self.log_err(err="Unable to delete the MariaDB actual volume old snapshots and backups")
+            raise MariaDBAppHandlerException(message="Unable to delete the MariaDB actual volume old snapshots and backups. The issue is the following:\n" + str(e))
 
-            except (K8sApiInstanceHandlerException,LonghornApiInstanceHandlerException) as e:
-                self.log_err(err="Unable to delete the old snapshots and backups")
-                raise MariaDBAppHandlerException(message="Unable to delete the old snapshots and backups. The issue is the following:\n" + e)
-        else:
-            self.log_err(err="Nextcloud maintenance mode not enabled. Cannot continue with the old snapshots and backups deletion")
-            raise MariaDBAppHandlerException(message="Nextcloud maintenance mode not enabled. Cannot continue with the old backups and snapshots deletion")
-        self.log_info(msg="DONE. MariaDB oldest volume backups and snapshots successfully deleted")
+    def delete_backup_volume_backups_and_snapshots_over_retain_count(self):
+        try:
+            self.longhorn_api.delete_backups_and_snapshots_over_retain_count(pv_name=self.get_backup_volume_pv_name())
+        except LonghornApiInstanceHandlerException as e:
+            self.log_err(err="Unable to delete the MariaDB backup volume old snapshots and backups")
+            raise MariaDBAppHandlerException(message="Unable to delete the MariaDB backup volume old snapshots and backups. The issue is the following:\n" + str(e))
     ### END - Methods implementation###
 ### END - Handler ###
@@ -1,9 +1,15 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
 from time import sleep
 
 from kubencbackup.apihandlers.kubernetesapi import K8sApiInstanceHandler, K8sApiInstanceHandlerException
 from kubencbackup.apihandlers.longhornapi import LonghornApiInstanceHandler, LonghornApiInstanceHandlerException
-from kubencbackup.common.backupexceptions import AppConfigException, AppHandlerException
+from kubencbackup.apihandlers.mariadbapi import MariaDBApiInstanceHandler, MariaDBApiInstanceHandlerException
+from kubencbackup.common.backupconfig import BackupConfig
+from kubencbackup.common.backupexceptions import AppConfigException, AppHandlerException, BackupException
 from kubencbackup.common.loggable import Loggable
+from kubencbackup.common.workerpool import WorkerPoolTask
 
 ### Config ###
 class NextcloudAppConfigException(AppConfigException):
@@ -12,9 +18,13 @@ class NextcloudAppConfigException(AppConfigException):
 
 
 class NextcloudAppConfig:
-    def __init__(self, app_name, app_volume_name):
+    def __init__(self, app_name, app_volume_name, db_user=None, drain_timeout=None, drain_poll_interval=None, status_url=None):
         self.app_name=app_name
         self.app_volume_name=app_volume_name
+        self.db_user=db_user
+        self.drain_timeout=drain_timeout
+        self.drain_poll_interval=drain_poll_interval
+        self.status_url=status_url
 
     ### app_name getter and setter ###
     @property
@@ -40,6 +50,65 @@ class NextcloudAppConfig:
         self.__app_volume_name=app_volume_name
     ### END ###
 
+    ### db_user getter and setter ###
+    @property
+    def db_user(self):
+        return self.__db_user
+    
+    @db_user.setter
+    def db_user(self,db_user):
+        # Optional: if not set, the Nextcloud MariaDB sessions are not checked while draining
+        self.__db_user=db_user
+    ### END ###
+
+    ### status_url getter and setter ###
+    @property
+    def status_url(self):
+        return self.__status_url
+    
+    @status_url.setter
+    def status_url(self,status_url):
+        # Optional web server status page reporting the busy workers, read from inside the Nextcloud pod
+        if status_url == None:
+            self.__status_url = None
+        elif "'" in status_url:
+            raise NextcloudAppConfigException(message='"status_url" must not contain quotes')
+        else:
+            self.__status_url=status_url
+    ### END ###
+
+    ### drain_timeout getter and setter ###
+    @property
+    def drain_timeout(self):
+        return self.__drain_timeout
+    
+    @drain_timeout.setter
+    def drain_timeout(self,drain_timeout):
+        if drain_timeout == None:
+            self.__drain_timeout = BackupConfig.DEFAULT_MAINTENANCE_DRAIN_TIMEOUT
+        else:
+            try:
+                self.__drain_timeout = int(drain_timeout)
+            except (ValueError,TypeError) as e:
+                raise NextcloudAppConfigException(message='"drain_timeout" must be a integer number')
+    ### END ###
+
+    ### drain_poll_interval getter and setter ###
+    @property
+    def drain_poll_interval(self):
+        return self.__drain_poll_interval
+    
+    @drain_poll_interval.setter
+    def drain_poll_interval(self,drain_poll_interval):
+        if drain_poll_interval == None:
+            self.__drain_poll_interval = BackupConfig.DEFAULT_MAINTENANCE_DRAIN_POLL_INTERVAL
+        else:
+            try:
+                self.__drain_poll_interval = float(drain_poll_interval)
+            except (ValueError,TypeError) as e:
+                raise NextcloudAppConfigException(message='"drain_poll_interval" must be a number')
+    ### END ###
+
 ### END - Config ###
 
 ### Handler ###
@@ -52,8 +121,21 @@ class NextcloudAppHandler(Loggable):
     # Declaring class private const
     __ENTER_MAINTENANCE_CMD='runuser -u www-data -- php occ maintenance:mode --on'
     __EXIT_MAINTENANCE_CMD='runuser -u www-data -- php occ maintenance:mode --off'
+    # Prints the number of running cron.php jobs (the [.] keeps the grep command itself out of the count), the number
+    # of busy web workers and the number of connections on the web (80) and PHP-FPM (9000) ports with queued data.
+    # The busy workers are read from the Apache server-status or the PHP-FPM status page (-1 if not set or not available),
+    # the request reading them being one of them. The idle keep-alive connections have no queued data and are not counted
+    __STATUS_URL_ESCAPE="____STATUS_URL____"
+    __BUSY_WORKERS_ESCAPE="____BUSY_WORKERS____"
+    __BUSY_WORKERS_CMD="$(php -r '$s=@file_get_contents(\"" + __STATUS_URL_ESCAPE + "\", false, stream_context_create([\"http\" => [\"timeout\" => 2]])); " \
+        "echo ($s !== false && preg_match(\"/(?:BusyWorkers|active processes):\\s*(\\d+)/\", $s, $m)) ? max(0, $m[1] - 1) : -1;' 2>/dev/null || echo -1)"
+    __ACTIVITY_CMD="echo $(grep -a -l -s -E 'cron[.]php' /proc/[0-9]*/cmdline | wc -l) " + __BUSY_WORKERS_ESCAPE + " " \
+        "$(cat /proc/net/tcp /proc/net/tcp6 2>/dev/null | awk '$4 == \"01\" && $5 != \"00000000:00000000\" && ($2 ~ /:0050$/ || $2 ~ /:2328$/)' | wc -l)"
+    __DB_SESSIONS_QUERY="SELECT COUNT(*) FROM information_schema.PROCESSLIST WHERE USER = ? AND COMMAND <> 'Sleep'"
+    # Number of consecutive idle samples needed to consider Nextcloud idle
+    __IDLE_SAMPLES=2
 
-    def __init__(self, config, k8s_api, longhorn_api):
+    def __init__(self, config, k8s_api, longhorn_api, mariadb_api=None):
         super().__init__(name="NEXTCLOUD-APP#", log_level=1)
 
         self.log_info(msg="Initializing Nextcloud App Handler...")
@@ -61,6 +143,9 @@ class NextcloudAppHandler(Loggable):
             self.config=config
             self.k8s_api=k8s_api
             self.longhorn_api=longhorn_api
+            self.mariadb_api=mariadb_api
+            self.drain_task=None
+            self.__status_fallback_logged=False
 
             self.__is_maintenance_mode_enabled = False
         except:
@@ -72,7 +157,7 @@ class NextcloudAppHandler(Loggable):
             self.log_info(msg="Entering Nextcloud maintenance mode...")
             self.enter_maintenance_mode()
             self.log_info(msg="DONE. successfully entered Nextcloud maintenance mode")
-        except NextcloudAppHandlerException as e:
+        except BackupException as e:
             self.log_err(err="Unable to enter Nextcloud maintenance mode")
             self.clean_resources()
             raise NextcloudAppHandlerException(message=e.message)
@@ -133,6 +218,34 @@ class NextcloudAppHandler(Loggable):
         self.__longhorn_api=longhorn_api
     ### END ###
 
+    ### mariadb_api getter and setter ###
+    @property
+    def mariadb_api(self):
+        return self.__mariadb_api
+    
+    @mariadb_api.setter
+    def mariadb_api(self,mariadb_api):
+        # Optional: used just to check the Nextcloud MariaDB sessions while draining
+        if mariadb_api != None and type(mariadb_api) != MariaDBApiInstanceHandler:
+            self.log_err(err='"mariadb_api" variable must be of type "MariaDBApiInstanceHandler"')
+            raise NextcloudAppHandlerException(message='"mariadb_api" variable must be of type "MariaDBApiInstanceHandler"')
+        self.__mariadb_api=mariadb_api
+    ### END ###
+
+    ### drain_task getter and setter ###
+    @property
+    def drain_task(self):
+        return self.__drain_task
+    
+    @drain_task.setter
+    def drain_task(self,drain_task):
+        # Optional callable run while waiting for Nextcloud to be idle, started as soon as the writes have stopped
+        if drain_task != None and not callable(drain_task):
+            self.log_err(err='"drain_task" variable must be callable')
+            raise NextcloudAppHandlerException(message='"drain_task" variable must be callable')
+        self.__drain_task=drain_task
+    ### END ###
+
     ### is_maintenance_mode_enabled getter ###
     @property
     def is_maintenance_mode_enabled(self):
@@ -140,30 +253,160 @@ class NextcloudAppHandler(Loggable):
     ### END ###
 
     ### Methods implementation ###
+    def get_volume_pv_name(self):
+        try:
+            return self.k8s_api.get_pv_name_from_pvc_name(pvc_name=self.config.app_volume_name)
+        except K8sApiInstanceHandlerException as e:
+            self.log_err(err="Unable to retrieve the Nextcloud volume name")
+            raise NextcloudAppHandlerException(message="Unable to retrieve the Nextcloud volume name. The issue is the following:\n" + str(e))
+
+    def get_warm_up_tasks(self):
+        # Lookups to be done before entering maintenance mode, so that the maintenance window contains just the snapshot
+        return {
+            "nextcloud-volume": self.warm_up_volume,
+            "nextcloud-pod": self.warm_up_pod
+        }
+
+    def warm_up_volume(self):
+        pv_name=self.get_volume_pv_name()
+        try:
+            self.longhorn_api.check_volume_health(pv_name=pv_name)
+        except LonghornApiInstanceHandlerException as e:
+            self.log_err(err="The Nextcloud volume is not ready to be snapshotted")
+            raise NextcloudAppHandlerException(message="The Nextcloud volume is not ready to be snapshotted. The issue is the following:\n" + str(e))
+
+    def warm_up_pod(self):
+        try:
+            self.k8s_api.get_running_pod_by_label(label="app="+self.config.app_name)
+        except K8sApiInstanceHandlerException as e:
+            self.log_err(err="Unable to retrieve the Nextcloud pod")
+            raise NextcloudAppHandlerException(message="Unable to retrieve the Nextcloud pod. The issue is the following:\n" + str(e))
+
     def enter_maintenance_mode(self):
         self.log_info(msg="Enabling Netcloud maintenance mode...")
         try:
             resp = self.k8s_api.exec_container_command(pod_label="app="+self.config.app_name, command=NextcloudAppHandler.__ENTER_MAINTENANCE_CMD)
         except K8sApiInstanceHandlerException as e:
             self.log_err(err="Unable to enable Nextcloud maintenance mode")
-            raise NextcloudAppHandlerException(message="Unable to enter maintenance mode. The issue is the following:\n" + e)
+            raise NextcloudAppHandlerException(message="Unable to enter maintenance mode. The issue is the following:\n" + str(e))
         
-        if resp == "Maintenance mode enabled\n":
-            sleep(30)
-        else:
+        if resp != "Maintenance mode enabled\n":
             self.log_err(err="Unable to enable Nextcloud maintenance mode")
             raise NextcloudAppHandlerException(message="Unable to enter maintenance mode. The issue is the following:\n" + resp)
 
         self.__is_maintenance_mode_enabled = True
         self.log_info(msg="DONE. Nextcloud maintenance mode successfully enabled")
 
+        # Wait for the in-flight requests and jobs to complete, running the drain task alongside if any
+        if self.drain_task == None:
+            self.wait_until_idle()
+        else:
+            self.wait_until_idle_running_drain_task()
+
+    def get_activity(self):
+        # Returns {signal name: number of active items}. A signal that cannot be read is reported as None
+        activity={}
+        try:
+            busy_workers_cmd="-1"
+            if self.config.status_url != None:
+                busy_workers_cmd=NextcloudAppHandler.__BUSY_WORKERS_CMD.replace(NextcloudAppHandler.__STATUS_URL_ESCAPE, self.config.status_url)
+            resp = self.k8s_api.exec_container_command(pod_label="app="+self.config.app_name,
+                command=NextcloudAppHandler.__ACTIVITY_CMD.replace(NextcloudAppHandler.__BUSY_WORKERS_ESCAPE, busy_workers_cmd))
+            cron_jobs, busy_workers, queued_connections = resp.split()
+            activity["cron-jobs"]=int(cron_jobs)
+            # The connections with queued data are just a fallback for when the status page is not set or cannot be
+            # read: they are reported under their own name, so that the idle state is never credited to the web workers
+            if int(busy_workers) >= 0:
+                activity["web-requests"]=int(busy_workers)
+            else:
+                if not self.__status_fallback_logged:
+                    if self.config.status_url == None:
+                        self.log_info(msg="WARNING: no web server status URL set. The busy web workers can't be read, counting the connections with queued data instead")
+                    else:
+                        self.log_info(msg="WARNING: unable to read the busy web workers from " + self.config.status_url + ". Counting the connections with queued data instead")
+                    self.__status_fallback_logged=True
+                activity["queued-connections"]=int(queued_connections)
+        except (K8sApiInstanceHandlerException,ValueError,AttributeError) as e:
+            self.log_err(err="Unable to read the Nextcloud pod activity")
+            activity["cron-jobs"]=None
+            activity["web-requests"]=None
+
+        if self.mariadb_api != None and self.config.db_user != None:
+            try:
+                activity["db-sessions"]=int(self.mariadb_api.exec_sql_query(NextcloudAppHandler.__DB_SESSIONS_QUERY, (self.config.db_user,))[0][0])
+            except (MariaDBApiInstanceHandlerException,IndexError,ValueError,TypeError) as e:
+                self.log_err(err="Unable to read the Nextcloud MariaDB sessions")
+                activity["db-sessions"]=None
+
+        return activity
+
+    def wait_until_idle(self, on_writes_stopped=None):
+        self.log_info(msg="Waiting for Nextcloud to be idle (at most " + str(self.config.drain_timeout) + "s)...")
+        start=time.monotonic()
+        idle_samples=0
+        while True:
+            activity=self.get_activity()
+            waited=time.monotonic() - start
+
+            # The writes are considered stopped when Nextcloud has no active MariaDB session
+            if on_writes_stopped != None and activity.get("db-sessions") == 0:
+                on_writes_stopped()
+
+            if all(value == 0 for value in activity.values()):
+                idle_samples+=1
+                if idle_samples >= NextcloudAppHandler.__IDLE_SAMPLES:
+                    if "queued-connections" in activity:
+                        self.log_info(msg="WARNING: the busy web workers have not been read: Nextcloud is considered idle from the connections with queued data only")
+                    self.log_info(msg="DONE. Nextcloud is idle. Waited " + "{:.3f}".format(waited) + "s")
+                    return waited
+            else:
+                idle_samples=0
+
+            if waited + self.config.drain_poll_interval > self.config.drain_timeout:
+                sleep(max(0, self.config.drain_timeout - waited))
+                waited=time.monotonic() - start
+                self.log_info(msg="WARNING: Nextcloud is not idle yet (" + ", ".join([name + "=" + str(value) for name, value in activity.items()]) + "). Drain timeout reached after " + "{:.3f}".format(waited) + "s. Continuing anyway")
+                return waited
+
+            sleep(self.config.drain_poll_interval)
+
+    def wait_until_idle_running_drain_task(self):
+        task=WorkerPoolTask(name="drain-task", function=self.drain_task)
+        executor=ThreadPoolExecutor(max_workers=1)
+        futures=[]
+
+        def start_drain_task():
+            if len(futures) == 0:
+                self.log_info(msg="Nextcloud writes stopped. Starting the drain task while waiting for Nextcloud to be idle...")
+                futures.append(executor.submit(task.run))
+
+        if self.mariadb_api == None or self.config.db_user == None:
+            self.log_info(msg="WARNING: the Nextcloud MariaDB sessions cannot be checked. The drain task will start once Nextcloud is idle")
+
+        try:
+            self.wait_until_idle(on_writes_stopped=start_drain_task)
+            wait_end=time.monotonic()
+            # Start the task now if the writes have never been detected as stopped
+            start_drain_task()
+            futures[0].result()
+        finally:
+            executor.shutdown(wait=True)
+
+        if task.error != None:
+            self.log_err(err="The drain task failed")
+            raise NextcloudAppHandlerException(message="The task run while waiting for Nextcloud to be idle failed. The issue is the following:\n" + str(task.error))
+
+        overlap=max(0.0, min(wait_end, task.finished_at) - task.started_at)
+        self.log_info(msg="DONE. Drain task completed in " + "{:.3f}".format(task.duration) + "s, overlapping the drain wait by " + "{:.3f}".format(overlap) + "s")
+        return overlap
+
     def exit_maintenance_mode(self):
         self.log_info(msg="Disabling Netcloud maintenance mode...")
         try:
             resp = self.k8s_api.exec_container_command(pod_label="app="+self.config.app_name, command=NextcloudAppHandler.__EXIT_MAINTENANCE_CMD)
         except K8sApiInstanceHandlerException as e:
             self.log_err(err="Unable to disable Nextcloud maintenance mode")
-            raise NextcloudAppHandlerException(message="Unable to exit maintenance mode. You have to do it by hands. The issue is the following:\n" + e)
+            raise NextcloudAppHandlerException(message="Unable to exit maintenance mode. You have to do it by hands. The issue is the following:\n" + str(e))
         
         if resp != "Maintenance mode disabled\n":
             self.log_err(err="Unable to disable Nextcloud maintenance mode")
@@ -182,7 +425,7 @@ class NextcloudAppHandler(Loggable):
                 )
             except (K8sApiInstanceHandlerException,LonghornApiInstanceHandlerException) as e:
                 self.log_err(err="Unable to create the snapshot")
-                raise NextcloudAppHandlerException(message="Unable to create the snapshot. The issue is the following:\n" + e)
+                raise NextcloudAppHandlerException(message="Unable to create the snapshot. The issue is the following:\n" + str(e))
         else:
             self.log_err(err="Nextcloud maintenance mode not enabled. Cannot continue with the snapshot creation")
             raise NextcloudAppHandlerException(message="Nextcloud maintenance mode not enabled. Cannot continue with the snapshot creation")
@@ -190,33 +433,29 @@ class NextcloudAppHandler(Loggable):
 
     def create_volume_backup(self, snapshot_name):
         self.log_info(msg="Creating the nextcloud volume backup from the snapshot" + snapshot_name + "...")
-        if self.is_maintenance_mode_enabled:
-            try:
-                self.longhorn_api.create_volume_backup(
-                    snapshot_name=snapshot_name,
-                    pv_name=self.k8s_api.get_pv_name_from_pvc_name(pvc_name=self.config.app_volume_name)
-                )
-            except (K8sApiInstanceHandlerException,LonghornApiInstanceHandlerException) as e:
-                self.log_err(err="Unable to create the backup")
-                raise NextcloudAppHandlerException(message="Unable to create the backup. The issue is the following:\n" + e)
-        else:
-            self.log_err(err="Nextcloud maintenance mode not enabled. Cannot continue with the backup creation")
-            raise NextcloudAppHandlerException(message="Nextcloud maintenance mode not enabled. Cannot continue with the backup creation")
+        try:
+            self.longhorn_api.create_volume_backup(
+                snapshot_name=snapshot_name,
+                pv_name=self.k8s_api.get_pv_name_from_pvc_name(pvc_name=self.config.app_volume_name)
+            )
+        except (K8sApiInstanceHandlerException,LonghornApiInstanceHandlerException) as e:
+            self.log_err(err="Unable to create the backup")
+            raise NextcloudAppHandlerException(message="Unable to create the backup. The issue is the following:\n" + str(e))
         self.log_info(msg="DONE. Nextcloud volume backup from snapshot " + snapshot_name + " successfully created")
 
+    def get_retention_tasks(self):
+        # Cleanups to be run once the apps are online again, concurrently with the other volumes ones
+        return {
+            "nextcloud-volume": self.delete_backups_and_snapshots_over_retain_count
+        }
+
     def delete_backups_and_snapshots_over_retain_count(self):
         self.log_info(msg="Deleting the nextcloud old backups and snapshots...")
-        if self.is_maintenance_mode_enabled:
-            try:
-                self.longhorn_api.delete_backups_and_snapshots_over_retain_count(
-                    pv_name=self.k8s_api.get_pv_name_from_pvc_name(pvc_name=self.config.app_volume_name)
-                )
-            except (K8sApiInstanceHandlerException,LonghornApiInstanceHandlerException) as e:
-                self.log_err(err="Unable to delete the old snapshots and backups")
-                raise NextcloudAppHandlerException(message="Unable to delete the old snapshots and backups. The issue is the following:\n" + e)
-        else:
-            self.log_err(err="Nextcloud maintenance mode not enabled. Cannot continue with the old snapshots and backups deletion")
-            raise NextcloudAppHandlerException(message="Nextcloud maintenance mode not enabled. Cannot continue with the old backups and snapshots deletion")
+        try:
+            self.longhorn_api.delete_backups_and_snapshots_over_retain_count(pv_name=self.get_volume_pv_name())
+        except LonghornApiInstanceHandlerException as e:
+            self.log_err(err="Unable to delete the old snapshots and backups")
+            raise NextcloudAppHandlerException(message="Unable to delete the old snapshots and backups. The issue is the following:\n" + str(e))
         self.log_info(msg="DONE. Nextcloud oldest volume backups and snapshots successfully deleted")
     ### END - Methods implementation###
 ### END - Handler ###
@@ -0,0 +1,260 @@
+import os
+import sqlite3
+
+from datetime import datetime, timezone
+
+from kubencbackup.common.backupexceptions import BackupException
+from kubencbackup.common.loggable import Loggable
+
+class BackupCatalogException(BackupException):
+    def __init__(self,message):
+        super().__init__(message)
+
+
+class BackupCatalog(Loggable):
+    # Local index of the backup sets: which snapshots and backups of the volumes belong to the same run.
+    # A set is named after the snapshots and backups it groups, each volume of the set being a component
+    __SCHEMA=[
+        """CREATE TABLE IF NOT EXISTS backup_sets (
+            name TEXT PRIMARY KEY,
+            created_at TEXT NOT NULL,
+            backup_type TEXT NOT NULL,
+            status TEXT NOT NULL,
+            duration REAL,
+            finished_at TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS components (
+            set_name TEXT NOT NULL REFERENCES backup_sets(name),
+            component TEXT NOT NULL,
+            pv_name TEXT NOT NULL,
+            snapshot_name TEXT,
+            snapshot_state TEXT,
+            snapshot_size INTEGER,
+            backup_id TEXT,
+            backup_url TEXT,
+            backup_state TEXT,
+            backup_size INTEGER,
+            backup_duration REAL,
+            PRIMARY KEY (set_name, component)
+        )""",
+        "CREATE INDEX IF NOT EXISTS components_pv_name ON components (pv_name, snapshot_name)",
+        "CREATE INDEX IF NOT EXISTS backup_sets_created_at ON backup_sets (created_at)",
+        """CREATE TABLE IF NOT EXISTS sync_state (
+            pv_name TEXT PRIMARY KEY,
+            backups_watermark TEXT
+        )"""
+    ]
+
+    # Sets status
+    SNAPSHOTTED="SNAPSHOTTED"
+    COMPLETE="COMPLETE"
+    FAILED="FAILED"
+    IMPORTED="IMPORTED"
+
+    # Components snapshot and backup state
+    PRESENT="PRESENT"
+    SKIPPED="SKIPPED"
+    DELETED="DELETED"
+
+    def __init__(self, file_path):
+        super().__init__(name="BACKUP-CATALOG", log_level=1)
+
+        if file_path == None:
+            self.log_err(err='"file_path" variable is mandatory')
+            raise BackupCatalogException(message='"file_path" variable is mandatory')
+        self.file_path=file_path
+        self.__connection=None
+
+    def __enter__(self):
+        self.log_info(msg="Opening the backup catalog " + self.file_path + "...")
+        try:
+            directory=os.path.dirname(self.file_path)
+            if directory != "":
+                os.makedirs(directory, exist_ok=True)
+            self.__connection=sqlite3.connect(self.file_path, timeout=30)
+            self.__connection.row_factory=sqlite3.Row
+            self.__connection.execute("PRAGMA journal_mode=WAL")
+            with self.__connection:
+                for statement in BackupCatalog.__SCHEMA:
+                    self.__connection.execute(statement)
+        except (OSError,sqlite3.Error) as e:
+            self.log_err(err="Unable to open the backup catalog")
+            self.free_resources()
+            raise BackupCatalogException(message="Unable to open the backup catalog " + self.file_path + ". The error message is:\n" + str(e))
+        self.log_info(msg="DONE. Backup catalog successfully opened")
+        return self
+
+    def __exit__(self, *a):
+        self.free_resources()
+
+    def free_resources(self):
+        if self.__connection != None:
+            self.__connection.close()
+            self.__connection=None
+
+    ### Methods implementation ###
+    def add_set(self, name, created_at, backup_type, volumes, skipped=None):
+        # volumes is a dictionary {component: volume name}. The skipped components have no snapshot of their own in
+        # this set, since the volume didn't change since the previous one
+        if skipped == None:
+            skipped=[]
+        self.__write(lambda connection: self.__add_set(connection, name, created_at, backup_type, volumes, skipped),
+            error="Unable to add the set " + name + " to the backup catalog")
+
+    def __add_set(self, connection, name, created_at, backup_type, volumes, skipped):
+        connection.execute("INSERT OR REPLACE INTO backup_sets (name, created_at, backup_type, status) VALUES (?, ?, ?, ?)",
+            (name, BackupCatalog.__timestamp(created_at), backup_type, BackupCatalog.SNAPSHOTTED))
+        for component, pv_name in volumes.items():
+            connection.execute(
+                "INSERT OR REPLACE INTO components (set_name, component, pv_name, snapshot_name, snapshot_state) VALUES (?, ?, ?, ?, ?)",
+                (name, component, pv_name, None if component in skipped else name, BackupCatalog.SKIPPED if component in skipped else BackupCatalog.PRESENT))
+
+    def record_backups(self, name, results):
+        # results is the dictionary {volume name: {"id", "url", "size", "duration"}} of the completed backups
+        def record(connection):
+            for pv_name, result in results.items():
+                connection.execute(
+                    "UPDATE components SET backup_id = ?, backup_url = ?, backup_size = ?, backup_duration = ?, backup_state = ? WHERE set_name = ? AND pv_name = ?",
+                    (result.get("id"), result.get("url"), result.get("size"), result.get("duration"), BackupCatalog.PRESENT, name, pv_name))
+        self.__write(record, error="Unable to record the backups of the set " + name)
+
+    def finish_set(self, name, status, duration=None):
+        self.__write(lambda connection: connection.execute("UPDATE backup_sets SET status = ?, duration = ?, finished_at = ? WHERE name = ?",
+                (status, duration, BackupCatalog.__timestamp(datetime.now(timezone.utc)), name)),
+            error="Unable to close the set " + name)
+
+    def latest_complete_set(self):
+        # Newest set whose components are all still available, either as a snapshot or as a backup
+        components=self.__components()
+        for backup_set in self.__query_sets("WHERE status IN (?, ?) ORDER BY created_at DESC", (BackupCatalog.COMPLETE, BackupCatalog.IMPORTED)):
+            if len(BackupCatalog.__missing_components(backup_set, components)) == 0:
+                return backup_set
+        return None
+
+    def sets_in_range(self, start, end):
+        return self.__query_sets("WHERE created_at >= ? AND created_at <= ? ORDER BY created_at",
+            (BackupCatalog.__timestamp(start), BackupCatalog.__timestamp(end)))
+
+    def sets_missing_component(self):
+        # The sets are returned with a "missing" list of the components not (or no more) available
+        components=self.__components()
+        missing_sets=[]
+        for backup_set in self.__query_sets("ORDER BY created_at", ()):
+            backup_set["missing"]=BackupCatalog.__missing_components(backup_set, components)
+            if len(backup_set["missing"]) > 0:
+                missing_sets.append(backup_set)
+        return missing_sets
+
+    def sync(self, longhorn_api, volumes):
+        # Brings the catalog in line with Longhorn: the snapshots and backups deleted since the last sync are marked
+        # as such and the backups newer than the volume watermark, not created by this tool, are imported.
+        # Longhorn can't filter the backups listing, so it is downloaded whole at every sync: the incremental part is
+        # on the catalog side, where just the components still present are checked and the older backups are skipped
+        self.log_info(msg="Syncing the backup catalog with Longhorn...")
+        for component, pv_name in volumes.items():
+            snapshots=longhorn_api.get_snapshots(pv_name=pv_name)
+            backups={backup["snapshot_name"]: backup for backup in longhorn_api.list_volume_backups(pv_name=pv_name)}
+            self.__write(lambda connection: self.__sync_volume(connection, component, pv_name, snapshots, backups),
+                error="Unable to sync the backup catalog for the volume " + pv_name)
+        self.log_info(msg="DONE. Backup catalog successfully synced")
+
+    def __sync_volume(self, connection, component, pv_name, snapshots, backups):
+        deleted_snapshots=0
+        deleted_backups=0
+        rows=connection.execute("SELECT set_name, snapshot_name, snapshot_state, backup_state FROM components WHERE pv_name = ? AND (snapshot_state = ? OR backup_state = ?)",
+            (pv_name, BackupCatalog.PRESENT, BackupCatalog.PRESENT)).fetchall()
+        for row in rows:
+            if row["snapshot_state"] == BackupCatalog.PRESENT:
+                snapshot=snapshots.get(row["snapshot_name"])
+                if snapshot == None or snapshot.removed == True:
+                    connection.execute("UPDATE components SET snapshot_state = ? WHERE set_name = ? AND pv_name = ?", (BackupCatalog.DELETED, row["set_name"], pv_name))
+                    deleted_snapshots+=1
+                else:
+                    connection.execute("UPDATE components SET snapshot_size = ? WHERE set_name = ? AND pv_name = ?",
+                        (BackupCatalog.__size(snapshot.size), row["set_name"], pv_name))
+            if row["backup_state"] == BackupCatalog.PRESENT and row["set_name"] not in backups:
+                connection.execute("UPDATE components SET backup_state = ? WHERE set_name = ? AND pv_name = ?", (BackupCatalog.DELETED, row["set_name"], pv_name))
+                deleted_backups+=1
+
+        watermark=connection.execute("SELECT backups_watermark FROM sync_state WHERE pv_name = ?", (pv_name,)).fetchone()
+        watermark=watermark["backups_watermark"] if watermark != None else None
+        imported=0
+        for backup in backups.values():
+            created=BackupCatalog.__timestamp(backup["created"])
+            if watermark != None and created <= watermark:
+                continue
+            known=connection.execute("SELECT 1 FROM components WHERE pv_name = ? AND set_name = ? AND backup_state IS NOT NULL",
+                (pv_name, backup["snapshot_name"])).fetchone()
+            if known == None:
+                connection.execute("INSERT OR IGNORE INTO backup_sets (name, created_at, backup_type, status) VALUES (?, ?, ?, ?)",
+                    (backup["snapshot_name"], created, "FULL-BACKUP", BackupCatalog.IMPORTED))
+                connection.execute(
+                    """INSERT INTO components (set_name, component, pv_name, backup_id, backup_url, backup_size, backup_state) VALUES (?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (set_name, component) DO UPDATE SET backup_id = excluded.backup_id, backup_url = excluded.backup_url,
+                        backup_size = excluded.backup_size, backup_state = excluded.backup_state""",
+                    (backup["snapshot_name"], component, pv_name, backup["name"], backup["url"], backup["size"], BackupCatalog.PRESENT))
+                imported+=1
+        if len(backups) > 0:
+            newest=max([BackupCatalog.__timestamp(backup["created"]) for backup in backups.values()])
+            if watermark == None or newest > watermark:
+                watermark=newest
+            connection.execute("INSERT OR REPLACE INTO sync_state (pv_name, backups_watermark) VALUES (?, ?)", (pv_name, watermark))
+
+        self.log_info(msg="Volume " + pv_name + ": " + str(deleted_snapshots) + " snapshots and " + str(deleted_backups) + " backups gone, " +
+            str(imported) + " backups imported")
+
+    def __write(self, function, error):
+        try:
+            with self.__connection:
+                function(self.__connection)
+        except sqlite3.Error as e:
+            self.log_err(err=error)
+            raise BackupCatalogException(message=error + ". The error message is:\n" + str(e))
+
+    def __query_sets(self, condition, params):
+        try:
+            sets=[dict(row) for row in self.__connection.execute("SELECT * FROM backup_sets " + condition, params).fetchall()]
+            for backup_set in sets:
+                backup_set["components"]={row["component"]: dict(row) for row in self.__connection.execute(
+                    "SELECT * FROM components WHERE set_name = ? ORDER BY component", (backup_set["name"],)).fetchall()}
+        except sqlite3.Error as e:
+            self.log_err(err="Unable to query the backup catalog")
+            raise BackupCatalogException(message="Unable to query the backup catalog. The error message is:\n" + str(e))
+        return sets
+
+    def __components(self):
+        try:
+            return [row["component"] for row in self.__connection.execute("SELECT DISTINCT component FROM components ORDER BY component").fetchall()]
+        except sqlite3.Error as e:
+            self.log_err(err="Unable to query the backup catalog")
+            raise BackupCatalogException(message="Unable to query the backup catalog. The error message is:\n" + str(e))
+
+    @staticmethod
+    def __missing_components(backup_set, components):
+        # A component is available if its snapshot or its backup are still there, or if it has been skipped since
+        # the volume was unchanged. The sets of a full backup need the backups too
+        missing=[]
+        for component in components:
+            row=backup_set["components"].get(component)
+            if row == None:
+                missing.append(component)
+            elif row["snapshot_state"] == BackupCatalog.SKIPPED:
+                continue
+            elif backup_set["backup_type"] == "FULL-BACKUP" and row["backup_state"] != BackupCatalog.PRESENT:
+                missing.append(component)
+            elif row["snapshot_state"] != BackupCatalog.PRESENT and row["backup_state"] != BackupCatalog.PRESENT:
+                missing.append(component)
+        return missing
+
+    @staticmethod
+    def __timestamp(moment):
+        # Stored as UTC ISO strings, so that they sort as the moments they represent. Naive datetimes are local ones
+        return moment.astimezone(timezone.utc).isoformat()
+
+    @staticmethod
+    def __size(size):
+        try:
+            return int(size)
+        except (ValueError,TypeError):
+            return None
+    ### END - Methods implementation ###
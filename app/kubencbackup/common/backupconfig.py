@@ -12,6 +12,30 @@ class BackupConfig(Loggable):
     DEFAULT_NAMESPACE = 'default'
     DEFAULT_SNAPSHOTS_TO_RETAIN = 30
     DEFAULT_BACKUPS_TO_RETAIN = 4
+    DEFAULT_SNAPSHOT_MODE = 'SEQUENTIAL'
+    DEFAULT_LONGHORN_MAX_WORKERS = 4
+    DEFAULT_MAINTENANCE_DRAIN_TIMEOUT = 30
+    DEFAULT_MAINTENANCE_DRAIN_POLL_INTERVAL = 2
+    DEFAULT_DUMP_SCHEDULING = 'SEQUENTIAL'
+    DEFAULT_EXEC_TIMEOUT = 600
+    DEFAULT_EXEC_MAX_OUTPUT_BYTES = 1048576
+    DEFAULT_MARIADB_DUMP_TIMEOUT = 21600
+    DEFAULT_EXEC_MODE = 'ONESHOT'
+    DEFAULT_MARIADB_DUMP_MODE = 'FILE'
+    DEFAULT_MARIADB_DUMP_COMPRESSION = 'gzip'
+    DEFAULT_MARIADB_DUMP_WORKERS = 4
+    DEFAULT_MARIADB_POOL_SIZE = 8
+    DEFAULT_MARIADB_LONG_TRX_THRESHOLD = 10
+    DEFAULT_MARIADB_PREFLIGHT_TIMEOUT = 60
+    DEFAULT_MARIADB_PREFLIGHT_ACTION = 'WAIT'
+    DEFAULT_MARIADB_REPLICA_CATCHUP_TIMEOUT = 60
+    DEFAULT_MARIADB_DUMP_STRATEGY = 'FULL'
+    DEFAULT_MARIADB_FULL_DUMP_INTERVAL = 24
+    DEFAULT_MARIADB_CHANGE_DETECTION = 'DISABLED'
+    DEFAULT_LONGHORN_BACKUP_STALL_TIMEOUT = 600
+    DEFAULT_LONGHORN_SCHEMA_REFRESH = 'DISABLED'
+    RETENTION_TIERS = ['HOURLY', 'DAILY', 'WEEKLY', 'MONTHLY']
+    SIZE_UNITS = {'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
 
     def __init__(self):
         super().__init__(name="BACKUP-CONFIG#",log_level=1)
@@ -26,10 +50,45 @@ class BackupConfig(Loggable):
         self.db_port=os.getenv('MARIADB_PORT')
         self.db_actual_volume_name=os.getenv('MARIADB_ACTUAL_VOLUME_NAME')
         self.db_backup_volume_name=os.getenv('MARIADB_BACKUP_VOLUME_NAME')
+        self.db_dump_mode=os.getenv('MARIADB_DUMP_MODE')
         self.db_backup_file_path=os.getenv('MARIADB_BACKUP_FILE_PATH')
+        self.db_dump_local_path=os.getenv('MARIADB_DUMP_LOCAL_PATH')
+        self.db_dump_compression=os.getenv('MARIADB_DUMP_COMPRESSION')
+        self.db_dump_workers=os.getenv('MARIADB_DUMP_WORKERS')
+        self.db_pool_size=os.getenv('MARIADB_POOL_SIZE')
+        self.db_long_trx_threshold=os.getenv('MARIADB_LONG_TRX_THRESHOLD')
+        self.db_preflight_timeout=os.getenv('MARIADB_PREFLIGHT_TIMEOUT')
+        self.db_preflight_action=os.getenv('MARIADB_PREFLIGHT_ACTION')
+        self.db_replica_app_name=os.getenv('MARIADB_REPLICA_APP_NAME')
+        self.db_replica_url=os.getenv('MARIADB_REPLICA_URL')
+        self.db_replica_port=os.getenv('MARIADB_REPLICA_PORT')
+        self.db_replica_catchup_timeout=os.getenv('MARIADB_REPLICA_CATCHUP_TIMEOUT')
+        self.state_path=os.getenv('STATE_PATH')
+        self.db_dump_strategy=os.getenv('MARIADB_DUMP_STRATEGY')
+        self.db_full_dump_interval=os.getenv('MARIADB_FULL_DUMP_INTERVAL')
+        self.db_change_detection=os.getenv('MARIADB_CHANGE_DETECTION')
+        self.db_fingerprint_tables=os.getenv('MARIADB_FINGERPRINT_TABLES')
+        self.longhorn_backup_stall_timeout=os.getenv('LONGHORN_BACKUP_STALL_TIMEOUT')
+        self.snapshots_retention_tiers=os.getenv('SNAPSHOTS_RETENTION_TIERS')
+        self.backups_retention_tiers=os.getenv('BACKUPS_RETENTION_TIERS')
+        self.snapshots_size_budget=os.getenv('SNAPSHOTS_SIZE_BUDGET')
+        self.longhorn_schema_cache_path=os.getenv('LONGHORN_SCHEMA_CACHE_PATH')
+        self.longhorn_schema_refresh=os.getenv('LONGHORN_SCHEMA_REFRESH')
+        self.catalog_path=os.getenv('BACKUP_CATALOG_PATH')
         self.longhorn_url=os.getenv('LONGHORN_URL')
         self.nr_snapshots_to_retain=os.getenv('NR_SNAPSHOTS_TO_RETAIN')
         self.nr_backups_to_retain=os.getenv('NR_BACKUPS_TO_RETAIN')
+        self.snapshot_mode=os.getenv('SNAPSHOT_MODE')
+        self.longhorn_max_workers=os.getenv('LONGHORN_MAX_WORKERS')
+        self.app_db_user=os.getenv('NEXTCLOUD_DB_USER')
+        self.maintenance_drain_timeout=os.getenv('MAINTENANCE_DRAIN_TIMEOUT')
+        self.maintenance_drain_poll_interval=os.getenv('MAINTENANCE_DRAIN_POLL_INTERVAL')
+        self.app_status_url=os.getenv('NEXTCLOUD_STATUS_URL')
+        self.dump_scheduling=os.getenv('DUMP_SCHEDULING')
+        self.exec_timeout=os.getenv('EXEC_TIMEOUT')
+        self.exec_max_output_bytes=os.getenv('EXEC_MAX_OUTPUT_BYTES')
+        self.db_dump_timeout=os.getenv('MARIADB_DUMP_TIMEOUT')
+        self.exec_mode=os.getenv('EXEC_MODE')
         
     ### backup_type getter and setter ###
     @property
@@ -185,8 +244,12 @@ class BackupConfig(Loggable):
     @db_backup_file_path.setter
     def db_backup_file_path(self,db_backup_file_path):
         if db_backup_file_path == None:
-            self.log_err('"MARIADB_BACKUP_FILE_PATH" environment variable is mandatory')
-            raise BackupConfigException(message='"MARIADB_BACKUP_FILE_PATH" environment variable is mandatory')
+            # The dump file path inside the MariaDB pod is needed just when the dump is written there
+            if self.db_dump_mode == 'FILE':
+                self.log_err('"MARIADB_BACKUP_FILE_PATH" environment variable is mandatory')
+                raise BackupConfigException(message='"MARIADB_BACKUP_FILE_PATH" environment variable is mandatory')
+            self.__db_backup_file_path=None
+            return
         self.__db_backup_file_path=db_backup_file_path
         self.log_info("successfully retrieved MARIADB_BACKUP_FILE_PATH as '" + db_backup_file_path + "'.")
     ### END ###
@@ -242,3 +305,673 @@ class BackupConfig(Loggable):
                 self.log_err("'NR_BACKUPS_TO_RETAIN' environment variable must be a integer number")
                 raise BackupConfigException(message="NR_BACKUPS_TO_RETAIN environment variable must be a integer number")
     ### END ###
+
+    ### snapshot_mode getter and setter ###
+    @property
+    def snapshot_mode(self):
+        return self.__snapshot_mode
+    
+    @snapshot_mode.setter
+    def snapshot_mode(self,snapshot_mode):
+        if snapshot_mode == None:
+            self.log_info("'SNAPSHOT_MODE' environment variable not set. Setting the default value: " + BackupConfig.DEFAULT_SNAPSHOT_MODE)
+            self.__snapshot_mode = BackupConfig.DEFAULT_SNAPSHOT_MODE
+        elif snapshot_mode not in ['CONCURRENT', 'SEQUENTIAL']:
+            self.log_err('Wrong snapshot mode. "SNAPSHOT_MODE" environment variable must be either "CONCURRENT" or "SEQUENTIAL"')
+            raise BackupConfigException(message='Wrong snapshot mode. "SNAPSHOT_MODE" environment variable must be either "CONCURRENT" or "SEQUENTIAL"')
+        else:
+            self.__snapshot_mode=snapshot_mode
+            self.log_info("successfully retrieved SNAPSHOT_MODE as '" + snapshot_mode + "'.")
+    ### END ###
+
+    ### longhorn_max_workers getter and setter ###
+    @property
+    def longhorn_max_workers(self):
+        return self.__longhorn_max_workers
+    
+    @longhorn_max_workers.setter
+    def longhorn_max_workers(self,longhorn_max_workers):
+        if longhorn_max_workers == None:
+            self.log_info("'LONGHORN_MAX_WORKERS' environment variable not set. Setting the default value: " + str(BackupConfig.DEFAULT_LONGHORN_MAX_WORKERS))
+            self.__longhorn_max_workers = BackupConfig.DEFAULT_LONGHORN_MAX_WORKERS
+        else:
+            try:
+                self.__longhorn_max_workers = int(longhorn_max_workers)
+            except (ValueError,TypeError) as e:
+                self.log_err("'LONGHORN_MAX_WORKERS' environment variable must be a integer number")
+                raise BackupConfigException(message="LONGHORN_MAX_WORKERS environment variable must be a integer number")
+            if self.__longhorn_max_workers < 1:
+                self.log_err("'LONGHORN_MAX_WORKERS' environment variable must be greater than 0")
+                raise BackupConfigException(message="LONGHORN_MAX_WORKERS environment variable must be greater than 0")
+            self.log_info("successfully retrieved LONGHORN_MAX_WORKERS as '" + longhorn_max_workers + "'.")
+    ### END ###
+
+    ### app_db_user getter and setter ###
+    @property
+    def app_db_user(self):
+        return self.__app_db_user
+    
+    @app_db_user.setter
+    def app_db_user(self,app_db_user):
+        if app_db_user == None:
+            self.log_info("'NEXTCLOUD_DB_USER' environment variable not set. The Nextcloud MariaDB sessions will not be checked while waiting for Nextcloud to be idle")
+        else:
+            self.log_info("successfully retrieved NEXTCLOUD_DB_USER as '" + app_db_user + "'.")
+        self.__app_db_user=app_db_user
+    ### END ###
+
+    ### maintenance_drain_timeout getter and setter ###
+    @property
+    def maintenance_drain_timeout(self):
+        return self.__maintenance_drain_timeout
+    
+    @maintenance_drain_timeout.setter
+    def maintenance_drain_timeout(self,maintenance_drain_timeout):
+        if maintenance_drain_timeout == None:
+            self.log_info("'MAINTENANCE_DRAIN_TIMEOUT' environment variable not set. Setting the default value: " + str(BackupConfig.DEFAULT_MAINTENANCE_DRAIN_TIMEOUT))
+            self.__maintenance_drain_timeout = BackupConfig.DEFAULT_MAINTENANCE_DRAIN_TIMEOUT
+        else:
+            try:
+                self.__maintenance_drain_timeout = int(maintenance_drain_timeout)
+                self.log_info("successfully retrieved MAINTENANCE_DRAIN_TIMEOUT as '" + maintenance_drain_timeout + "'.")
+            except (ValueError,TypeError) as e:
+                self.log_err("'MAINTENANCE_DRAIN_TIMEOUT' environment variable must be a integer number")
+                raise BackupConfigException(message="MAINTENANCE_DRAIN_TIMEOUT environment variable must be a integer number")
+    ### END ###
+
+    ### maintenance_drain_poll_interval getter and setter ###
+    @property
+    def maintenance_drain_poll_interval(self):
+        return self.__maintenance_drain_poll_interval
+    
+    @maintenance_drain_poll_interval.setter
+    def maintenance_drain_poll_interval(self,maintenance_drain_poll_interval):
+        if maintenance_drain_poll_interval == None:
+            self.log_info("'MAINTENANCE_DRAIN_POLL_INTERVAL' environment variable not set. Setting the default value: " + str(BackupConfig.DEFAULT_MAINTENANCE_DRAIN_POLL_INTERVAL))
+            self.__maintenance_drain_poll_interval = BackupConfig.DEFAULT_MAINTENANCE_DRAIN_POLL_INTERVAL
+        else:
+            try:
+                self.__maintenance_drain_poll_interval = float(maintenance_drain_poll_interval)
+                self.log_info("successfully retrieved MAINTENANCE_DRAIN_POLL_INTERVAL as '" + maintenance_drain_poll_interval + "'.")
+            except (ValueError,TypeError) as e:
+                self.log_err("'MAINTENANCE_DRAIN_POLL_INTERVAL' environment variable must be a number")
+                raise BackupConfigException(message="MAINTENANCE_DRAIN_POLL_INTERVAL environment variable must be a number")
+    ### END ###
+
+    ### dump_scheduling getter and setter ###
+    @property
+    def dump_scheduling(self):
+        return self.__dump_scheduling
+    
+    @dump_scheduling.setter
+    def dump_scheduling(self,dump_scheduling):
+        if dump_scheduling == None:
+            self.log_info("'DUMP_SCHEDULING' environment variable not set. Setting the default value: " + BackupConfig.DEFAULT_DUMP_SCHEDULING)
+            self.__dump_scheduling = BackupConfig.DEFAULT_DUMP_SCHEDULING
+        elif dump_scheduling not in ['SEQUENTIAL', 'OVERLAP']:
+            self.log_err('Wrong dump scheduling. "DUMP_SCHEDULING" environment variable must be either "SEQUENTIAL" or "OVERLAP"')
+            raise BackupConfigException(message='Wrong dump scheduling. "DUMP_SCHEDULING" environment variable must be either "SEQUENTIAL" or "OVERLAP"')
+        else:
+            self.__dump_scheduling=dump_scheduling
+            self.log_info("successfully retrieved DUMP_SCHEDULING as '" + dump_scheduling + "'.")
+    ### END ###
+
+    ### exec_timeout getter and setter ###
+    @property
+    def exec_timeout(self):
+        return self.__exec_timeout
+    
+    @exec_timeout.setter
+    def exec_timeout(self,exec_timeout):
+        if exec_timeout == None:
+            self.log_info("'EXEC_TIMEOUT' environment variable not set. Setting the default value: " + str(BackupConfig.DEFAULT_EXEC_TIMEOUT))
+            self.__exec_timeout = BackupConfig.DEFAULT_EXEC_TIMEOUT
+        else:
+            try:
+                self.__exec_timeout = int(exec_timeout)
+                self.log_info("successfully retrieved EXEC_TIMEOUT as '" + exec_timeout + "'.")
+            except (ValueError,TypeError) as e:
+                self.log_err("'EXEC_TIMEOUT' environment variable must be a integer number")
+                raise BackupConfigException(message="EXEC_TIMEOUT environment variable must be a integer number")
+    ### END ###
+
+    ### exec_max_output_bytes getter and setter ###
+    @property
+    def exec_max_output_bytes(self):
+        return self.__exec_max_output_bytes
+    
+    @exec_max_output_bytes.setter
+    def exec_max_output_bytes(self,exec_max_output_bytes):
+        if exec_max_output_bytes == None:
+            self.log_info("'EXEC_MAX_OUTPUT_BYTES' environment variable not set. Setting the default value: " + str(BackupConfig.DEFAULT_EXEC_MAX_OUTPUT_BYTES))
+            self.__exec_max_output_bytes = BackupConfig.DEFAULT_EXEC_MAX_OUTPUT_BYTES
+        else:
+            try:
+                self.__exec_max_output_bytes = int(exec_max_output_bytes)
+                self.log_info("successfully retrieved EXEC_MAX_OUTPUT_BYTES as '" + exec_max_output_bytes + "'.")
+            except (ValueError,TypeError) as e:
+                self.log_err("'EXEC_MAX_OUTPUT_BYTES' environment variable must be a integer number")
+                raise BackupConfigException(message="EXEC_MAX_OUTPUT_BYTES environment variable must be a integer number")
+    ### END ###
+
+    ### db_dump_timeout getter and setter ###
+    @property
+    def db_dump_timeout(self):
+        return self.__db_dump_timeout
+    
+    @db_dump_timeout.setter
+    def db_dump_timeout(self,db_dump_timeout):
+        if db_dump_timeout == None:
+            self.log_info("'MARIADB_DUMP_TIMEOUT' environment variable not set. Setting the default value: " + str(BackupConfig.DEFAULT_MARIADB_DUMP_TIMEOUT))
+            self.__db_dump_timeout = BackupConfig.DEFAULT_MARIADB_DUMP_TIMEOUT
+        else:
+            try:
+                self.__db_dump_timeout = int(db_dump_timeout)
+                self.log_info("successfully retrieved MARIADB_DUMP_TIMEOUT as '" + db_dump_timeout + "'.")
+            except (ValueError,TypeError) as e:
+                self.log_err("'MARIADB_DUMP_TIMEOUT' environment variable must be a integer number")
+                raise BackupConfigException(message="MARIADB_DUMP_TIMEOUT environment variable must be a integer number")
+    ### END ###
+
+    ### exec_mode getter and setter ###
+    @property
+    def exec_mode(self):
+        return self.__exec_mode
+    
+    @exec_mode.setter
+    def exec_mode(self,exec_mode):
+        # ONESHOT opens an exec websocket per command. SESSION keeps a shell open in each pod and runs the commands
+        # one at a time over it, saving the websocket setup of every command
+        if exec_mode == None:
+            self.log_info("'EXEC_MODE' environment variable not set. Setting the default value: " + BackupConfig.DEFAULT_EXEC_MODE)
+            self.__exec_mode = BackupConfig.DEFAULT_EXEC_MODE
+        elif exec_mode not in ['SESSION', 'ONESHOT']:
+            self.log_err('Wrong exec mode. "EXEC_MODE" environment variable must be either "SESSION" or "ONESHOT"')
+            raise BackupConfigException(message='Wrong exec mode. "EXEC_MODE" environment variable must be either "SESSION" or "ONESHOT"')
+        else:
+            self.__exec_mode=exec_mode
+            self.log_info("successfully retrieved EXEC_MODE as '" + exec_mode + "'.")
+    ### END ###
+
+    ### db_dump_mode getter and setter ###
+    @property
+    def db_dump_mode(self):
+        return self.__db_dump_mode
+    
+    @db_dump_mode.setter
+    def db_dump_mode(self,db_dump_mode):
+        if db_dump_mode == None:
+            self.log_info("'MARIADB_DUMP_MODE' environment variable not set. Setting the default value: " + BackupConfig.DEFAULT_MARIADB_DUMP_MODE)
+            self.__db_dump_mode = BackupConfig.DEFAULT_MARIADB_DUMP_MODE
+        elif db_dump_mode not in ['FILE', 'STREAM', 'PARALLEL']:
+            self.log_err('Wrong dump mode. "MARIADB_DUMP_MODE" environment variable must be one of "FILE", "STREAM" or "PARALLEL"')
+            raise BackupConfigException(message='Wrong dump mode. "MARIADB_DUMP_MODE" environment variable must be one of "FILE", "STREAM" or "PARALLEL"')
+        else:
+            self.__db_dump_mode=db_dump_mode
+            self.log_info("successfully retrieved MARIADB_DUMP_MODE as '" + db_dump_mode + "'.")
+    ### END ###
+
+    ### db_dump_local_path getter and setter ###
+    @property
+    def db_dump_local_path(self):
+        return self.__db_dump_local_path
+    
+    @db_dump_local_path.setter
+    def db_dump_local_path(self,db_dump_local_path):
+        if db_dump_local_path == None:
+            # The local dump directory is needed just when the dump is not written inside the MariaDB pod
+            if self.db_dump_mode != 'FILE':
+                self.log_err('"MARIADB_DUMP_LOCAL_PATH" environment variable is mandatory when "MARIADB_DUMP_MODE" is "' + self.db_dump_mode + '"')
+                raise BackupConfigException(message='"MARIADB_DUMP_LOCAL_PATH" environment variable is mandatory when "MARIADB_DUMP_MODE" is "' + self.db_dump_mode + '"')
+        else:
+            self.log_info("successfully retrieved MARIADB_DUMP_LOCAL_PATH as '" + db_dump_local_path + "'.")
+        self.__db_dump_local_path=db_dump_local_path
+    ### END ###
+
+    ### db_dump_compression getter and setter ###
+    @property
+    def db_dump_compression(self):
+        return self.__db_dump_compression
+    
+    @db_dump_compression.setter
+    def db_dump_compression(self,db_dump_compression):
+        if db_dump_compression == None:
+            self.log_info("'MARIADB_DUMP_COMPRESSION' environment variable not set. Setting the default value: " + BackupConfig.DEFAULT_MARIADB_DUMP_COMPRESSION)
+            self.__db_dump_compression = BackupConfig.DEFAULT_MARIADB_DUMP_COMPRESSION
+        elif db_dump_compression not in ['gzip', 'zstd']:
+            self.log_err('Wrong dump compression. "MARIADB_DUMP_COMPRESSION" environment variable must be either "gzip" or "zstd"')
+            raise BackupConfigException(message='Wrong dump compression. "MARIADB_DUMP_COMPRESSION" environment variable must be either "gzip" or "zstd"')
+        else:
+            self.__db_dump_compression=db_dump_compression
+            self.log_info("successfully retrieved MARIADB_DUMP_COMPRESSION as '" + db_dump_compression + "'.")
+    ### END ###
+
+    ### db_dump_workers getter and setter ###
+    @property
+    def db_dump_workers(self):
+        return self.__db_dump_workers
+    
+    @db_dump_workers.setter
+    def db_dump_workers(self,db_dump_workers):
+        if db_dump_workers == None:
+            self.log_info("'MARIADB_DUMP_WORKERS' environment variable not set. Setting the default value: " + str(BackupConfig.DEFAULT_MARIADB_DUMP_WORKERS))
+            self.__db_dump_workers = BackupConfig.DEFAULT_MARIADB_DUMP_WORKERS
+        else:
+            try:
+                self.__db_dump_workers = int(db_dump_workers)
+            except (ValueError,TypeError) as e:
+                self.log_err("'MARIADB_DUMP_WORKERS' environment variable must be a integer number")
+                raise BackupConfigException(message="MARIADB_DUMP_WORKERS environment variable must be a integer number")
+            if self.__db_dump_workers < 1:
+                self.log_err("'MARIADB_DUMP_WORKERS' environment variable must be greater than 0")
+                raise BackupConfigException(message="MARIADB_DUMP_WORKERS environment variable must be greater than 0")
+            self.log_info("successfully retrieved MARIADB_DUMP_WORKERS as '" + db_dump_workers + "'.")
+    ### END ###
+
+    ### db_pool_size getter and setter ###
+    @property
+    def db_pool_size(self):
+        return self.__db_pool_size
+    
+    @db_pool_size.setter
+    def db_pool_size(self,db_pool_size):
+        if db_pool_size == None:
+            self.log_info("'MARIADB_POOL_SIZE' environment variable not set. Setting the default value: " + str(BackupConfig.DEFAULT_MARIADB_POOL_SIZE))
+            self.__db_pool_size = BackupConfig.DEFAULT_MARIADB_POOL_SIZE
+        else:
+            try:
+                self.__db_pool_size = int(db_pool_size)
+            except (ValueError,TypeError) as e:
+                self.log_err("'MARIADB_POOL_SIZE' environment variable must be a integer number")
+                raise BackupConfigException(message="MARIADB_POOL_SIZE environment variable must be a integer number")
+            if self.__db_pool_size < 1:
+                self.log_err("'MARIADB_POOL_SIZE' environment variable must be greater than 0")
+                raise BackupConfigException(message="MARIADB_POOL_SIZE environment variable must be greater than 0")
+            self.log_info("successfully retrieved MARIADB_POOL_SIZE as '" + db_pool_size + "'.")
+    ### END ###
+
+    ### db_long_trx_threshold getter and setter ###
+    @property
+    def db_long_trx_threshold(self):
+        return self.__db_long_trx_threshold
+    
+    @db_long_trx_threshold.setter
+    def db_long_trx_threshold(self,db_long_trx_threshold):
+        if db_long_trx_threshold == None:
+            self.log_info("'MARIADB_LONG_TRX_THRESHOLD' environment variable not set. Setting the default value: " + str(BackupConfig.DEFAULT_MARIADB_LONG_TRX_THRESHOLD))
+            self.__db_long_trx_threshold = BackupConfig.DEFAULT_MARIADB_LONG_TRX_THRESHOLD
+        else:
+            try:
+                self.__db_long_trx_threshold = int(db_long_trx_threshold)
+                self.log_info("successfully retrieved MARIADB_LONG_TRX_THRESHOLD as '" + db_long_trx_threshold + "'.")
+            except (ValueError,TypeError) as e:
+                self.log_err("'MARIADB_LONG_TRX_THRESHOLD' environment variable must be a integer number")
+                raise BackupConfigException(message="MARIADB_LONG_TRX_THRESHOLD environment variable must be a integer number")
+    ### END ###
+
+    ### db_preflight_timeout getter and setter ###
+    @property
+    def db_preflight_timeout(self):
+        return self.__db_preflight_timeout
+    
+    @db_preflight_timeout.setter
+    def db_preflight_timeout(self,db_preflight_timeout):
+        if db_preflight_timeout == None:
+            self.log_info("'MARIADB_PREFLIGHT_TIMEOUT' environment variable not set. Setting the default value: " + str(BackupConfig.DEFAULT_MARIADB_PREFLIGHT_TIMEOUT))
+            self.__db_preflight_timeout = BackupConfig.DEFAULT_MARIADB_PREFLIGHT_TIMEOUT
+        else:
+            try:
+                self.__db_preflight_timeout = int(db_preflight_timeout)
+                self.log_info("successfully retrieved MARIADB_PREFLIGHT_TIMEOUT as '" + db_preflight_timeout + "'.")
+            except (ValueError,TypeError) as e:
+                self.log_err("'MARIADB_PREFLIGHT_TIMEOUT' environment variable must be a integer number")
+                raise BackupConfigException(message="MARIADB_PREFLIGHT_TIMEOUT environment variable must be a integer number")
+    ### END ###
+
+    ### db_preflight_action getter and setter ###
+    @property
+    def db_preflight_action(self):
+        return self.__db_preflight_action
+    
+    @db_preflight_action.setter
+    def db_preflight_action(self,db_preflight_action):
+        if db_preflight_action == None:
+            self.log_info("'MARIADB_PREFLIGHT_ACTION' environment variable not set. Setting the default value: " + BackupConfig.DEFAULT_MARIADB_PREFLIGHT_ACTION)
+            self.__db_preflight_action = BackupConfig.DEFAULT_MARIADB_PREFLIGHT_ACTION
+        elif db_preflight_action not in ['WAIT', 'ABORT']:
+            self.log_err('Wrong preflight action. "MARIADB_PREFLIGHT_ACTION" environment variable must be either "WAIT" or "ABORT"')
+            raise BackupConfigException(message='Wrong preflight action. "MARIADB_PREFLIGHT_ACTION" environment variable must be either "WAIT" or "ABORT"')
+        else:
+            self.__db_preflight_action=db_preflight_action
+            self.log_info("successfully retrieved MARIADB_PREFLIGHT_ACTION as '" + db_preflight_action + "'.")
+    ### END ###
+
+    ### db_replica_app_name getter and setter ###
+    @property
+    def db_replica_app_name(self):
+        return self.__db_replica_app_name
+    
+    @db_replica_app_name.setter
+    def db_replica_app_name(self,db_replica_app_name):
+        if db_replica_app_name == None:
+            self.log_info("'MARIADB_REPLICA_APP_NAME' environment variable not set. The db backup in SQL format will be created on the primary")
+        elif self.db_dump_mode == 'FILE':
+            # In FILE mode the dump would be written on the replica volume, which is not snapshotted
+            self.log_err('"MARIADB_DUMP_MODE" environment variable must be "STREAM" or "PARALLEL" when "MARIADB_REPLICA_APP_NAME" is set')
+            raise BackupConfigException(message='"MARIADB_DUMP_MODE" environment variable must be "STREAM" or "PARALLEL" when "MARIADB_REPLICA_APP_NAME" is set')
+        else:
+            self.log_info("successfully retrieved MARIADB_REPLICA_APP_NAME as '" + db_replica_app_name + "'.")
+        self.__db_replica_app_name=db_replica_app_name
+    ### END ###
+
+    ### db_replica_url getter and setter ###
+    @property
+    def db_replica_url(self):
+        return self.__db_replica_url
+    
+    @db_replica_url.setter
+    def db_replica_url(self,db_replica_url):
+        if db_replica_url == None:
+            if self.db_replica_app_name != None:
+                self.log_err('"MARIADB_REPLICA_URL" environment variable is mandatory when "MARIADB_REPLICA_APP_NAME" is set')
+                raise BackupConfigException(message='"MARIADB_REPLICA_URL" environment variable is mandatory when "MARIADB_REPLICA_APP_NAME" is set')
+        else:
+            self.log_info("successfully retrieved MARIADB_REPLICA_URL as '" + db_replica_url + "'.")
+        self.__db_replica_url=db_replica_url
+    ### END ###
+
+    ### db_replica_port getter and setter ###
+    @property
+    def db_replica_port(self):
+        return self.__db_replica_port
+    
+    @db_replica_port.setter
+    def db_replica_port(self,db_replica_port):
+        if db_replica_port == None:
+            if self.db_replica_app_name != None:
+                self.log_err('"MARIADB_REPLICA_PORT" environment variable is mandatory when "MARIADB_REPLICA_APP_NAME" is set')
+                raise BackupConfigException(message='"MARIADB_REPLICA_PORT" environment variable is mandatory when "MARIADB_REPLICA_APP_NAME" is set')
+        else:
+            self.log_info("successfully retrieved MARIADB_REPLICA_PORT as '" + db_replica_port + "'.")
+        self.__db_replica_port=db_replica_port
+    ### END ###
+
+    ### db_replica_catchup_timeout getter and setter ###
+    @property
+    def db_replica_catchup_timeout(self):
+        return self.__db_replica_catchup_timeout
+    
+    @db_replica_catchup_timeout.setter
+    def db_replica_catchup_timeout(self,db_replica_catchup_timeout):
+        if db_replica_catchup_timeout == None:
+            self.log_info("'MARIADB_REPLICA_CATCHUP_TIMEOUT' environment variable not set. Setting the default value: " + str(BackupConfig.DEFAULT_MARIADB_REPLICA_CATCHUP_TIMEOUT))
+            self.__db_replica_catchup_timeout = BackupConfig.DEFAULT_MARIADB_REPLICA_CATCHUP_TIMEOUT
+        else:
+            try:
+                self.__db_replica_catchup_timeout = int(db_replica_catchup_timeout)
+                self.log_info("successfully retrieved MARIADB_REPLICA_CATCHUP_TIMEOUT as '" + db_replica_catchup_timeout + "'.")
+            except (ValueError,TypeError) as e:
+                self.log_err("'MARIADB_REPLICA_CATCHUP_TIMEOUT' environment variable must be a integer number")
+                raise BackupConfigException(message="MARIADB_REPLICA_CATCHUP_TIMEOUT environment variable must be a integer number")
+    ### END ###
+
+    ### state_path getter and setter ###
+    @property
+    def state_path(self):
+        return self.__state_path
+    
+    @state_path.setter
+    def state_path(self,state_path):
+        if state_path == None:
+            self.log_info("'STATE_PATH' environment variable not set. Nothing will be kept between the runs")
+        else:
+            self.log_info("successfully retrieved STATE_PATH as '" + state_path + "'.")
+        self.__state_path=state_path
+    ### END ###
+
+    ### db_dump_strategy getter and setter ###
+    @property
+    def db_dump_strategy(self):
+        return self.__db_dump_strategy
+    
+    @db_dump_strategy.setter
+    def db_dump_strategy(self,db_dump_strategy):
+        if db_dump_strategy == None:
+            self.log_info("'MARIADB_DUMP_STRATEGY' environment variable not set. Setting the default value: " + BackupConfig.DEFAULT_MARIADB_DUMP_STRATEGY)
+            self.__db_dump_strategy = BackupConfig.DEFAULT_MARIADB_DUMP_STRATEGY
+        elif db_dump_strategy not in ['FULL', 'INCREMENTAL']:
+            self.log_err('Wrong dump strategy. "MARIADB_DUMP_STRATEGY" environment variable must be either "FULL" or "INCREMENTAL"')
+            raise BackupConfigException(message='Wrong dump strategy. "MARIADB_DUMP_STRATEGY" environment variable must be either "FULL" or "INCREMENTAL"')
+        elif db_dump_strategy == 'INCREMENTAL' and (self.state_path == None or self.db_dump_mode == 'FILE'):
+            # The binlog position of the last dump is kept in the run state and the binlog segments are written to the local dump directory
+            self.log_err('"STATE_PATH" must be set and "MARIADB_DUMP_MODE" must not be "FILE" when "MARIADB_DUMP_STRATEGY" is "INCREMENTAL"')
+            raise BackupConfigException(message='"STATE_PATH" must be set and "MARIADB_DUMP_MODE" must not be "FILE" when "MARIADB_DUMP_STRATEGY" is "INCREMENTAL"')
+        else:
+            self.__db_dump_strategy=db_dump_strategy
+            self.log_info("successfully retrieved MARIADB_DUMP_STRATEGY as '" + db_dump_strategy + "'.")
+    ### END ###
+
+    ### db_full_dump_interval getter and setter ###
+    @property
+    def db_full_dump_interval(self):
+        return self.__db_full_dump_interval
+    
+    @db_full_dump_interval.setter
+    def db_full_dump_interval(self,db_full_dump_interval):
+        if db_full_dump_interval == None:
+            self.log_info("'MARIADB_FULL_DUMP_INTERVAL' environment variable not set. Setting the default value: " + str(BackupConfig.DEFAULT_MARIADB_FULL_DUMP_INTERVAL))
+            self.__db_full_dump_interval = BackupConfig.DEFAULT_MARIADB_FULL_DUMP_INTERVAL
+        else:
+            try:
+                self.__db_full_dump_interval = int(db_full_dump_interval)
+                self.log_info("successfully retrieved MARIADB_FULL_DUMP_INTERVAL as '" + db_full_dump_interval + "'.")
+            except (ValueError,TypeError) as e:
+                self.log_err("'MARIADB_FULL_DUMP_INTERVAL' environment variable must be a integer number")
+                raise BackupConfigException(message="MARIADB_FULL_DUMP_INTERVAL environment variable must be a integer number")
+    ### END ###
+
+    ### db_change_detection getter and setter ###
+    @property
+    def db_change_detection(self):
+        return self.__db_change_detection
+    
+    @db_change_detection.setter
+    def db_change_detection(self,db_change_detection):
+        # The changes are detected from the binlog GTID position and the tables update times. InnoDB doesn't keep
+        # the update times across restarts, so with the binlog disabled the db backup is skipped only when
+        # MARIADB_FINGERPRINT_TABLES lists the tables to be checksummed as well
+        if db_change_detection == None:
+            self.log_info("'MARIADB_CHANGE_DETECTION' environment variable not set. Setting the default value: " + BackupConfig.DEFAULT_MARIADB_CHANGE_DETECTION)
+            self.__db_change_detection = BackupConfig.DEFAULT_MARIADB_CHANGE_DETECTION
+        elif db_change_detection not in ['ENABLED', 'DISABLED']:
+            self.log_err('Wrong change detection. "MARIADB_CHANGE_DETECTION" environment variable must be either "ENABLED" or "DISABLED"')
+            raise BackupConfigException(message='Wrong change detection. "MARIADB_CHANGE_DETECTION" environment variable must be either "ENABLED" or "DISABLED"')
+        elif db_change_detection == 'ENABLED' and self.state_path == None:
+            # The fingerprint of the previous run is kept in the run state
+            self.log_err('"STATE_PATH" environment variable is mandatory when "MARIADB_CHANGE_DETECTION" is "ENABLED"')
+            raise BackupConfigException(message='"STATE_PATH" environment variable is mandatory when "MARIADB_CHANGE_DETECTION" is "ENABLED"')
+        else:
+            self.__db_change_detection=db_change_detection
+            self.log_info("successfully retrieved MARIADB_CHANGE_DETECTION as '" + db_change_detection + "'.")
+    ### END ###
+
+    ### db_fingerprint_tables getter and setter ###
+    @property
+    def db_fingerprint_tables(self):
+        return self.__db_fingerprint_tables
+    
+    @db_fingerprint_tables.setter
+    def db_fingerprint_tables(self,db_fingerprint_tables):
+        # Comma separated list of "schema.table" to be checksummed as part of the change fingerprint. Needed for the
+        # change detection to skip any db backup when the MariaDB binlog is disabled
+        if db_fingerprint_tables == None:
+            self.__db_fingerprint_tables = []
+        else:
+            self.__db_fingerprint_tables = [table.strip() for table in db_fingerprint_tables.split(",") if table.strip() != ""]
+            for table in self.__db_fingerprint_tables:
+                if len(table.split(".")) != 2:
+                    self.log_err('"MARIADB_FINGERPRINT_TABLES" environment variable must be a comma separated list of "schema.table"')
+                    raise BackupConfigException(message='"MARIADB_FINGERPRINT_TABLES" environment variable must be a comma separated list of "schema.table"')
+            self.log_info("successfully retrieved MARIADB_FINGERPRINT_TABLES as '" + db_fingerprint_tables + "'.")
+    ### END ###
+
+    ### longhorn_backup_stall_timeout getter and setter ###
+    @property
+    def longhorn_backup_stall_timeout(self):
+        return self.__longhorn_backup_stall_timeout
+    
+    @longhorn_backup_stall_timeout.setter
+    def longhorn_backup_stall_timeout(self,longhorn_backup_stall_timeout):
+        if longhorn_backup_stall_timeout == None:
+            self.log_info("'LONGHORN_BACKUP_STALL_TIMEOUT' environment variable not set. Setting the default value: " + str(BackupConfig.DEFAULT_LONGHORN_BACKUP_STALL_TIMEOUT))
+            self.__longhorn_backup_stall_timeout = BackupConfig.DEFAULT_LONGHORN_BACKUP_STALL_TIMEOUT
+        else:
+            try:
+                self.__longhorn_backup_stall_timeout = int(longhorn_backup_stall_timeout)
+                self.log_info("successfully retrieved LONGHORN_BACKUP_STALL_TIMEOUT as '" + longhorn_backup_stall_timeout + "'.")
+            except (ValueError,TypeError) as e:
+                self.log_err("'LONGHORN_BACKUP_STALL_TIMEOUT' environment variable must be a integer number")
+                raise BackupConfigException(message="LONGHORN_BACKUP_STALL_TIMEOUT environment variable must be a integer number")
+    ### END ###
+
+    ### snapshots_retention_tiers getter and setter ###
+    @property
+    def snapshots_retention_tiers(self):
+        return self.__snapshots_retention_tiers
+    
+    @snapshots_retention_tiers.setter
+    def snapshots_retention_tiers(self,snapshots_retention_tiers):
+        if snapshots_retention_tiers == None:
+            self.log_info("'SNAPSHOTS_RETENTION_TIERS' environment variable not set. Just the last items will be retained")
+            self.__snapshots_retention_tiers = None
+        else:
+            self.__snapshots_retention_tiers = self.__parse_retention_tiers(env_name="SNAPSHOTS_RETENTION_TIERS", value=snapshots_retention_tiers)
+            self.log_info("successfully retrieved SNAPSHOTS_RETENTION_TIERS as '" + snapshots_retention_tiers + "'.")
+    ### END ###
+
+    ### backups_retention_tiers getter and setter ###
+    @property
+    def backups_retention_tiers(self):
+        return self.__backups_retention_tiers
+    
+    @backups_retention_tiers.setter
+    def backups_retention_tiers(self,backups_retention_tiers):
+        if backups_retention_tiers == None:
+            self.log_info("'BACKUPS_RETENTION_TIERS' environment variable not set. Just the last items will be retained")
+            self.__backups_retention_tiers = None
+        else:
+            self.__backups_retention_tiers = self.__parse_retention_tiers(env_name="BACKUPS_RETENTION_TIERS", value=backups_retention_tiers)
+            self.log_info("successfully retrieved BACKUPS_RETENTION_TIERS as '" + backups_retention_tiers + "'.")
+    ### END ###
+
+    ### snapshots_size_budget getter and setter ###
+    @property
+    def snapshots_size_budget(self):
+        return self.__snapshots_size_budget
+    
+    @snapshots_size_budget.setter
+    def snapshots_size_budget(self,snapshots_size_budget):
+        if snapshots_size_budget == None:
+            self.log_info("'SNAPSHOTS_SIZE_BUDGET' environment variable not set. The snapshots size will not be taken into account")
+            self.__snapshots_size_budget = None
+        else:
+            # Bytes, optionally followed by K, M, G or T (powers of 1024)
+            try:
+                value=snapshots_size_budget.strip().upper()
+                multiplier=1
+                if value[-1:] in BackupConfig.SIZE_UNITS:
+                    multiplier=BackupConfig.SIZE_UNITS[value[-1]]
+                    value=value[:-1]
+                self.__snapshots_size_budget = int(value) * multiplier
+                if self.__snapshots_size_budget <= 0:
+                    raise ValueError("must be positive")
+                self.log_info("successfully retrieved SNAPSHOTS_SIZE_BUDGET as '" + snapshots_size_budget + "'.")
+            except ValueError as e:
+                self.log_err("'SNAPSHOTS_SIZE_BUDGET' environment variable must be a positive number of bytes, optionally followed by K, M, G or T")
+                raise BackupConfigException(message="SNAPSHOTS_SIZE_BUDGET environment variable must be a positive number of bytes, optionally followed by K, M, G or T")
+    ### END ###
+
+    ### longhorn_schema_cache_path getter and setter ###
+    @property
+    def longhorn_schema_cache_path(self):
+        return self.__longhorn_schema_cache_path
+    
+    @longhorn_schema_cache_path.setter
+    def longhorn_schema_cache_path(self,longhorn_schema_cache_path):
+        if longhorn_schema_cache_path == None:
+            self.log_info("'LONGHORN_SCHEMA_CACHE_PATH' environment variable not set. The Longhorn API schema will be downloaded at every run")
+        else:
+            self.log_info("successfully retrieved LONGHORN_SCHEMA_CACHE_PATH as '" + longhorn_schema_cache_path + "'.")
+        self.__longhorn_schema_cache_path=longhorn_schema_cache_path
+    ### END ###
+
+    ### longhorn_schema_refresh getter and setter ###
+    @property
+    def longhorn_schema_refresh(self):
+        return self.__longhorn_schema_refresh
+    
+    @longhorn_schema_refresh.setter
+    def longhorn_schema_refresh(self,longhorn_schema_refresh):
+        if longhorn_schema_refresh == None:
+            self.log_info("'LONGHORN_SCHEMA_REFRESH' environment variable not set. Setting the default value: " + BackupConfig.DEFAULT_LONGHORN_SCHEMA_REFRESH)
+            self.__longhorn_schema_refresh = BackupConfig.DEFAULT_LONGHORN_SCHEMA_REFRESH
+        elif longhorn_schema_refresh not in ['ENABLED', 'DISABLED']:
+            self.log_err('Wrong schema refresh. "LONGHORN_SCHEMA_REFRESH" environment variable must be either "ENABLED" or "DISABLED"')
+            raise BackupConfigException(message='Wrong schema refresh. "LONGHORN_SCHEMA_REFRESH" environment variable must be either "ENABLED" or "DISABLED"')
+        else:
+            self.__longhorn_schema_refresh=longhorn_schema_refresh
+            self.log_info("successfully retrieved LONGHORN_SCHEMA_REFRESH as '" + longhorn_schema_refresh + "'.")
+    ### END ###
+
+    ### catalog_path getter and setter ###
+    @property
+    def catalog_path(self):
+        return self.__catalog_path
+    
+    @catalog_path.setter
+    def catalog_path(self,catalog_path):
+        if catalog_path == None:
+            self.log_info("'BACKUP_CATALOG_PATH' environment variable not set. The backup sets will not be cataloged")
+        else:
+            self.log_info("successfully retrieved BACKUP_CATALOG_PATH as '" + catalog_path + "'.")
+        self.__catalog_path=catalog_path
+    ### END ###
+
+    ### app_status_url getter and setter ###
+    @property
+    def app_status_url(self):
+        return self.__app_status_url
+    
+    @app_status_url.setter
+    def app_status_url(self,app_status_url):
+        # Web server status page reporting the busy workers, as the Apache mod_status 'server-status?auto' page or
+        # the PHP-FPM pm.status_path one. Not exposed by every image, so it has to be enabled and set explicitly
+        if app_status_url == None or app_status_url == "":
+            self.log_info("'NEXTCLOUD_STATUS_URL' environment variable not set. The idle detection will count the connections with queued data instead of the busy web workers")
+            self.__app_status_url = None
+        elif "'" in app_status_url or not app_status_url.startswith(("http://", "https://")):
+            self.log_err('"NEXTCLOUD_STATUS_URL" environment variable must be an http(s) URL')
+            raise BackupConfigException(message='"NEXTCLOUD_STATUS_URL" environment variable must be an http(s) URL')
+        else:
+            self.__app_status_url=app_status_url
+            self.log_info("successfully retrieved NEXTCLOUD_STATUS_URL as '" + app_status_url + "'.")
+    ### END ###
+
+    def __parse_retention_tiers(self, env_name, value):
+        # "HOURLY=24,DAILY=7,WEEKLY=4,MONTHLY=6" -> {"HOURLY": 24, "DAILY": 7, "WEEKLY": 4, "MONTHLY": 6}
+        tiers={}
+        try:
+            for tier in value.split(","):
+                if tier.strip() == "":
+                    continue
+                name, count = tier.split("=")
+                name=name.strip().upper()
+                if name not in BackupConfig.RETENTION_TIERS:
+                    raise ValueError("unknown tier '" + name + "'")
+                tiers[name]=int(count)
+                if tiers[name] < 0:
+                    raise ValueError("negative count for the tier '" + name + "'")
+        except ValueError as e:
+            self.log_err('"' + env_name + '" environment variable must be a comma separated list of TIER=COUNT, TIER being one of ' + ", ".join(BackupConfig.RETENTION_TIERS))
+            raise BackupConfigException(message='"' + env_name + '" environment variable must be a comma separated list of TIER=COUNT, TIER being one of ' + ", ".join(BackupConfig.RETENTION_TIERS))
+        return tiers
@@ -0,0 +1,166 @@
+import gzip
+import hashlib
+import os
+import time
+
+from queue import Queue
+from threading import Thread
+
+from kubencbackup.common.backupexceptions import BackupException
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class CompressedSinkException(BackupException):
+    def __init__(self,message):
+        super().__init__(message)
+
+
+class CompressedSink:
+    COMPRESSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+
+    # Number of chunks buffered between the producer and the compressing thread
+    __QUEUE_SIZE = 64
+
+    def __init__(self, file_path, compression='gzip', previous_digest=None):
+        if compression not in CompressedSink.COMPRESSIONS:
+            raise CompressedSinkException(message="Unknown compression '" + str(compression) + "'. Must be one of " + ", ".join(CompressedSink.COMPRESSIONS))
+        if compression == 'zstd' and zstandard == None:
+            raise CompressedSinkException(message="The zstd compression requires the 'zstandard' python package")
+
+        self.file_path=file_path
+        self.compression=compression
+        self.previous_digest=previous_digest
+        self.unchanged=False
+        self.bytes_in=0
+        self.bytes_out=0
+        self.started_at=None
+        self.finished_at=None
+
+        # Digest of the uncompressed data, it doesn't depend on the compression settings
+        self.__hash=hashlib.sha256()
+
+        self.__tmp_file_path=file_path + ".part"
+        self.__queue=None
+        self.__thread=None
+        self.__error=None
+
+    ### duration, digest and throughput getters ###
+    @property
+    def duration(self):
+        if self.started_at == None:
+            return None
+        return (self.finished_at if self.finished_at != None else time.monotonic()) - self.started_at
+
+    @property
+    def digest(self):
+        return self.__hash.hexdigest()
+
+    @property
+    def throughput(self):
+        # Uncompressed bytes per second
+        duration=self.duration
+        if duration == None or duration <= 0:
+            return 0.0
+        return self.bytes_in / duration
+    ### END ###
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, *a):
+        if exc_type == None:
+            self.close()
+        else:
+            self.abort()
+
+    def open(self):
+        # The data is written to a temporary file next to the final one, renamed to the final name only once completed
+        # and only if its content changed. Deleted otherwise, leaving the blocks of the existing file untouched
+        try:
+            raw=open(self.__tmp_file_path, "wb")
+        except OSError as e:
+            raise CompressedSinkException(message="Unable to open " + self.__tmp_file_path + ". The error message is:\n" + str(e))
+
+        if self.compression == 'zstd':
+            # zstd compresses on all the available cores
+            writer=zstandard.ZstdCompressor(threads=-1).stream_writer(raw, closefd=True)
+        else:
+            # mtime=0 keeps the output identical for identical input
+            writer=gzip.GzipFile(filename="", fileobj=raw, mode="wb", mtime=0)
+
+        self.started_at=time.monotonic()
+        self.__queue=Queue(maxsize=CompressedSink.__QUEUE_SIZE)
+        self.__thread=Thread(target=self.__compress, args=(writer, raw), daemon=True)
+        self.__thread.start()
+
+    def __compress(self, writer, raw):
+        # Compress in a dedicated thread, so that the producer can keep receiving the data in the meantime
+        try:
+            while True:
+                data=self.__queue.get()
+                if data == None:
+                    break
+                if self.__error == None:
+                    writer.write(data)
+        except BaseException as e:
+            self.__error=e
+            # Keep consuming the queue so that the producer is never blocked
+            while self.__queue.get() != None:
+                pass
+        finally:
+            try:
+                writer.close()
+                if not raw.closed:
+                    raw.close()
+            except BaseException as e:
+                if self.__error == None:
+                    self.__error=e
+
+    def write(self, data):
+        if self.__error != None:
+            raise CompressedSinkException(message="Unable to write " + self.file_path + ". The error message is:\n" + str(self.__error))
+        if isinstance(data, str):
+            data=data.encode("utf-8")
+        self.bytes_in+=len(data)
+        self.__hash.update(data)
+        self.__queue.put(data)
+
+    def close(self):
+        self.__queue.put(None)
+        self.__thread.join()
+        self.finished_at=time.monotonic()
+
+        if self.__error != None:
+            self.__remove_tmp_file()
+            raise CompressedSinkException(message="Unable to write " + self.file_path + ". The error message is:\n" + str(self.__error))
+
+        try:
+            # The same data as the existing file: keep it untouched, so that its blocks don't change on the volume
+            if self.previous_digest != None and self.digest == self.previous_digest and os.path.exists(self.file_path):
+                self.__remove_tmp_file()
+                self.unchanged=True
+                self.bytes_out=os.path.getsize(self.file_path)
+                return
+            self.bytes_out=os.path.getsize(self.__tmp_file_path)
+            os.replace(self.__tmp_file_path, self.file_path)
+        except OSError as e:
+            self.__remove_tmp_file()
+            raise CompressedSinkException(message="Unable to complete " + self.file_path + ". The error message is:\n" + str(e))
+
+    def abort(self):
+        if self.__thread != None and self.__thread.is_alive():
+            self.__error=CompressedSinkException(message="aborted")
+            self.__queue.put(None)
+            self.__thread.join()
+        self.finished_at=time.monotonic()
+        self.__remove_tmp_file()
+
+    def __remove_tmp_file(self):
+        try:
+            os.remove(self.__tmp_file_path)
+        except OSError:
+            pass
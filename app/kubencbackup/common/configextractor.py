@@ -16,7 +16,10 @@ def backupconfig_to_k8s_api_instance_config(backupconfig):
         raise ConfigExtractorException(message="Wrong backupconfig object type. Must be BackupConfig.")
 
     return K8sApiInstanceConfig(
-        namespace=backupconfig.namespace
+        namespace=backupconfig.namespace,
+        exec_timeout=backupconfig.exec_timeout,
+        exec_max_output_bytes=backupconfig.exec_max_output_bytes,
+        exec_sessions=(backupconfig.exec_mode == "SESSION")
     )
 
 def backupconfig_to_mariadb_api_instance_config(backupconfig):
@@ -26,7 +29,23 @@ def backupconfig_to_mariadb_api_instance_config(backupconfig):
     return MariaDBApiInstanceConfig(
         db_url=backupconfig.db_url,
         db_port=backupconfig.db_port,
-        db_root_password=backupconfig.db_root_password
+        db_root_password=backupconfig.db_root_password,
+        pool_size=backupconfig.db_pool_size
+    )
+
+def backupconfig_to_mariadb_replica_api_instance_config(backupconfig):
+    if type(backupconfig) != BackupConfig:
+        raise ConfigExtractorException(message="Wrong backupconfig object type. Must be BackupConfig.")
+
+    # No replica configured
+    if backupconfig.db_replica_app_name == None:
+        return None
+
+    return MariaDBApiInstanceConfig(
+        db_url=backupconfig.db_replica_url,
+        db_port=backupconfig.db_replica_port,
+        db_root_password=backupconfig.db_root_password,
+        pool_size=backupconfig.db_pool_size
     )
 
 def backupconfig_to_longhorn_api_instance_config(backupconfig):
@@ -36,7 +55,14 @@ def backupconfig_to_longhorn_api_instance_config(backupconfig):
     return LonghornApiInstanceConfig(
         longhorn_url=backupconfig.longhorn_url,
         nr_snapshots_to_retain=backupconfig.nr_snapshots_to_retain,
-        nr_backups_to_retain=backupconfig.nr_backups_to_retain
+        nr_backups_to_retain=backupconfig.nr_backups_to_retain,
+        max_workers=backupconfig.longhorn_max_workers,
+        backup_stall_timeout=backupconfig.longhorn_backup_stall_timeout,
+        snapshots_retention_tiers=backupconfig.snapshots_retention_tiers,
+        backups_retention_tiers=backupconfig.backups_retention_tiers,
+        snapshots_size_budget=backupconfig.snapshots_size_budget,
+        schema_cache_path=backupconfig.longhorn_schema_cache_path,
+        schema_refresh=backupconfig.longhorn_schema_refresh
     )
 
 def backupconfig_to_nextcloud_app_config(backupconfig):
@@ -45,7 +71,11 @@ def backupconfig_to_nextcloud_app_config(backupconfig):
 
     return NextcloudAppConfig(
         app_name=backupconfig.app_name,
-        app_volume_name=backupconfig.app_volume_name
+        app_volume_name=backupconfig.app_volume_name,
+        db_user=backupconfig.app_db_user,
+        drain_timeout=backupconfig.maintenance_drain_timeout,
+        drain_poll_interval=backupconfig.maintenance_drain_poll_interval,
+        status_url=backupconfig.app_status_url
     )
 
 def backupconfig_to_mariadb_app_config(backupconfig):
@@ -57,5 +87,19 @@ def backupconfig_to_mariadb_app_config(backupconfig):
         db_root_password=backupconfig.db_root_password,
         db_actual_volume_name=backupconfig.db_actual_volume_name,
         db_backup_volume_name=backupconfig.db_backup_volume_name,
-        db_backup_file_path=backupconfig.db_backup_file_path
+        db_backup_file_path=backupconfig.db_backup_file_path,
+        dump_timeout=backupconfig.db_dump_timeout,
+        dump_mode=backupconfig.db_dump_mode,
+        dump_local_path=backupconfig.db_dump_local_path,
+        dump_compression=backupconfig.db_dump_compression,
+        dump_workers=backupconfig.db_dump_workers,
+        long_trx_threshold=backupconfig.db_long_trx_threshold,
+        preflight_timeout=backupconfig.db_preflight_timeout,
+        preflight_action=backupconfig.db_preflight_action,
+        replica_app_name=backupconfig.db_replica_app_name,
+        replica_catchup_timeout=backupconfig.db_replica_catchup_timeout,
+        dump_strategy=backupconfig.db_dump_strategy,
+        full_dump_interval=backupconfig.db_full_dump_interval,
+        change_detection=backupconfig.db_change_detection,
+        fingerprint_tables=backupconfig.db_fingerprint_tables
     )
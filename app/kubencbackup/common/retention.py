@@ -0,0 +1,43 @@
+# Retention selection, kept apart from the Longhorn handler as it only works on (creation time, name) tuples
+
+def retention_period(tier, created):
+    if tier == "HOURLY":
+        return (created.year, created.month, created.day, created.hour)
+    if tier == "DAILY":
+        return (created.year, created.month, created.day)
+    if tier == "WEEKLY":
+        return tuple(created.isocalendar()[:2])
+    return (created.year, created.month)
+
+def select_over_retention(items, retain_count, tiers):
+    # items is a list of (creation time, name). Sorted on both, so that the items created at the same time
+    # are all kept in the list and always in the same order.
+    # Grandfather-father-son: the last retain_count items are kept, plus the newest item of each of the last
+    # N hours, days, weeks and months as set in tiers. Everything is decided in a single pass, newest first.
+    # Returns the items to be deleted, oldest first
+    kept_periods={tier: set() for tier in tiers}
+    to_delete=[]
+    for index, (created, name) in enumerate(sorted(items, reverse=True)):
+        keep=index < retain_count
+        for tier, count in tiers.items():
+            period=retention_period(tier=tier, created=created)
+            if period not in kept_periods[tier] and len(kept_periods[tier]) < count:
+                kept_periods[tier].add(period)
+                keep=True
+        if not keep:
+            to_delete.append((created, name))
+    to_delete.reverse()
+    return to_delete
+
+def select_over_size_budget(items, sizes, budget):
+    # Walks the items newest first, summing up their sizes, and returns the ones that don't fit the budget anymore,
+    # oldest first. The newest item is always kept, whatever its size.
+    # Note: removing a snapshot merges its data into the next one, so the space actually freed may be lower
+    to_delete=[]
+    total=0
+    for index, item in enumerate(sorted(items, reverse=True)):
+        total+=sizes.get(item[1], 0)
+        if index > 0 and (len(to_delete) > 0 or total > budget):
+            to_delete.append(item)
+    to_delete.reverse()
+    return to_delete
@@ -0,0 +1,63 @@
+from datetime import datetime
+
+from kubencbackup.common.loggable import Loggable
+from kubencbackup.common.runstate import RunState, RunStateException
+
+class RunJournal(Loggable):
+    # Steps completed by the current backup set, kept in the run state and saved after every step, so that a
+    # failed run can be resumed from the first missing step. The journal is cleared once the set is complete
+    __RUN_STATE_SECTION="journal"
+
+    def __init__(self, run_state):
+        super().__init__(name="RUN-JOURNAL###", log_level=1)
+
+        if run_state == None or type(run_state) != RunState:
+            self.log_err(err="the run_state object mustn't be None and must be a RunState instance")
+            raise RunStateException(message="run_state must be of type RunState")
+        self.run_state=run_state
+
+    ### Methods implementation ###
+    def get_pending_set(self):
+        # Returns the name of the set left incomplete by a previous run, if any
+        return self.run_state.get(RunJournal.__RUN_STATE_SECTION, "set_name")
+
+    def start(self, set_name, backup_type):
+        pending_set=self.get_pending_set()
+        if pending_set != None and pending_set != set_name:
+            self.log_info(msg="Discarding the journal of the incomplete set " + pending_set)
+        self.run_state.set(RunJournal.__RUN_STATE_SECTION, "set_name", set_name)
+        self.run_state.set(RunJournal.__RUN_STATE_SECTION, "backup_type", backup_type)
+        self.run_state.set(RunJournal.__RUN_STATE_SECTION, "steps", {})
+        self.run_state.save()
+
+    def resume(self):
+        # Returns the name of the set to resume, the steps already done being skipped
+        set_name=self.get_pending_set()
+        if set_name != None:
+            self.log_info(msg="Resuming the set " + set_name + ". Steps already completed: " + (", ".join(self.__steps()) or "none"))
+        return set_name
+
+    @property
+    def backup_type(self):
+        return self.run_state.get(RunJournal.__RUN_STATE_SECTION, "backup_type")
+
+    def is_done(self, step):
+        return step in self.__steps()
+
+    def get_step_data(self, step):
+        return self.__steps().get(step, {}).get("data")
+
+    def complete(self, step, data=None):
+        steps=dict(self.__steps())
+        steps[step]={"completed_at": datetime.now().isoformat(), "data": data}
+        self.run_state.set(RunJournal.__RUN_STATE_SECTION, "steps", steps)
+        self.run_state.save()
+
+    def finish(self):
+        for key in ["set_name", "backup_type", "steps"]:
+            self.run_state.delete(RunJournal.__RUN_STATE_SECTION, key)
+        self.run_state.save()
+
+    def __steps(self):
+        return self.run_state.get(RunJournal.__RUN_STATE_SECTION, "steps", {})
+    ### END - Methods implementation ###
@@ -0,0 +1,71 @@
+import json
+import os
+
+from threading import RLock
+
+from kubencbackup.common.backupexceptions import BackupException
+from kubencbackup.common.loggable import Loggable
+
+class RunStateException(BackupException):
+    def __init__(self,message):
+        super().__init__(message)
+
+
+class RunState(Loggable):
+    # State kept between the runs, as a JSON document {section: {key: value}}
+    def __init__(self, file_path):
+        super().__init__(name="RUN-STATE#####", log_level=1)
+
+        if file_path == None:
+            self.log_err(err='"file_path" variable is mandatory')
+            raise RunStateException(message='"file_path" variable is mandatory')
+        self.file_path=file_path
+
+        self.__lock=RLock()
+        self.__state={}
+
+    ### Methods implementation ###
+    def load(self):
+        self.log_info(msg="Loading the run state from " + self.file_path + "...")
+        with self.__lock:
+            if not os.path.exists(self.file_path):
+                self.__state={}
+                self.log_info(msg="DONE. No run state found, starting from an empty one")
+                return self
+            try:
+                with open(self.file_path, "r") as state_file:
+                    self.__state=json.load(state_file)
+            except (OSError,ValueError) as e:
+                self.log_err(err="Unable to load the run state")
+                raise RunStateException(message="Unable to load the run state from " + self.file_path + ". The error message is:\n" + str(e))
+        self.log_info(msg="DONE. Run state successfully loaded")
+        return self
+
+    def save(self):
+        # Written to a temporary file first, so that a crash never leaves a truncated state behind
+        with self.__lock:
+            try:
+                directory=os.path.dirname(self.file_path)
+                if directory != "":
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.file_path + ".part", "w") as state_file:
+                    json.dump(self.__state, state_file, indent=2, sort_keys=True)
+                    state_file.flush()
+                    os.fsync(state_file.fileno())
+                os.replace(self.file_path + ".part", self.file_path)
+            except (OSError,TypeError,ValueError) as e:
+                self.log_err(err="Unable to save the run state")
+                raise RunStateException(message="Unable to save the run state to " + self.file_path + ". The error message is:\n" + str(e))
+
+    def get(self, section, key, default=None):
+        with self.__lock:
+            return self.__state.get(section, {}).get(key, default)
+
+    def set(self, section, key, value):
+        with self.__lock:
+            self.__state.setdefault(section, {})[key]=value
+
+    def delete(self, section, key):
+        with self.__lock:
+            self.__state.get(section, {}).pop(key, None)
+    ### END - Methods implementation ###
@@ -0,0 +1,78 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from kubencbackup.common.backupexceptions import BackupException
+
+class WorkerPoolException(BackupException):
+    def __init__(self,message,tasks=None):
+        super().__init__(message)
+        self.tasks=tasks
+
+
+class WorkerPoolTask:
+    def __init__(self, name, function):
+        self.name=name
+        self.function=function
+        self.result=None
+        self.error=None
+        self.started_at=None
+        self.finished_at=None
+
+    ### duration getter ###
+    @property
+    def duration(self):
+        if self.started_at == None or self.finished_at == None:
+            return None
+        return self.finished_at - self.started_at
+    ### END ###
+
+    def run(self):
+        self.started_at=time.monotonic()
+        try:
+            self.result=self.function()
+        except BaseException as e:
+            self.error=e
+        finally:
+            self.finished_at=time.monotonic()
+        return self
+
+
+class WorkerPool:
+    def __init__(self, max_workers):
+        try:
+            self.max_workers=int(max_workers)
+        except (ValueError,TypeError):
+            raise WorkerPoolException(message="max_workers must be a integer number")
+        if self.max_workers < 1:
+            raise WorkerPoolException(message="max_workers must be greater than 0")
+
+    ### Methods implementation ###
+    def run(self, functions):
+        # functions is a dictionary {task name: callable without arguments}. Every task is always waited for,
+        # so that the errors of all the workers can be collected and reported together
+        tasks={}
+        for name, function in functions.items():
+            tasks[name]=WorkerPoolTask(name=name, function=function)
+
+        if len(tasks) > 0:
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tasks))) as executor:
+                for future in [executor.submit(task.run) for task in tasks.values()]:
+                    future.result()
+
+        failed=[task for task in tasks.values() if task.error != None]
+        if len(failed) > 0:
+            raise WorkerPoolException(
+                message="; ".join([task.name + ": " + str(task.error) for task in failed]),
+                tasks=tasks)
+
+        return tasks
+
+    @staticmethod
+    def spread(tasks):
+        # Time elapsed between the first and the last task completion
+        finished=[task.finished_at for task in tasks.values() if task.finished_at != None]
+        if len(finished) == 0:
+            return 0.0
+        return max(finished) - min(finished)
+    ### END - Methods implementation ###
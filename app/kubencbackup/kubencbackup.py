@@ -1,23 +1,31 @@
-from datetime import datetime
+import json
+import time
+
+from contextlib import nullcontext
+from datetime import datetime, timedelta, timezone
 
 from kubencbackup.apihandlers.kubernetesapi import K8sApiInstanceHandler
-from kubencbackup.apihandlers.longhornapi import LonghornApiInstanceHandler
+from kubencbackup.apihandlers.longhornapi import LonghornApiInstanceHandler, LonghornApiInstanceHandlerException
 from kubencbackup.apihandlers.mariadbapi import MariaDBApiInstanceHandler
 from kubencbackup.apphandlers.nextcloudapp import NextcloudAppHandler
 from kubencbackup.apphandlers.mariadbapp import MariaDBAppHandler
 
 import kubencbackup.common.configextractor as conf_ext
 
+from kubencbackup.common.backupcatalog import BackupCatalog, BackupCatalogException
 from kubencbackup.common.backupexceptions import AppHandlerException, BackupException
 from kubencbackup.common.backupconfig import BackupConfig, BackupConfigException
 from kubencbackup.common.loggable import Loggable
+from kubencbackup.common.runjournal import RunJournal
+from kubencbackup.common.runstate import RunState, RunStateException
+from kubencbackup.common.workerpool import WorkerPool, WorkerPoolException
 
 class KubeNCBackup(Loggable):
     def __init__(self):
         # Set the name attribute in superclass for log purpose
         super().__init__(name="KUBE-NC-BACKUP")
 
-    def main(self):
+    def main(self, resume=False):
         # Init BackupConfig
         try:
             self.log_info("Retrieving the configuration from the environment variables...")
@@ -29,86 +37,288 @@ class KubeNCBackup(Loggable):
             self.log_err("Cannot retrieve the config environment variables.")
             return(1)
 
+        # Load the state kept between the runs
+        run_state=None
+        if backup_config.state_path != None:
+            try:
+                run_state=RunState(file_path=backup_config.state_path).load()
+            except RunStateException as rse:
+                self.log_err("Cannot load the run state: " + rse.message)
+                return 1
+
+        # The steps completed by the current backup set are journaled in the run state
+        journal=RunJournal(run_state=run_state) if run_state != None else None
+        if resume and journal == None:
+            self.log_err("Cannot resume the previous run: the 'STATE_PATH' environment variable is not set.")
+            return 1
+
         # Init kubernetes, longhorn and mariadb api handlers with their correspondent connections
         try:
             self.log_info("Preparing the system for the backups...")
-            self.log_info("Initializing Kubernetes, MariaDB and Longhorn APIs...")
+            self.log_info("Initializing Kubernetes, MariaDB (and the MariaDB replica, if any) and Longhorn APIs...")
             with \
                 K8sApiInstanceHandler(conf_ext.backupconfig_to_k8s_api_instance_config(backup_config)) as k8s_api, \
                 MariaDBApiInstanceHandler(conf_ext.backupconfig_to_mariadb_api_instance_config(backup_config)) as mariadb_api, \
-                LonghornApiInstanceHandler(conf_ext.backupconfig_to_longhorn_api_instance_config(backup_config)) as longhorn_api:
+                (MariaDBApiInstanceHandler(conf_ext.backupconfig_to_mariadb_replica_api_instance_config(backup_config))
+                    if backup_config.db_replica_app_name != None else nullcontext()) as replica_api, \
+                LonghornApiInstanceHandler(conf_ext.backupconfig_to_longhorn_api_instance_config(backup_config)) as longhorn_api, \
+                (BackupCatalog(file_path=backup_config.catalog_path)
+                    if backup_config.catalog_path != None else nullcontext()) as catalog:
+
+                ncah=NextcloudAppHandler(config=conf_ext.backupconfig_to_nextcloud_app_config(backup_config),k8s_api=k8s_api,longhorn_api=longhorn_api,mariadb_api=mariadb_api)
+                mdbah=MariaDBAppHandler(config=conf_ext.backupconfig_to_mariadb_app_config(backup_config),k8s_api=k8s_api,mariadb_api=mariadb_api,longhorn_api=longhorn_api,replica_api=replica_api,run_state=run_state)
+
+                # Set snapshots and backups name. When resuming, the ones of the incomplete set
+                run_started_at=datetime.now()
+                run_start=time.monotonic()
+                snapshot_backup_name=run_started_at.strftime("%d-%m-%Y__%H-%M-%S")
+                resumed_set_name=journal.resume() if resume else None
+                if resumed_set_name != None and not journal.is_done("snapshots"):
+                    # Some snapshots of the set may exist: the set is left to the retention and a new one is started
+                    self.log_info("The set " + resumed_set_name + " failed before its snapshots were all created. Nothing to resume.")
+                    resumed_set_name=None
+                if resumed_set_name != None and journal.backup_type != backup_config.backup_type:
+                    self.log_err("Cannot resume the set " + resumed_set_name + ": it was a " + journal.backup_type + " run and this is a " + backup_config.backup_type + " one.")
+                    return 1
+                if resumed_set_name != None:
+                    snapshot_backup_name=resumed_set_name
+                elif journal != None:
+                    if resume:
+                        self.log_info("No incomplete run to resume. Starting a new one...")
+                    journal.start(set_name=snapshot_backup_name, backup_type=backup_config.backup_type)
 
-                # Create nextcloud app handler and automatically enter maintenance mode
-                self.log_info("DONE. Prepare Nextcloud to be backupped...")
-                with NextcloudAppHandler(config=conf_ext.backupconfig_to_nextcloud_app_config(backup_config),k8s_api=k8s_api,longhorn_api=longhorn_api) as ncah:
+                ### Warm-up - Resolve the volumes and the pods and check them before quiescing the apps ###
+                self.log_info("DONE. Warming up: resolving and checking the volumes and the pods...")
+                warm_up_tasks={}
+                warm_up_tasks.update(ncah.get_warm_up_tasks())
+                warm_up_tasks.update(mdbah.get_warm_up_tasks())
+                warm_up_start=time.monotonic()
+                try:
+                    WorkerPool(max_workers=len(warm_up_tasks)).run(warm_up_tasks)
+                except WorkerPoolException as wpe:
+                    self.log_err("Unable to complete the warm-up stage due to the following issues: " + wpe.message)
+                    return 1
+                self.log_info("DONE. Warm-up stage completed in " + "{:.3f}".format(time.monotonic() - warm_up_start) + "s")
 
-                    # Create mysqldump file
-                    self.log_info("DONE. Create the db backup in SQL format...")
+                # Volumes grouped by the backup sets, resolved during the warm-up
+                catalog_volumes={
+                    "nextcloud-volume": ncah.get_volume_pv_name(),
+                    "mariadb-actual-volume": mdbah.get_actual_volume_pv_name(),
+                    "mariadb-backup-volume": mdbah.get_backup_volume_pv_name()
+                }
+                ### END - Warm-up ###
+
+                ### Phase 1 - Quiesce the apps and snapshot the volumes ###
+                # The snapshots are taken all together in the same quiesced window, so they are a single step: a run failed
+                # before the end of the window is never resumed from the middle of it
+                if journal != None and journal.is_done("snapshots"):
+                    backup_volume_unchanged=journal.get_step_data("snapshots")["backup_volume_unchanged"]
+                    self.log_info("Snapshots already created by the previous run. Skipping the maintenance mode and the MariaDB backup mode...")
+                else:
+                    # The long running transactions are waited for with Nextcloud still online
                     try:
-                        MariaDBAppHandler(
-                            config=conf_ext.backupconfig_to_mariadb_app_config(backup_config),
-                            k8s_api=k8s_api,
-                            mariadb_api=mariadb_api,
-                            longhorn_api=longhorn_api).create_mariadb_mysqldump()
+                        mdbah.wait_for_long_running_work()
                     except BackupException as e:
-                        self.log_err(err="Cannot create the db backup in SQL format")
+                        self.log_err(err="Cannot prepare MariaDB to be backupped")
                         return 1
+
+                    # In OVERLAP mode the db backup in SQL format is created while waiting for Nextcloud to be idle
+                    if backup_config.dump_scheduling == "OVERLAP":
+                        ncah.drain_task=mdbah.create_mariadb_dump
+
+                    # Enter nextcloud maintenance mode through the 'with' statement
+                    self.log_info("Prepare Nextcloud to be backupped...")
+                    quiesce_start=time.monotonic()
+                    with ncah:
+
+                        if backup_config.dump_scheduling == "SEQUENTIAL":
+                            # Create mysqldump file
+                            self.log_info("DONE. Create the db backup in SQL format...")
+                            try:
+                                mdbah.create_mariadb_dump()
+                            except BackupException as e:
+                                self.log_err(err="Cannot create the db backup in SQL format")
+                                return 1
                     
-                    self.log_info("DONE. Prepare MariaDB to be backupped...")
-
-                    # Create mariadb app handler and automatically enter backup mode
-                    with MariaDBAppHandler(config=conf_ext.backupconfig_to_mariadb_app_config(backup_config),k8s_api=k8s_api,mariadb_api=mariadb_api,longhorn_api=longhorn_api) as mdbah:
-                        # Set snapshots and backups name
-                        snapshot_backup_name=datetime.now().strftime("%d-%m-%Y__%H-%M-%S")
-                        
-                        try:
-                            # Create nextcloud snapshot
-                            self.log_info("DONE. Creating the Nextcloud snapshot...")
-                            ncah.create_volume_snapshot(snapshot_name=snapshot_backup_name)
-
-                            # Create mariadb actual volume snapshot
-                            self.log_info("DONE. Creating the MariaDB actual volume snapshot...")
-                            mdbah.create_actual_volume_snapshot(snapshot_name=snapshot_backup_name)
-
-                            # Create mariadb backup volume snapshot
-                            self.log_info("DONE. Creating the MariaDB backup snapshot...")
-                            mdbah.create_backup_volume_snapshot(snapshot_name=snapshot_backup_name)
-
-                            # Check whether a simple snapshot or a backup too have to be done
-                            if backup_config.backup_type == "FULL-BACKUP":
-                                # Create nextcloud backup
-                                self.log_info("DONE. Creating the Nextcloud backup...")
-                                ncah.create_volume_backup(snapshot_name=snapshot_backup_name)
-
-                                # Create mariadb actual volume backup
-                                self.log_info("DONE. Creating the MariaDB actual volume backup...")
-                                mdbah.create_actual_volume_backup(snapshot_name=snapshot_backup_name)
-
-                                # Create mariadb backup volume backup
-                                self.log_info("DONE. Creating the MariaDB backup volume backup...")
-                                mdbah.create_backup_volume_backup(snapshot_name=snapshot_backup_name)
-
-                            # Cleanup nextcloud old snapshots and backups
-                            self.log_info("DONE. Cleaning up Nextcloud old snapshots and backups...")
-                            ncah.delete_backups_and_snapshots_over_retain_count()
-
-                            # Cleanup mariadb old snapshots and backups
-                            self.log_info("DONE. Cleaning up MariaDB old snapshots and backups...")
-                            mdbah.delete_backups_and_snapshots_over_retain_count()
-
-                            self.log_info("DONE. Snapshots and backups processes successfully completed. Cleaning up the allocated resources...")
-
-                        except AppHandlerException as ahe:
-                            self.log_err("Unable to complete the snapshots and backups processes due to the following issue: " + ahe.message)
-                            return 1
-                # The resources will be freed and the correspondent connections closed through the 'with' statement
+                        self.log_info("DONE. Prepare MariaDB to be backupped...")
+
+                        # Enter mariadb backup mode through the 'with' statement. DDL is blocked, the commits are not yet
+                        # The mariadb backup volume is left alone when the db didn't change since the previous run
+                        backup_volume_unchanged=mdbah.is_backup_volume_unchanged(full_backup=(backup_config.backup_type == "FULL-BACKUP"))
+                        if backup_volume_unchanged:
+                            self.log_info("DONE. MariaDB unchanged since the previous run. Skipping the MariaDB backup volume snapshot and backup...")
+
+                        with mdbah:
+                            try:
+                                if backup_config.snapshot_mode == "CONCURRENT":
+                                    # Create nextcloud and mariadb backup volume snapshots at the same time
+                                    self.log_info("DONE. Creating the Nextcloud and MariaDB backup volume snapshots concurrently...")
+                                    longhorn_api.create_volume_snapshots(
+                                        snapshot_name=snapshot_backup_name,
+                                        pv_names=[ncah.get_volume_pv_name()] + ([] if backup_volume_unchanged else [mdbah.get_backup_volume_pv_name()]))
+                                else:
+                                    # Create nextcloud snapshot
+                                    self.log_info("DONE. Creating the Nextcloud snapshot...")
+                                    ncah.create_volume_snapshot(snapshot_name=snapshot_backup_name)
+
+                                    # Create mariadb backup volume snapshot
+                                    if not backup_volume_unchanged:
+                                        self.log_info("DONE. Creating the MariaDB backup snapshot...")
+                                        mdbah.create_backup_volume_snapshot(snapshot_name=snapshot_backup_name)
+
+                                # The commits are blocked just for the mariadb actual volume snapshot
+                                self.log_info("DONE. Blocking the MariaDB commits...")
+                                mdbah.block_commit()
+
+                                # Create mariadb actual volume snapshot
+                                self.log_info("DONE. Creating the MariaDB actual volume snapshot...")
+                                mdbah.create_actual_volume_snapshot(snapshot_name=snapshot_backup_name)
+
+                                self.log_info("DONE. Snapshots successfully created. Leaving MariaDB backup mode and Nextcloud maintenance mode...")
+
+                            except (AppHandlerException,LonghornApiInstanceHandlerException) as ahe:
+                                self.log_err("Unable to complete the snapshots process due to the following issue: " + ahe.message)
+                                return 1
+                        # MariaDB backup mode is disabled through the 'with' statement
+                    # Nextcloud maintenance mode is disabled through the 'with' statement
+                    self.log_info("DONE. Quiesced window lasted " + "{:.3f}".format(time.monotonic() - quiesce_start) + "s")
+
+                    self.update_catalog(catalog, lambda catalog: catalog.add_set(
+                        name=snapshot_backup_name, created_at=run_started_at, backup_type=backup_config.backup_type, volumes=catalog_volumes,
+                        skipped=["mariadb-backup-volume"] if backup_volume_unchanged else []))
+                    if journal != None:
+                        journal.complete("snapshots", data={"backup_volume_unchanged": backup_volume_unchanged})
+                ### END - Phase 1 ###
+
+                ### Phase 2 - Backup from the snapshots and retention. The apps are online again ###
+                try:
+                    # Check whether a simple snapshot or a backup too have to be done
+                    if backup_config.backup_type == "FULL-BACKUP":
+                        # Create nextcloud backup
+                        if self.run_step(journal, "nextcloud-backup"):
+                            self.log_info("DONE. Creating the Nextcloud backup...")
+                            ncah.create_volume_backup(snapshot_name=snapshot_backup_name)
+                            self.complete_step(journal, "nextcloud-backup")
+
+                        # Create mariadb actual volume backup
+                        if self.run_step(journal, "mariadb-actual-volume-backup"):
+                            self.log_info("DONE. Creating the MariaDB actual volume backup...")
+                            mdbah.create_actual_volume_backup(snapshot_name=snapshot_backup_name)
+                            self.complete_step(journal, "mariadb-actual-volume-backup")
+
+                        # Create mariadb backup volume backup
+                        if not backup_volume_unchanged and self.run_step(journal, "mariadb-backup-volume-backup"):
+                            self.log_info("DONE. Creating the MariaDB backup volume backup...")
+                            mdbah.create_backup_volume_backup(snapshot_name=snapshot_backup_name)
+                            self.complete_step(journal, "mariadb-backup-volume-backup")
+
+                        # Wait for the uploads to the backup target to complete
+                        if self.run_step(journal, "backups-completed"):
+                            self.log_info("DONE. Waiting for the backups to complete...")
+                            backups={
+                                ncah.get_volume_pv_name(): snapshot_backup_name,
+                                mdbah.get_actual_volume_pv_name(): snapshot_backup_name
+                            }
+                            if not backup_volume_unchanged:
+                                backups[mdbah.get_backup_volume_pv_name()]=snapshot_backup_name
+                            backup_results=longhorn_api.wait_for_volume_backups(backups=backups)
+                            self.update_catalog(catalog, lambda catalog: catalog.record_backups(name=snapshot_backup_name, results=backup_results))
+                            self.complete_step(journal, "backups-completed")
+
+                    # Everything went well, the next run can compare the db state with this one
+                    mdbah.save_change_fingerprint(full_backup=(backup_config.backup_type == "FULL-BACKUP"))
+
+                    self.update_catalog(catalog, lambda catalog: catalog.finish_set(
+                        name=snapshot_backup_name, status=BackupCatalog.COMPLETE, duration=time.monotonic() - run_start))
+
+                    # The set is complete, there's nothing left to resume
+                    if journal != None:
+                        journal.finish()
+
+                    self.log_info("DONE. Snapshots and backups processes successfully completed.")
+
+                except (AppHandlerException,LonghornApiInstanceHandlerException) as ahe:
+                    self.log_err("Unable to complete the backups process due to the following issue: " + ahe.message)
+                    self.update_catalog(catalog, lambda catalog: catalog.finish_set(
+                        name=snapshot_backup_name, status=BackupCatalog.FAILED, duration=time.monotonic() - run_start))
+                    return 1
+                ### END - Phase 2 ###
+
+                ### Retention - Cleanup the old snapshots and backups of all the volumes concurrently ###
+                # The snapshots and backups are already safe: a failure here is reported but doesn't fail the run
+                self.log_info("Cleaning up the old snapshots and backups of all the volumes...")
+                retention_tasks={}
+                retention_tasks.update(ncah.get_retention_tasks())
+                retention_tasks.update(mdbah.get_retention_tasks())
+                retention_start=time.monotonic()
+                try:
+                    WorkerPool(max_workers=len(retention_tasks)).run(retention_tasks)
+                    self.log_info("DONE. Retention stage completed in " + "{:.3f}".format(time.monotonic() - retention_start) + "s")
+                except WorkerPoolException as wpe:
+                    self.log_err("Retention stage completed in " + "{:.3f}".format(time.monotonic() - retention_start)
+                        + "s with the following issues (the old snapshots and backups will be retried on the next run): " + wpe.message)
+                ### END - Retention ###
+
+                # The catalog catches up with the snapshots and backups deleted by the retention and created elsewhere
+                self.update_catalog(catalog, lambda catalog: catalog.sync(longhorn_api=longhorn_api, volumes=catalog_volumes))
+
+                self.log_info("DONE. Cleaning up the allocated resources...")
             # The resources will be freed and the correspondent connections closed through the 'with' statement
         except conf_ext.ConfigExtractorException:
             self.log_err(err="Error extracting config values from the main BackupConfig object.")
+            return 1
         except BackupException as e:
             self.log_err("Cannot complete the operations. Note: The operations already done will not be undone. Take care of it on your own.")
+            return 1
         except:
             return 1
 
         self.log_info(msg="DONE. Process completed without errors. BYE!")
         return 0
+
+    def run_step(self, journal, step):
+        # Whether the step has still to be run: without a journal every step is run
+        if journal == None or not journal.is_done(step):
+            return True
+        self.log_info("DONE. Step '" + step + "' already completed by the previous run. Skipping it...")
+        return False
+
+    def complete_step(self, journal, step):
+        if journal != None:
+            journal.complete(step)
+
+    def query_catalog(self, query, since=None, until=None):
+        # Answers the query from the backup catalog alone, without any call to Longhorn, and prints the sets as JSON
+        try:
+            backup_config = BackupConfig()
+        except BackupConfigException as bce:
+            self.log_err("Cannot retrieve the config environment variables.")
+            return 1
+        if backup_config.catalog_path == None:
+            self.log_err("Cannot query the backup catalog: the 'BACKUP_CATALOG_PATH' environment variable is not set.")
+            return 1
+
+        try:
+            with BackupCatalog(file_path=backup_config.catalog_path) as catalog:
+                if query == "latest-complete":
+                    result=catalog.latest_complete_set()
+                elif query == "missing-component":
+                    result=catalog.sets_missing_component()
+                else:
+                    until=until if until != None else datetime.now(timezone.utc)
+                    result=catalog.sets_in_range(since if since != None else until - timedelta(days=7), until)
+        except BackupCatalogException as bce:
+            self.log_err("Cannot query the backup catalog: " + bce.message)
+            return 1
+
+        print(json.dumps(result, indent=2))
+        return 0
+
+    def update_catalog(self, catalog, update):
+        # The catalog is just an index of what is in Longhorn: a failure is reported but doesn't fail the run
+        if catalog == None:
+            return
+        try:
+            update(catalog)
+        except (BackupCatalogException,LonghornApiInstanceHandlerException) as e:
+            self.log_err("Unable to update the backup catalog: " + e.message)
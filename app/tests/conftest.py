@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+# The package is run with the app directory in PYTHONPATH (see the Dockerfile)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kubencbackup.common.loggable import Loggable
+
+
+def make_stub_handler(handler_class, **attributes):
+    # An instance of the real class, so that the handlers type checks pass, built without connecting to anything.
+    # The methods used by the test are replaced by the given attributes
+    handler=handler_class.__new__(handler_class)
+    Loggable.__init__(handler, name="TEST-STUB#####", log_level=2)
+    for name, value in attributes.items():
+        setattr(handler, name, value)
+    return handler
+
+
+@pytest.fixture
+def stub_handler():
+    return make_stub_handler
@@ -0,0 +1,107 @@
+import json
+
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from kubencbackup.common.backupcatalog import BackupCatalog
+
+
+T0=datetime(2024, 3, 10, 2, 0, tzinfo=timezone.utc)
+VOLUMES={"nextcloud": "pv-nextcloud"}
+
+
+class FakeLonghornApi:
+    def __init__(self):
+        self.snapshots={}
+        self.backups=[]
+
+    def get_snapshots(self, pv_name):
+        return self.snapshots
+
+    def list_volume_backups(self, pv_name):
+        return self.backups
+
+
+def backup(snapshot_name, created):
+    return {"name": "backup-" + snapshot_name, "snapshot_name": snapshot_name, "created": created, "size": 1000,
+        "url": "s3://backups?backup=backup-" + snapshot_name}
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    with BackupCatalog(file_path=str(tmp_path / "catalog.db")) as catalog:
+        catalog.add_set(name="set-1", created_at=T0, backup_type="FULL-BACKUP", volumes=VOLUMES)
+        catalog.record_backups(name="set-1", results={"pv-nextcloud": {"id": "backup-set-1", "url": "s3://backups?backup=backup-set-1", "size": 1000}})
+        catalog.finish_set(name="set-1", status=BackupCatalog.COMPLETE)
+        catalog.add_set(name="set-2", created_at=T0 + timedelta(hours=1), backup_type="SNAPSHOT", volumes=VOLUMES)
+        catalog.finish_set(name="set-2", status=BackupCatalog.COMPLETE)
+        yield catalog
+
+
+def components(catalog):
+    return {backup_set["name"]: backup_set["components"]["nextcloud"]
+        for backup_set in catalog.sets_in_range(T0 - timedelta(days=1), T0 + timedelta(days=1))}
+
+
+def test_sync_marks_the_deleted_items_and_imports_the_new_backups(catalog):
+    longhorn_api=FakeLonghornApi()
+    longhorn_api.snapshots={"set-1": SimpleNamespace(removed=True, size="2000"), "set-2": SimpleNamespace(removed=False, size="3000")}
+    longhorn_api.backups=[backup("set-1", T0), backup("manual-1", T0 + timedelta(hours=2))]
+    catalog.sync(longhorn_api=longhorn_api, volumes=VOLUMES)
+
+    rows=components(catalog)
+    assert rows["set-1"]["snapshot_state"] == BackupCatalog.DELETED
+    assert rows["set-1"]["backup_state"] == BackupCatalog.PRESENT
+    assert rows["set-2"]["snapshot_state"] == BackupCatalog.PRESENT
+    assert rows["set-2"]["snapshot_size"] == 3000
+    assert rows["manual-1"]["backup_state"] == BackupCatalog.PRESENT
+    assert rows["manual-1"]["backup_id"] == "backup-manual-1"
+    assert catalog.latest_complete_set()["name"] == "manual-1"
+
+
+def test_sync_only_imports_the_backups_newer_than_the_watermark(catalog):
+    longhorn_api=FakeLonghornApi()
+    longhorn_api.snapshots={"set-2": SimpleNamespace(removed=False, size="3000")}
+    longhorn_api.backups=[backup("set-1", T0), backup("manual-1", T0 + timedelta(hours=2))]
+    catalog.sync(longhorn_api=longhorn_api, volumes=VOLUMES)
+
+    # The backup of set-1 is deleted and an older external backup shows up: it is below the watermark
+    longhorn_api.backups=[backup("manual-0", T0 - timedelta(hours=1)), backup("manual-1", T0 + timedelta(hours=2))]
+    catalog.sync(longhorn_api=longhorn_api, volumes=VOLUMES)
+
+    rows=components(catalog)
+    assert rows["set-1"]["backup_state"] == BackupCatalog.DELETED
+    assert "manual-0" not in rows
+    assert [backup_set["name"] for backup_set in catalog.sets_missing_component()] == ["set-1"]
+
+
+def test_add_set_defaults_to_no_skipped_component(tmp_path):
+    with BackupCatalog(file_path=str(tmp_path / "catalog.db")) as catalog:
+        catalog.add_set(name="set-1", created_at=T0, backup_type="SNAPSHOT", volumes={"nextcloud": "pv-nextcloud", "mariadb": "pv-mariadb"})
+        catalog.add_set(name="set-2", created_at=T0, backup_type="SNAPSHOT", volumes={"mariadb": "pv-mariadb"}, skipped=["mariadb"])
+        catalog.add_set(name="set-3", created_at=T0, backup_type="SNAPSHOT", volumes={"mariadb": "pv-mariadb"})
+        states={backup_set["name"]: {component: row["snapshot_state"] for component, row in backup_set["components"].items()}
+            for backup_set in catalog.sets_in_range(T0, T0)}
+    assert states == {"set-1": {"mariadb": BackupCatalog.PRESENT, "nextcloud": BackupCatalog.PRESENT},
+        "set-2": {"mariadb": BackupCatalog.SKIPPED}, "set-3": {"mariadb": BackupCatalog.PRESENT}}
+
+
+def test_catalog_queries_from_the_command_line(tmp_path, monkeypatch, capsys):
+    kubencbackup=pytest.importorskip("kubencbackup.kubencbackup")
+    with BackupCatalog(file_path=str(tmp_path / "catalog.db")) as catalog:
+        catalog.add_set(name="set-1", created_at=T0, backup_type="SNAPSHOT", volumes=VOLUMES)
+        catalog.finish_set(name="set-1", status=BackupCatalog.COMPLETE)
+    monkeypatch.setattr(kubencbackup, "BackupConfig", lambda: SimpleNamespace(catalog_path=str(tmp_path / "catalog.db")))
+
+    def query(**kw):
+        capsys.readouterr()
+        assert kubencbackup.KubeNCBackup().query_catalog(**kw) == 0
+        # The logs are printed as comments
+        return json.loads("\n".join([line for line in capsys.readouterr().out.splitlines() if not line.startswith("# [")]))
+
+    assert query(query="latest-complete")["name"] == "set-1"
+    assert query(query="missing-component") == []
+    assert query(query="sets-in-range", until=T0 + timedelta(days=8)) == []
+    assert [backup_set["name"] for backup_set in query(query="sets-in-range", until=T0 + timedelta(days=1))] == ["set-1"]
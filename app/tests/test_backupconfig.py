@@ -0,0 +1,40 @@
+import pytest
+
+from kubencbackup.common.backupconfig import BackupConfig, BackupConfigException
+from kubencbackup.common.loggable import Loggable
+
+
+@pytest.fixture
+def config():
+    # The setters are tested one at a time, without the environment variables read by the constructor
+    config=BackupConfig.__new__(BackupConfig)
+    Loggable.__init__(config, name="BACKUP-CONFIG#", log_level=0)
+    return config
+
+
+def test_retention_tiers_are_parsed(config):
+    config.snapshots_retention_tiers="hourly=24, DAILY=7,,WEEKLY = 4"
+    assert config.snapshots_retention_tiers == {"HOURLY": 24, "DAILY": 7, "WEEKLY": 4}
+
+
+def test_retention_tiers_are_optional(config):
+    config.backups_retention_tiers=None
+    assert config.backups_retention_tiers == None
+
+
+@pytest.mark.parametrize("value", ["YEARLY=2", "DAILY", "DAILY=seven", "DAILY=7=1", "DAILY=-1"])
+def test_wrong_retention_tiers_are_rejected(config, value):
+    with pytest.raises(BackupConfigException):
+        config.backups_retention_tiers=value
+
+
+@pytest.mark.parametrize("value, budget", [("1048576", 1048576), ("512k", 524288), (" 2G ", 2147483648)])
+def test_size_budget_is_parsed(config, value, budget):
+    config.snapshots_size_budget=value
+    assert config.snapshots_size_budget == budget
+
+
+@pytest.mark.parametrize("value", ["", "G", "0", "-1M", "1.5G", "10P"])
+def test_wrong_size_budgets_are_rejected(config, value):
+    with pytest.raises(BackupConfigException):
+        config.snapshots_size_budget=value
@@ -0,0 +1,35 @@
+import gzip
+import os
+
+from kubencbackup.common.compressedsink import CompressedSink
+
+
+def test_unchanged_data_keeps_the_existing_file(tmp_path):
+    file_path=str(tmp_path / "table.sql.gz")
+
+    with CompressedSink(file_path=file_path) as sink:
+        sink.write("INSERT INTO t VALUES (1);\n")
+    mtime=os.stat(file_path).st_mtime_ns
+
+    with CompressedSink(file_path=file_path, previous_digest=sink.digest) as unchanged_sink:
+        unchanged_sink.write("INSERT INTO t VALUES (1);\n")
+
+    assert unchanged_sink.unchanged
+    assert os.stat(file_path).st_mtime_ns == mtime
+    # The temporary file is deleted
+    assert os.listdir(tmp_path) == ["table.sql.gz"]
+
+
+def test_changed_data_replaces_the_existing_file(tmp_path):
+    file_path=str(tmp_path / "table.sql.gz")
+
+    with CompressedSink(file_path=file_path) as sink:
+        sink.write("INSERT INTO t VALUES (1);\n")
+    with CompressedSink(file_path=file_path, previous_digest=sink.digest) as changed_sink:
+        changed_sink.write("INSERT INTO t VALUES (2);\n")
+
+    assert not changed_sink.unchanged
+    assert changed_sink.digest != sink.digest
+    with gzip.open(file_path) as f:
+        assert f.read() == b"INSERT INTO t VALUES (2);\n"
+    assert os.listdir(tmp_path) == ["table.sql.gz"]
@@ -0,0 +1,23 @@
+import importlib
+
+import pytest
+
+# The handlers need the runtime dependencies, longhornlib being downloaded when the image is built
+pytest.importorskip("kubernetes")
+pytest.importorskip("mariadb")
+pytest.importorskip("kubencbackup.extlib.longhornlib")
+
+MODULES=[
+    "kubencbackup.apihandlers.kubernetesapi",
+    "kubencbackup.apihandlers.longhornapi",
+    "kubencbackup.apihandlers.mariadbapi",
+    "kubencbackup.apihandlers.mariadbdump",
+    "kubencbackup.apphandlers.mariadbapp",
+    "kubencbackup.apphandlers.nextcloudapp",
+    "kubencbackup.common.configextractor",
+    "kubencbackup.kubencbackup"
+]
+
+@pytest.mark.parametrize("module", MODULES)
+def test_import(module):
+    importlib.import_module(module)
@@ -0,0 +1,175 @@
+from types import SimpleNamespace
+
+import pytest
+
+kubencbackup=pytest.importorskip("kubencbackup.kubencbackup")
+
+
+class FakeApi:
+    # Stands for the api handlers: opened and closed by the 'with' statement
+    def __init__(self, events, name):
+        self.events=events
+        self.name=name
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def create_volume_snapshots(self, snapshot_name, pv_names):
+        self.events.append("snapshots " + ",".join(pv_names))
+
+    def wait_for_volume_backups(self, backups):
+        self.events.append("wait backups")
+        return {}
+
+
+class FakeNextcloudApp:
+    def __init__(self, events):
+        self.events=events
+        self.drain_task=None
+
+    def __enter__(self):
+        if self.drain_task != None:
+            self.drain_task()
+        self.events.append("maintenance on")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.events.append("maintenance off")
+
+    def get_warm_up_tasks(self):
+        return {"nextcloud-volume": lambda: self.events.append("warm-up nextcloud")}
+
+    def get_volume_pv_name(self):
+        return "pv-nextcloud"
+
+    def create_volume_snapshot(self, snapshot_name):
+        self.events.append("snapshot nextcloud")
+
+    def create_volume_backup(self, snapshot_name):
+        self.events.append("backup nextcloud")
+
+    def get_retention_tasks(self):
+        return {"nextcloud-volume": lambda: self.events.append("retention nextcloud")}
+
+
+class FakeMariaDBApp:
+    def __init__(self, events, retention_error=None):
+        self.events=events
+        self.retention_error=retention_error
+
+    def __enter__(self):
+        self.events.append("backup mode on")
+        return self
+
+    def __exit__(self, *exc_info):
+        self.events.append("backup mode off")
+
+    def get_warm_up_tasks(self):
+        return {"mariadb-actual-volume": lambda: self.events.append("warm-up mariadb")}
+
+    def get_actual_volume_pv_name(self):
+        return "pv-mariadb"
+
+    def get_backup_volume_pv_name(self):
+        return "pv-mariadb-backup"
+
+    def wait_for_long_running_work(self):
+        self.events.append("preflight")
+
+    def create_mariadb_dump(self):
+        self.events.append("dump")
+
+    def is_backup_volume_unchanged(self, full_backup):
+        return False
+
+    def create_backup_volume_snapshot(self, snapshot_name):
+        self.events.append("snapshot mariadb backup")
+
+    def block_commit(self):
+        self.events.append("block commit")
+
+    def create_actual_volume_snapshot(self, snapshot_name):
+        self.events.append("snapshot mariadb actual")
+
+    def create_actual_volume_backup(self, snapshot_name):
+        self.events.append("backup mariadb actual")
+
+    def create_backup_volume_backup(self, snapshot_name):
+        self.events.append("backup mariadb backup")
+
+    def save_change_fingerprint(self, full_backup):
+        self.events.append("fingerprint")
+
+    def get_retention_tasks(self):
+        def retention():
+            if self.retention_error != None:
+                raise self.retention_error
+            self.events.append("retention mariadb")
+        return {"mariadb-actual-volume": retention}
+
+
+@pytest.fixture
+def run(monkeypatch):
+    # Runs the main flow on the fake apps and returns its exit code and the events in order
+    def run(retention_error=None, **config):
+        events=[]
+        backup_config=SimpleNamespace(state_path=None, catalog_path=None, db_replica_app_name=None, backup_type="FULL-BACKUP",
+            dump_scheduling="SEQUENTIAL", snapshot_mode="SEQUENTIAL")
+        for name, value in config.items():
+            setattr(backup_config, name, value)
+        monkeypatch.setattr(kubencbackup, "BackupConfig", lambda: backup_config)
+        monkeypatch.setattr(kubencbackup, "conf_ext", SimpleNamespace(ConfigExtractorException=Exception, **{name: lambda config: None for name in [
+            "backupconfig_to_k8s_api_instance_config", "backupconfig_to_mariadb_api_instance_config", "backupconfig_to_mariadb_replica_api_instance_config",
+            "backupconfig_to_longhorn_api_instance_config", "backupconfig_to_nextcloud_app_config", "backupconfig_to_mariadb_app_config"]}))
+        for name in ["K8sApiInstanceHandler", "MariaDBApiInstanceHandler", "LonghornApiInstanceHandler"]:
+            monkeypatch.setattr(kubencbackup, name, lambda config, name=name: FakeApi(events, name))
+        monkeypatch.setattr(kubencbackup, "NextcloudAppHandler", lambda **kw: FakeNextcloudApp(events))
+        monkeypatch.setattr(kubencbackup, "MariaDBAppHandler", lambda **kw: FakeMariaDBApp(events, retention_error=retention_error))
+        return kubencbackup.KubeNCBackup().main(), events
+    return run
+
+
+def test_warm_up_runs_before_the_maintenance_mode(run):
+    returncode, events=run()
+    assert returncode == 0
+    assert set(events[:2]) == {"warm-up nextcloud", "warm-up mariadb"}
+    assert events.index("preflight") < events.index("maintenance on")
+
+
+def test_maintenance_mode_is_left_before_the_uploads(run):
+    returncode, events=run()
+    assert returncode == 0
+    assert events[events.index("maintenance on"):events.index("maintenance off") + 1] == ["maintenance on", "dump", "backup mode on",
+        "snapshot nextcloud", "snapshot mariadb backup", "block commit", "snapshot mariadb actual", "backup mode off", "maintenance off"]
+    assert events[events.index("maintenance off") + 1:events.index("fingerprint")] == ["backup nextcloud", "backup mariadb actual",
+        "backup mariadb backup", "wait backups"]
+
+
+def test_overlapped_dump_runs_while_draining_nextcloud(run):
+    returncode, events=run(dump_scheduling="OVERLAP")
+    assert returncode == 0
+    assert events.index("preflight") < events.index("dump") < events.index("maintenance on")
+    assert events.count("dump") == 1
+
+
+def test_concurrent_snapshots(run):
+    returncode, events=run(snapshot_mode="CONCURRENT")
+    assert returncode == 0
+    assert "snapshots pv-nextcloud,pv-mariadb-backup" in events
+    assert "snapshot nextcloud" not in events
+
+
+def test_retention_runs_after_the_backups(run):
+    returncode, events=run()
+    assert returncode == 0
+    assert set(events[-2:]) == {"retention nextcloud", "retention mariadb"}
+    assert events.index("fingerprint") < events.index("retention nextcloud")
+
+
+def test_retention_failure_does_not_fail_the_run(run):
+    returncode, events=run(retention_error=kubencbackup.AppHandlerException(message="cannot delete the snapshot"))
+    assert returncode == 0
+    assert "retention nextcloud" in events
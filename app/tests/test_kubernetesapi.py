@@ -0,0 +1,264 @@
+import base64
+import re
+
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("kubernetes")
+
+from kubencbackup.apihandlers.kubernetesapi import K8sApiInstanceConfig, K8sApiInstanceHandler, K8sApiInstanceHandlerException, K8sBinaryExecStream, K8sExecSession, K8sExecStream, hide_passwords
+from kubernetes.stream.ws_client import STDERR_CHANNEL, STDOUT_CHANNEL
+
+
+class FakeWSClient:
+    # Replies to each command written on stdin with the given frames, the end markers being split across them
+    def __init__(self, frames_factory):
+        self.frames_factory=frames_factory
+        self.frames=[]
+        self.commands=[]
+        self.closed=False
+
+    def write_stdin(self, data):
+        self.commands.append(data)
+        marker=re.search(r"__KNCB_[0-9a-f]+__", data).group(0)
+        self.frames=list(self.frames_factory(marker))
+
+    def is_open(self):
+        return not self.closed
+
+    def update(self, timeout=0):
+        pass
+
+    def read_channel(self, channel):
+        if len(self.frames) == 0 or self.frames[0][0] != channel:
+            return ""
+        return self.frames.pop(0)[1]
+
+    def close(self):
+        self.closed=True
+
+
+def run(frames_factory, **kw):
+    ws_client=FakeWSClient(frames_factory)
+    session=K8sExecSession(ws_client=ws_client, pod_name="nextcloud-0")
+    stream=session.run(command="echo hello", **kw)
+    output={"stdout": "", "stderr": ""}
+    for channel, data in stream:
+        output[channel]+=data
+    return ws_client, stream, output
+
+
+def test_markers_split_across_frames():
+    def frames(marker):
+        yield STDOUT_CHANNEL, "hel"
+        yield STDERR_CHANNEL, "warn" + marker[:5]
+        yield STDOUT_CHANNEL, "lo\n" + marker[:7]
+        yield STDOUT_CHANNEL, marker[7:] + " 3"
+        yield STDERR_CHANNEL, marker[5:] + "\n"
+        yield STDOUT_CHANNEL, "\n"
+
+    ws_client, stream, output=run(frames)
+    assert output == {"stdout": "hello\n", "stderr": "warn"}
+    assert stream.returncode == 3
+    assert stream.output_bytes == len("hello\nwarn")
+    assert not ws_client.closed
+
+
+def test_session_is_reused_by_the_next_command():
+    def frames(marker):
+        yield STDOUT_CHANNEL, "ok\n" + marker + " 0\n"
+        yield STDERR_CHANNEL, marker + "\n"
+
+    ws_client=FakeWSClient(frames)
+    session=K8sExecSession(ws_client=ws_client, pod_name="nextcloud-0")
+    for command in ["true", "false"]:
+        stream=session.run(command=command)
+        assert list(stream) == [("stdout", "ok\n")]
+        assert stream.returncode == 0
+    assert len(ws_client.commands) == 2
+    assert session.is_open()
+
+
+def test_output_size_limit_closes_the_session():
+    def frames(marker):
+        yield STDOUT_CHANNEL, "x" * 100 + marker + " 0\n"
+        yield STDERR_CHANNEL, marker + "\n"
+
+    ws_client=FakeWSClient(frames)
+    session=K8sExecSession(ws_client=ws_client, pod_name="nextcloud-0")
+    with pytest.raises(K8sApiInstanceHandlerException):
+        list(session.run(command="cat big-file", max_output_bytes=10))
+    assert not session.is_open()
+
+
+def test_closed_websocket_is_reported():
+    def frames(marker):
+        yield STDOUT_CHANNEL, "partial"
+
+    ws_client=FakeWSClient(frames)
+    session=K8sExecSession(ws_client=ws_client, pod_name="nextcloud-0")
+    stream=session.run(command="sleep 10 --password=secret")
+    ws_client.closed=True
+    with pytest.raises(K8sApiInstanceHandlerException) as e:
+        list(stream)
+    assert "secret" not in str(e.value)
+
+
+def test_binary_stdout_split_across_frames():
+    data="caffè ☕ ".encode("utf-8") * 50 + bytes(range(256))
+    encoded=base64.encodebytes(data).decode("ascii")
+
+    def frames(marker):
+        # Frames of 7 characters: the base64 groups and lines are split anywhere
+        for index in range(0, len(encoded), 7):
+            yield STDOUT_CHANNEL, encoded[index:index + 7]
+        yield STDOUT_CHANNEL, marker + " 0\n"
+        yield STDERR_CHANNEL, "note\n" + marker + "\n"
+
+    ws_client=FakeWSClient(frames)
+    session=K8sExecSession(ws_client=ws_client, pod_name="mariadb-0")
+    stream=K8sBinaryExecStream(session.run(command=K8sBinaryExecStream.wrap_command("mysqldump")))
+    output={"stdout": b"", "stderr": ""}
+    for channel, chunk in stream:
+        output[channel]+=chunk
+    assert output == {"stdout": data, "stderr": "note\n"}
+    assert stream.returncode == 0
+    assert "set -o pipefail; (mysqldump) | base64" in ws_client.commands[0]
+
+
+def test_binary_stdout_not_in_base64_is_reported():
+    def frames(marker):
+        yield STDOUT_CHANNEL, "not base64!\n" + marker + " 0\n"
+        yield STDERR_CHANNEL, marker + "\n"
+
+    session=K8sExecSession(ws_client=FakeWSClient(frames), pod_name="mariadb-0")
+    with pytest.raises(K8sApiInstanceHandlerException):
+        list(K8sBinaryExecStream(session.run(command="mysqldump")))
+
+
+class FakeCommandStream:
+    def __init__(self, chunks, returncode):
+        self.chunks=chunks
+        self.returncode=returncode
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+def test_hide_passwords():
+    assert hide_passwords("mysqldump --password='a b' --all-databases --password=x") == "mysqldump --password=******** --all-databases --password=********"
+
+
+def test_command_failure_is_reported(stub_handler):
+    k8s_api=stub_handler(K8sApiInstanceHandler,
+        exec_container_command_stream=lambda **kw: FakeCommandStream([("stdout", "done\n")], returncode=0))
+    assert k8s_api.exec_container_command(pod_label="app=mariadb", command="true") == "done\n"
+
+    k8s_api=stub_handler(K8sApiInstanceHandler,
+        exec_container_command_stream=lambda **kw: FakeCommandStream([("stderr", "access denied\n")], returncode=2))
+    with pytest.raises(K8sApiInstanceHandlerException) as e:
+        k8s_api.exec_container_command(pod_label="app=mariadb", command="mysqldump --password=secret")
+    assert "exited with code 2" in str(e.value)
+    assert "secret" not in str(e.value)
+
+
+class FakeCommandWSClient:
+    # Per-command exec websocket sending the given stdout frames, then the exit status
+    def __init__(self, frames, returncode=0):
+        self.frames=list(frames)
+        self.returncode=returncode
+
+    def is_open(self):
+        return len(self.frames) > 0
+
+    def update(self, timeout=0):
+        pass
+
+    def read_channel(self, channel):
+        if channel == STDOUT_CHANNEL and len(self.frames) > 0:
+            return self.frames.pop(0)
+        return ""
+
+    def close(self):
+        pass
+
+
+def test_command_stream_yields_the_frames_and_the_exit_code():
+    stream=K8sExecStream(ws_client=FakeCommandWSClient(["a", "b"], returncode=1), command="false")
+    assert list(stream) == [("stdout", "a"), ("stdout", "b")]
+    assert stream.returncode == 1
+    assert stream.output_bytes == 2
+
+
+def test_command_stream_limits():
+    with pytest.raises(K8sApiInstanceHandlerException):
+        list(K8sExecStream(ws_client=FakeCommandWSClient(["x" * 10] * 3), command="cat", max_output_bytes=15))
+    with pytest.raises(K8sApiInstanceHandlerException):
+        list(K8sExecStream(ws_client=FakeCommandWSClient(["x"] * 3), command="sleep 1", timeout=-1))
+
+
+def test_exec_sessions_are_opt_in():
+    assert K8sApiInstanceConfig(namespace="nextcloud").exec_sessions == False
+
+
+def test_closing_a_partly_read_stream_releases_the_session():
+    def frames(marker):
+        yield STDOUT_CHANNEL, "first chunk, " + "x" * 100
+        yield STDOUT_CHANNEL, "second chunk"
+
+    ws_client=FakeWSClient(frames)
+    session=K8sExecSession(ws_client=ws_client, pod_name="mariadb-0")
+    with session.run(command="mysqldump") as stream:
+        next(iter(stream))
+
+    # The lock is released and the session, left in the middle of the output, is closed
+    assert session.lock.acquire(blocking=False)
+    session.lock.release()
+    assert not session.is_open()
+
+
+class FakeCoreV1Api:
+    def __init__(self, pvcs):
+        # {PVC name: bound PV name or None}
+        self.pvcs=pvcs
+        self.pvc_listings=0
+
+    def list_namespaced_persistent_volume_claim(self, namespace):
+        self.pvc_listings+=1
+        return SimpleNamespace(items=[SimpleNamespace(metadata=SimpleNamespace(name=name), spec=SimpleNamespace(volume_name=pv_name))
+            for name, pv_name in self.pvcs.items()])
+
+
+def test_pv_names_are_resolved_from_the_run_cache():
+    core_v1_api=FakeCoreV1Api({"nextcloud-data": "pv-nextcloud", "mariadb-data": "pv-mariadb"})
+    k8s_api=K8sApiInstanceHandler(conf=K8sApiInstanceConfig(namespace="nextcloud"))
+    k8s_api.k8s_api_instance=core_v1_api
+    k8s_api.load_pv_names_cache()
+
+    assert k8s_api.get_pv_name_from_pvc_name(pvc_name="nextcloud-data") == "pv-nextcloud"
+    assert k8s_api.get_pv_name_from_pvc_name(pvc_name="mariadb-data") == "pv-mariadb"
+    assert (core_v1_api.pvc_listings, k8s_api.pv_names_cache_hits, k8s_api.pv_names_cache_misses) == (1, 2, 0)
+
+    # A PVC created after the warm-up reloads the cache once
+    core_v1_api.pvcs["mariadb-backup"]="pv-mariadb-backup"
+    assert k8s_api.get_pv_name_from_pvc_name(pvc_name="mariadb-backup") == "pv-mariadb-backup"
+    assert (core_v1_api.pvc_listings, k8s_api.pv_names_cache_misses) == (2, 1)
+
+
+def test_unbound_pvc_is_looked_up_again():
+    core_v1_api=FakeCoreV1Api({"mariadb-backup": None})
+    k8s_api=K8sApiInstanceHandler(conf=K8sApiInstanceConfig(namespace="nextcloud"))
+    k8s_api.k8s_api_instance=core_v1_api
+    with pytest.raises(K8sApiInstanceHandlerException):
+        k8s_api.get_pv_name_from_pvc_name(pvc_name="mariadb-backup")
+
+    core_v1_api.pvcs["mariadb-backup"]="pv-mariadb-backup"
+    assert k8s_api.get_pv_name_from_pvc_name(pvc_name="mariadb-backup") == "pv-mariadb-backup"
+    assert core_v1_api.pvc_listings == 2
@@ -0,0 +1,252 @@
+import json
+import os
+
+from types import SimpleNamespace
+
+import pytest
+
+longhornlib=pytest.importorskip("kubencbackup.extlib.longhornlib")
+
+import kubencbackup.apihandlers.longhornapi as longhornapi
+
+from kubencbackup.apihandlers.longhornapi import LonghornApiInstanceConfig, LonghornApiInstanceHandler, LonghornApiInstanceHandlerException, LonghornClient
+
+
+class FakeClock:
+    # time.monotonic and time.sleep of the handler, the sleeps moving the clock
+    def __init__(self):
+        self.now=1000.0
+        self.sleeps=[]
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now+=seconds
+
+
+class FakeLonghornClient:
+    def __init__(self, volumes=None, backup_statuses=None, backup_volumes=None):
+        self.volumes=dict(volumes or {})
+        self.backup_volumes=dict(backup_volumes or {})
+        # {volume name: [backupStatus lists, one per poll, the last one repeated]}
+        self.backup_statuses=dict(backup_statuses or {})
+        self.calls=[]
+
+    def by_id_volume(self, id):
+        self.calls.append(("by_id_volume", id))
+        if id in self.backup_statuses:
+            polls=self.backup_statuses[id]
+            return SimpleNamespace(name=id, backupStatus=polls.pop(0) if len(polls) > 1 else polls[0])
+        return self.volumes.get(id)
+
+    def by_id_backupVolume(self, id):
+        self.calls.append(("by_id_backupVolume", id))
+        return self.backup_volumes.get(id)
+
+
+def backup_status(progress, error="", size="1048576"):
+    return SimpleNamespace(snapshot="backup-1", progress=progress, error=error, size=size, id="backup-id", backupURL="s3://backups?backup=backup-id")
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock=FakeClock()
+    monkeypatch.setattr(longhornapi, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def handler():
+    def make_handler(client, **config):
+        longhorn_api=LonghornApiInstanceHandler(config=LonghornApiInstanceConfig(longhorn_url="http://longhorn", nr_snapshots_to_retain=3,
+            nr_backups_to_retain=3, **config))
+        longhorn_api.client=client
+        return longhorn_api
+    return make_handler
+
+
+def test_backups_are_polled_until_completed(handler, clock):
+    client=FakeLonghornClient(backup_statuses={
+        "pv-nextcloud": [[], [backup_status(40)], [backup_status(100)]],
+        "pv-mariadb": [[backup_status(100, size="2097152")]]
+    })
+    results=handler(client).wait_for_volume_backups({"pv-nextcloud": "backup-1", "pv-mariadb": "backup-1"})
+    assert results["pv-nextcloud"]["size"] == 1048576
+    assert results["pv-mariadb"]["url"] == "s3://backups?backup=backup-id"
+    # The poll interval is doubled at every poll
+    assert clock.sleeps == [1, 2]
+
+
+def test_stalled_and_failed_backups_are_reported(handler, clock):
+    client=FakeLonghornClient(backup_statuses={
+        "pv-nextcloud": [[backup_status(40)]],
+        "pv-mariadb": [[backup_status(10, error="backup target unreachable")]]
+    })
+    with pytest.raises(LonghornApiInstanceHandlerException) as e:
+        handler(client, backup_stall_timeout=60).wait_for_volume_backups({"pv-nextcloud": "backup-1", "pv-mariadb": "backup-1"})
+    assert "pv-nextcloud: stalled at 40% for more than 60s" in str(e.value)
+    assert "pv-mariadb: backup target unreachable" in str(e.value)
+    # Given up once the stall timeout is over, not before
+    assert 60 < sum(clock.sleeps) <= 60 + 30
+
+
+class FakeVolume:
+    def __init__(self, name, snapshots=()):
+        self.name=name
+        self.state="attached"
+        self.robustness="healthy"
+        self.snapshots=[SimpleNamespace(name=snapshot_name) for snapshot_name in snapshots]
+        self.created=[]
+        self.listings=0
+
+    def snapshotCreate(self, name):
+        self.created.append(name)
+        return SimpleNamespace(name=name)
+
+    def snapshotList(self):
+        self.listings+=1
+        return SimpleNamespace(data=list(self.snapshots))
+
+
+def test_volume_snapshots_are_created_concurrently(handler):
+    volumes={pv_name: FakeVolume(pv_name) for pv_name in ["pv-nextcloud", "pv-mariadb"]}
+    tasks=handler(FakeLonghornClient(volumes=volumes), max_workers=2).create_volume_snapshots(snapshot_name="backup-1", pv_names=list(volumes))
+    assert sorted(tasks) == ["pv-mariadb", "pv-nextcloud"]
+    assert all(volume.created == ["backup-1"] for volume in volumes.values())
+
+
+def test_missing_volume_releases_the_other_snapshots(handler):
+    # The snapshot of the volume found must not wait for the barrier timeout
+    volumes={"pv-nextcloud": FakeVolume("pv-nextcloud")}
+    longhorn_api=handler(FakeLonghornClient(volumes=volumes), max_workers=2)
+    with pytest.raises(LonghornApiInstanceHandlerException) as e:
+        longhorn_api.create_volume_snapshots(snapshot_name="backup-1", pv_names=["pv-nextcloud", "pv-missing"])
+    assert "pv-missing" in str(e.value)
+    assert volumes["pv-nextcloud"].created == []
+
+
+def test_volumes_and_snapshots_are_listed_once_per_run(handler):
+    volume=FakeVolume("pv-nextcloud", snapshots=["backup-0"])
+    client=FakeLonghornClient(volumes={"pv-nextcloud": volume})
+    longhorn_api=handler(client, max_workers=1)
+
+    assert longhorn_api.get_volume(pv_name="pv-nextcloud") is volume
+    assert sorted(longhorn_api.get_snapshots(pv_name="pv-nextcloud")) == ["backup-0"]
+    longhorn_api.create_volume_snapshot(snapshot_name="backup-1", pv_name="pv-nextcloud")
+    # The snapshot created during the run is indexed without listing the snapshots again
+    assert longhorn_api.has_snapshot(pv_name="pv-nextcloud", snapshot_name="backup-1")
+    assert sorted(longhorn_api.get_snapshots(pv_name="pv-nextcloud")) == ["backup-0", "backup-1"]
+    assert client.calls == [("by_id_volume", "pv-nextcloud")]
+    assert volume.listings == 1
+
+    longhorn_api.invalidate_cache()
+    assert not longhorn_api.has_snapshot(pv_name="pv-nextcloud", snapshot_name="backup-1")
+    assert len(client.calls) == 2 and volume.listings == 2
+
+
+def test_created_snapshots_dont_stand_for_the_listing(handler):
+    volume=FakeVolume("pv-nextcloud", snapshots=["backup-0"])
+    longhorn_api=handler(FakeLonghornClient(volumes={"pv-nextcloud": volume}), max_workers=1)
+    longhorn_api.create_volume_snapshot(snapshot_name="backup-1", pv_name="pv-nextcloud")
+    assert longhorn_api.has_snapshot(pv_name="pv-nextcloud", snapshot_name="backup-1")
+    assert volume.listings == 0
+    # The index of the created snapshots doesn't stand for the full listing
+    assert longhorn_api.has_snapshot(pv_name="pv-nextcloud", snapshot_name="backup-0")
+    assert volume.listings == 1
+
+
+def schema_text(*type_names):
+    return json.dumps({"type": "collection", "data": [{"id": type_name, "type": "schema", "collectionMethods": ["GET"], "resourceMethods": ["GET"],
+        "links": {"collection": "http://longhorn/v1/" + type_name + "s"}} for type_name in type_names]})
+
+
+@pytest.fixture
+def schema_server(monkeypatch):
+    # The schema sent by Longhorn, the requests are counted
+    server=SimpleNamespace(text=schema_text("volume", "backupVolume"), requests=[])
+
+    def get_response(client, url, data=None):
+        server.requests.append(url)
+        return SimpleNamespace(status_code=200, headers={}, text=server.text)
+
+    monkeypatch.setattr(longhornlib.Client, "_get_response", get_response)
+    return server
+
+
+def test_schema_is_cached_by_url(schema_server, tmp_path):
+    LonghornClient(url="http://longhorn/v1", pool_size=2, schema_cache_path=str(tmp_path)).close()
+    client=LonghornClient(url="http://longhorn/v1", pool_size=2, schema_cache_path=str(tmp_path))
+    # Just the schema download of the first client, no version request
+    assert schema_server.requests == ["http://longhorn/v1"]
+    assert sorted(client.schema.types) == ["backupVolume", "volume"]
+    assert len(os.listdir(tmp_path)) == 1
+
+    LonghornClient(url="http://longhorn-upgraded/v1", pool_size=2, schema_cache_path=str(tmp_path))
+    assert len(schema_server.requests) == 2
+
+
+def test_outdated_schema_is_downloaded_again(schema_server, tmp_path):
+    schema_server.text=schema_text("volume")
+    LonghornClient(url="http://longhorn/v1", pool_size=2, schema_cache_path=str(tmp_path))
+    assert len(schema_server.requests) == 1
+
+    # The cached schema lacks a type used by the handler
+    schema_server.text=schema_text("volume", "backupVolume")
+    LonghornClient(url="http://longhorn/v1", pool_size=2, schema_cache_path=str(tmp_path))
+    assert len(schema_server.requests) == 2
+    LonghornClient(url="http://longhorn/v1", pool_size=2, schema_cache_path=str(tmp_path))
+    assert len(schema_server.requests) == 2
+
+    # Expired after a day
+    cached_schema=os.path.join(tmp_path, os.listdir(tmp_path)[0])
+    os.utime(cached_schema, (os.path.getmtime(cached_schema) - 25 * 3600,) * 2)
+    LonghornClient(url="http://longhorn/v1", pool_size=2, schema_cache_path=str(tmp_path))
+    assert len(schema_server.requests) == 3
+
+
+class RetentionVolume(FakeVolume):
+    # Volume and backup volume at the same time: {name: creation time} snapshots and backups, the deletes recorded
+    def __init__(self, name, snapshots=None, backups=None, failing=()):
+        super().__init__(name)
+        self.snapshots=[SimpleNamespace(name=snapshot_name, created=created, removed=False, size="0") for snapshot_name, created in (snapshots or {}).items()]
+        self.backups=[SimpleNamespace(name=backup_name, snapshotCreated=created, progress=100) for backup_name, created in (backups or {}).items()]
+        self.failing=failing
+        self.deleted=[]
+
+    def snapshotDelete(self, name):
+        self.deleted.append(name)
+
+    def backupList(self):
+        return SimpleNamespace(data=list(self.backups))
+
+    def backupDelete(self, name):
+        if name in self.failing:
+            raise RuntimeError("cannot delete " + name)
+        self.deleted.append(name)
+
+
+def test_old_snapshots_are_deleted_oldest_first(handler):
+    volume=RetentionVolume("pv-nextcloud", snapshots={"backup-1": "2024-03-01T02:00:00Z", "backup-2": "2024-03-02T02:00:00Z",
+        "backup-3b": "2024-03-03T02:00:00Z", "backup-3a": "2024-03-03T02:00:00Z", "backup-4": "2024-03-04T02:00:00Z",
+        "backup-5": "2024-03-05T02:00:00Z", "volume-head": "2024-03-06T02:00:00Z"})
+    # The volume head and the snapshots already removed are never candidates
+    volume.snapshots.append(SimpleNamespace(name="backup-0", created="2024-02-28T02:00:00Z", removed=True, size="0"))
+    longhorn_api=handler(FakeLonghornClient(volumes={"pv-nextcloud": volume}), max_workers=2)
+    longhorn_api.delete_snapshots_over_retain_count(pv_name="pv-nextcloud")
+    # The snapshots created at the same time are both kept in the sort, ordered by name
+    assert sorted(volume.deleted) == ["backup-1", "backup-2", "backup-3a"]
+    assert not longhorn_api.has_snapshot(pv_name="pv-nextcloud", snapshot_name="backup-1")
+
+
+def test_every_old_backup_is_deleted_despite_the_failures(handler):
+    volume=RetentionVolume("pv-nextcloud", backups={"backup-" + str(day): "2024-03-0" + str(day) + "T02:00:00Z" for day in range(1, 8)},
+        failing=["backup-2"])
+    # An upload in progress is not a candidate
+    volume.backups.append(SimpleNamespace(name="backup-0", snapshotCreated="2024-02-28T02:00:00Z", progress=50))
+    longhorn_api=handler(FakeLonghornClient(backup_volumes={"pv-nextcloud": volume}), max_workers=2)
+    with pytest.raises(LonghornApiInstanceHandlerException) as e:
+        longhorn_api.delete_backups_over_retain_count(pv_name="pv-nextcloud")
+    assert "cannot delete backup-2" in str(e.value)
+    assert sorted(volume.deleted) == ["backup-1", "backup-3", "backup-4"]
@@ -0,0 +1,78 @@
+import threading
+
+import pytest
+
+mariadb=pytest.importorskip("mariadb")
+
+from kubencbackup.apihandlers.mariadbapi import MariaDBApiInstanceConfig, MariaDBApiInstanceHandler, MariaDBApiInstanceHandlerException
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed=False
+
+    def cursor(self, dictionary=False):
+        return self
+
+    def close(self):
+        self.closed=True
+
+
+class FakeConnectionPool:
+    def __init__(self, pool_name, pool_size, **kw):
+        self.connections=[]
+
+    def get_connection(self):
+        self.connections.append(FakeConnection())
+        return self.connections[-1]
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def mariadb_api(monkeypatch):
+    monkeypatch.setattr(mariadb, "connect", lambda **kw: FakeConnection(), raising=False)
+    monkeypatch.setattr(mariadb, "ConnectionPool", FakeConnectionPool)
+    config=MariaDBApiInstanceConfig(db_url="mariadb", db_port=3306, db_root_password="secret", pool_size=2)
+    with MariaDBApiInstanceHandler(config=config) as mariadb_api:
+        yield mariadb_api
+
+
+def test_connections_are_given_back_to_the_pool(mariadb_api):
+    with mariadb_api.connection() as first:
+        with mariadb_api.connection() as second:
+            assert first is not second
+            assert mariadb_api.pool_stats["in_use"] == 2
+    assert first.closed and second.closed
+    stats=mariadb_api.pool_stats
+    assert (stats["borrowed"], stats["in_use"], stats["peak_in_use"]) == (2, 0, 2)
+
+
+def test_borrowers_wait_for_a_free_connection(mariadb_api):
+    borrowed=threading.Event()
+
+    def borrow():
+        with mariadb_api.connection():
+            borrowed.set()
+
+    with mariadb_api.connection(), mariadb_api.connection():
+        thread=threading.Thread(target=borrow)
+        thread.start()
+        # The pool is exhausted until a connection is given back
+        assert not borrowed.wait(timeout=0.2)
+    assert borrowed.wait(timeout=5)
+    thread.join()
+    assert mariadb_api.pool_stats["max_wait_time"] >= 0.2
+
+
+def test_connection_errors_keep_the_message(monkeypatch):
+    def connect(**kw):
+        raise mariadb.Error("Access denied for user 'root'")
+
+    monkeypatch.setattr(mariadb, "connect", connect, raising=False)
+    config=MariaDBApiInstanceConfig(db_url="mariadb", db_port=3306, db_root_password="secret")
+    with pytest.raises(MariaDBApiInstanceHandlerException) as e:
+        with MariaDBApiInstanceHandler(config=config):
+            pass
+    assert "Access denied for user 'root'" in str(e.value)
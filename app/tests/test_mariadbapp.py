@@ -0,0 +1,272 @@
+import pytest
+
+pytest.importorskip("kubernetes")
+pytest.importorskip("mariadb")
+pytest.importorskip("kubencbackup.extlib.longhornlib")
+
+from kubencbackup.apihandlers.kubernetesapi import K8sApiInstanceHandler
+from kubencbackup.apihandlers.longhornapi import LonghornApiInstanceHandler
+from kubencbackup.apihandlers.mariadbapi import MariaDBApiInstanceHandler
+from kubencbackup.apphandlers.mariadbapp import MariaDBAppConfig, MariaDBAppHandler, MariaDBAppHandlerException
+from kubencbackup.common.runstate import RunState
+
+
+class FakeMariaDBApi:
+    # Replies to the queries with the given rows, in order when a list of replies is given, and records the commands
+    def __init__(self, replies=None):
+        self.replies=dict(replies or {})
+        self.commands=[]
+        self.queries=[]
+
+    def exec_sql_command(self, command):
+        self.commands.append(command)
+
+    def exec_sql_query(self, query, params=(), dictionary=False):
+        self.queries.append(query)
+        reply=self.replies[query]
+        if type(reply) == list and len(reply) > 0 and type(reply[0]) == list:
+            return reply.pop(0) if len(reply) > 1 else reply[0]
+        return reply
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr("kubencbackup.apphandlers.mariadbapp.time.sleep", lambda seconds: None)
+
+
+@pytest.fixture
+def handler(stub_handler):
+    def make_handler(mariadb_api=None, k8s_api=None, longhorn_api=None, replica_api=None, run_state=None, **config):
+        def stub(handler_class, fake, **attributes):
+            # The real handler class with the public methods of the fake
+            attributes.update({name: getattr(fake, name) for name in dir(fake) if not name.startswith("_")})
+            return stub_handler(handler_class, **attributes)
+        app_config=MariaDBAppConfig(db_app_name="mariadb", db_root_password="secret", db_actual_volume_name="mariadb-data",
+            db_backup_volume_name="mariadb-backup", db_backup_file_path="/backup/all-databases.sql", **config)
+        return MariaDBAppHandler(config=app_config,
+            k8s_api=stub(K8sApiInstanceHandler, k8s_api),
+            mariadb_api=stub(MariaDBApiInstanceHandler, mariadb_api, _MariaDBApiInstanceHandler__pool=None),
+            longhorn_api=stub(LonghornApiInstanceHandler, longhorn_api),
+            replica_api=stub(MariaDBApiInstanceHandler, replica_api, _MariaDBApiInstanceHandler__pool=None) if replica_api != None else None,
+            run_state=run_state)
+    return make_handler
+
+
+def long_running_work_replies(*samples):
+    # (transactions, queries) samples of the preflight queries
+    return {
+        MariaDBAppHandler._MariaDBAppHandler__LONG_TRX_QUERY: [[(transactions, 120)] for transactions, queries in samples],
+        MariaDBAppHandler._MariaDBAppHandler__LONG_QUERIES_QUERY: [[(queries, 90)] for transactions, queries in samples]
+    }
+
+
+def test_preflight_waits_for_the_long_running_work(handler):
+    mariadb_api=FakeMariaDBApi(long_running_work_replies((1, 0), (0, 1), (0, 0)))
+    handler(mariadb_api=mariadb_api, preflight_action="WAIT").wait_for_long_running_work()
+    assert len(mariadb_api.queries) == 6
+
+
+def test_preflight_aborts_on_long_running_work(handler):
+    mariadb_api=FakeMariaDBApi(long_running_work_replies((1, 0), (0, 0)))
+    with pytest.raises(MariaDBAppHandlerException):
+        handler(mariadb_api=mariadb_api, preflight_action="ABORT").wait_for_long_running_work()
+
+
+def test_backup_mode_holds_block_commit_only_when_asked(handler):
+    # The preflight is run before the maintenance mode, not when entering the backup stages
+    mariadb_api=FakeMariaDBApi()
+    mdbah=handler(mariadb_api=mariadb_api)
+    with mdbah:
+        assert mdbah.backup_stage == "BLOCK_DDL"
+        mdbah.block_commit()
+    assert mariadb_api.queries == []
+    assert [command.split()[-1] for command in mariadb_api.commands] == ["START", "FLUSH", "BLOCK_DDL", "BLOCK_COMMIT", "END"]
+    assert mdbah.backup_stage == None
+    assert mdbah.backup_stage_timings["BLOCK_DDL"]["held"] != None
+
+
+def test_binlog_command_across_a_rotation():
+    command=MariaDBAppHandler.get_mysqlbinlog_command(files=["mariadb-bin.000007", "mariadb-bin.000008", "mariadb-bin.000009"],
+        start_position=1234, stop_position=567, password="secret")
+    commands=command.split(" && ")
+    assert len(commands) == 3
+    assert commands[0].endswith(" --start-position=1234 mariadb-bin.000007")
+    assert commands[1].endswith("--password=secret mariadb-bin.000008")
+    assert commands[2].endswith(" --stop-position=567 mariadb-bin.000009")
+    assert "--to-last-log" not in command
+
+    command=MariaDBAppHandler.get_mysqlbinlog_command(files=["mariadb-bin.000007"], start_position=1234, stop_position=5678, password="secret")
+    assert command.endswith(" --start-position=1234 --stop-position=5678 mariadb-bin.000007")
+
+
+class FakeBinaryStream:
+    def __init__(self, chunks, returncode=0):
+        self.chunks=chunks
+        self.returncode=returncode
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+class FakeK8sApi:
+    def __init__(self):
+        self.commands=[]
+
+    def exec_container_command_stream(self, pod_label, command, timeout=None, max_output_bytes=None, binary_stdout=False):
+        self.commands.append(command)
+        return FakeBinaryStream([("stdout", b"BINLOG '...';\n")])
+
+
+def binlog_replies(binary_logs, master_status):
+    return {
+        MariaDBAppHandler._MariaDBAppHandler__BINARY_LOGS_QUERY: [(name, 1048576) for name in binary_logs],
+        MariaDBAppHandler._MariaDBAppHandler__MASTER_STATUS_QUERY: [master_status],
+        MariaDBAppHandler._MariaDBAppHandler__PRIMARY_GTID_QUERY: [("0-1-42",)]
+    }
+
+
+@pytest.fixture
+def incremental_handler(handler, tmp_path):
+    def make_handler(mariadb_api, k8s_api=None):
+        run_state=RunState(file_path=str(tmp_path / "state.json"))
+        run_state.set("mariadb", "last_position", {"file": "mariadb-bin.000007", "position": 1234, "gtid": "0-1-40"})
+        return handler(mariadb_api=mariadb_api, k8s_api=k8s_api, run_state=run_state, dump_mode="STREAM",
+            dump_local_path=str(tmp_path / "dump"), dump_strategy="INCREMENTAL"), run_state
+    return make_handler
+
+
+def test_binlog_segment_records_the_rotated_files(incremental_handler):
+    k8s_api=FakeK8sApi()
+    mariadb_api=FakeMariaDBApi(binlog_replies(["mariadb-bin.000006", "mariadb-bin.000007", "mariadb-bin.000008", "mariadb-bin.000009"],
+        ("mariadb-bin.000008", 567)))
+    mdbah, run_state=incremental_handler(mariadb_api, k8s_api)
+    mdbah.create_mariadb_binlog_segment()
+
+    assert len(k8s_api.commands[0].split(" && ")) == 2
+    segment=run_state.get("mariadb", "segments")[0]
+    assert segment["files"] == ["mariadb-bin.000007", "mariadb-bin.000008"]
+    assert segment["stop"]["position"] == 567
+    assert run_state.get("mariadb", "last_position") == segment["stop"]
+
+
+def test_binlog_segment_needs_all_the_files(incremental_handler):
+    # The start file was purged: the caller falls back to a full dump
+    mariadb_api=FakeMariaDBApi(binlog_replies(["mariadb-bin.000008"], ("mariadb-bin.000008", 567)))
+    mdbah, run_state=incremental_handler(mariadb_api)
+    with pytest.raises(MariaDBAppHandlerException):
+        mdbah.create_mariadb_binlog_segment()
+    assert run_state.get("mariadb", "segments") == None
+
+
+def test_binlog_segments_must_be_contiguous(handler):
+    first={"file": "000001", "start": {"file": "bin.1", "position": 4}, "stop": {"file": "bin.2", "position": 100}, "files": ["bin.1", "bin.2"]}
+    second={"file": "000002", "start": {"file": "bin.2", "position": 100}, "stop": {"file": "bin.2", "position": 200}, "files": ["bin.2"]}
+    mdbah=handler()
+    mdbah.check_binlog_segments([first, second])
+    with pytest.raises(MariaDBAppHandlerException):
+        mdbah.check_binlog_segments([first, dict(second, start={"file": "bin.2", "position": 150})])
+    with pytest.raises(MariaDBAppHandlerException):
+        mdbah.check_binlog_segments([dict(first, files=["bin.1"])])
+
+
+def fingerprint_replies(log_bin=1, gtid="0-1-42", update_time="2024-03-10 02:00:00", checksum=None):
+    replies={
+        MariaDBAppHandler._MariaDBAppHandler__FINGERPRINT_GTID_QUERY: [(log_bin, gtid)],
+        MariaDBAppHandler._MariaDBAppHandler__FINGERPRINT_TABLES_QUERY: [(120, "2024-03-01 10:00:00", update_time)]
+    }
+    if checksum != None:
+        replies["CHECKSUM TABLE `nextcloud`.`oc_filecache`"]=[("nextcloud.oc_filecache", checksum)]
+    return replies
+
+
+@pytest.fixture
+def detecting_handler(handler, tmp_path):
+    run_state=RunState(file_path=str(tmp_path / "state.json"))
+
+    def make_handler(replies, **config):
+        mdbah=handler(mariadb_api=FakeMariaDBApi(replies), run_state=run_state, change_detection="ENABLED", **config)
+        # Stands for the dump itself
+        mdbah.create_mariadb_full_dump=lambda: "dump"
+        return mdbah
+    return make_handler
+
+
+def test_unchanged_fingerprint_skips_the_dump(detecting_handler):
+    first=detecting_handler(fingerprint_replies())
+    assert first.create_mariadb_dump() == "dump"
+    first.save_change_fingerprint(full_backup=True)
+
+    second=detecting_handler(fingerprint_replies())
+    assert second.create_mariadb_dump() == None
+    assert second.dump_skipped
+    assert second.is_backup_volume_unchanged(full_backup=True)
+
+    third=detecting_handler(fingerprint_replies(gtid="0-1-43"))
+    assert third.create_mariadb_dump() == "dump"
+    assert not third.is_backup_volume_unchanged(full_backup=False)
+
+
+def test_snapshot_only_runs_leave_the_backup_volume_to_the_next_backup(detecting_handler):
+    first=detecting_handler(fingerprint_replies())
+    first.create_mariadb_dump()
+    first.save_change_fingerprint(full_backup=True)
+    changed=detecting_handler(fingerprint_replies(update_time="2024-03-10 03:00:00"))
+    changed.create_mariadb_dump()
+    changed.save_change_fingerprint(full_backup=False)
+
+    # Unchanged since the snapshot-only run, but the dump taken then was never backed up
+    unchanged=detecting_handler(fingerprint_replies(update_time="2024-03-10 03:00:00"))
+    assert unchanged.create_mariadb_dump() == None
+    assert unchanged.is_backup_volume_unchanged(full_backup=False)
+    assert not unchanged.is_backup_volume_unchanged(full_backup=True)
+
+
+def test_fingerprint_without_binlog_needs_the_checksums(detecting_handler):
+    first=detecting_handler(fingerprint_replies(log_bin=0))
+    assert first.get_change_fingerprint() == None
+    first.save_change_fingerprint(full_backup=True)
+    assert detecting_handler(fingerprint_replies(log_bin=0)).create_mariadb_dump() == "dump"
+
+    tables={"fingerprint_tables": ["nextcloud.oc_filecache"]}
+    fingerprint=detecting_handler(fingerprint_replies(log_bin=0, checksum=1234), **tables).get_change_fingerprint()
+    assert fingerprint != None
+    assert detecting_handler(fingerprint_replies(log_bin=0, checksum=1235), **tables).get_change_fingerprint() != fingerprint
+
+
+def replica_replies(wait_result=0):
+    primary=FakeMariaDBApi({MariaDBAppHandler._MariaDBAppHandler__PRIMARY_GTID_QUERY: [("0-1-42",)]})
+    replica=FakeMariaDBApi({
+        MariaDBAppHandler._MariaDBAppHandler__REPLICA_GTID_WAIT_QUERY: [(wait_result,)],
+        MariaDBAppHandler._MariaDBAppHandler__REPLICA_GTID_QUERY: [("0-1-42",)]
+    })
+    return primary, replica
+
+
+def test_replication_is_paused_while_dumping(handler):
+    primary, replica=replica_replies()
+    mdbah=handler(mariadb_api=primary, replica_api=replica, replica_app_name="mariadb-replica",
+        dump_mode="STREAM", dump_local_path="/backup")
+    with pytest.raises(RuntimeError):
+        with mdbah.paused_replica() as replica_gtid_pos:
+            assert replica_gtid_pos == "0-1-42"
+            assert replica.commands == ["STOP SLAVE SQL_THREAD"]
+            raise RuntimeError("dump failed")
+    # Resumed even when the dump fails
+    assert replica.commands == ["STOP SLAVE SQL_THREAD", "START SLAVE SQL_THREAD"]
+
+
+def test_replica_behind_the_primary_is_not_dumped(handler):
+    # MASTER_GTID_WAIT returns -1 on timeout
+    primary, replica=replica_replies(wait_result=-1)
+    mdbah=handler(mariadb_api=primary, replica_api=replica, replica_app_name="mariadb-replica",
+        dump_mode="STREAM", dump_local_path="/backup")
+    with pytest.raises(MariaDBAppHandlerException):
+        with mdbah.paused_replica():
+            pass
+    assert replica.commands == []
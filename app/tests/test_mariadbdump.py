@@ -0,0 +1,100 @@
+import gzip
+
+import pytest
+
+pytest.importorskip("mariadb")
+
+from kubencbackup.apihandlers.mariadbapi import MariaDBApiInstanceHandler
+from kubencbackup.apihandlers.mariadbdump import MariaDBDumpEngine, MariaDBDumpTable, get_order_by_columns
+
+
+COLUMNS=["`id`", "`email`", "`name`"]
+
+
+def test_order_by_the_primary_key():
+    unique_keys=[("PRIMARY", "id", ""), ("email_unique", "email", "")]
+    assert get_order_by_columns(unique_keys, COLUMNS) == ["`id`"]
+
+
+def test_order_by_a_not_nullable_unique_key():
+    unique_keys=[("a_unique", "email", "YES"), ("b_unique", "name", ""), ("b_unique", "id", "")]
+    assert get_order_by_columns(unique_keys, COLUMNS) == ["`name`", "`id`"]
+
+
+def test_order_by_all_the_columns_without_a_usable_key():
+    assert get_order_by_columns([], COLUMNS) == COLUMNS
+    assert get_order_by_columns([("email_unique", "email", "YES")], COLUMNS) == COLUMNS
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection=connection
+        self.rows=[]
+
+    def execute(self, query, params=()):
+        self.connection.queries.append(query)
+        self.rows=list(self.connection.results(query))
+
+    def fetchall(self):
+        rows, self.rows=self.rows, []
+        return rows
+
+    def fetchone(self):
+        return self.rows.pop(0) if len(self.rows) > 0 else None
+
+    def fetchmany(self, size):
+        rows, self.rows=self.rows[:size], self.rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    # A table with a TIMESTAMP and a DATETIME column, the server sending the temporal columns cast to text
+    def __init__(self):
+        self.queries=[]
+
+    def cursor(self, buffered=True):
+        return FakeCursor(self)
+
+    def results(self, query):
+        if query.startswith("SELECT COLUMN_NAME"):
+            return [("id", "int"), ("created_at", "timestamp"), ("deleted_at", "datetime")]
+        if query.startswith("SHOW CREATE TABLE"):
+            return [("events", "CREATE TABLE `events` (`id` int)")]
+        if query.startswith("SELECT `id`"):
+            return [(1, "2024-03-10 01:30:00", "0000-00-00 00:00:00"), (2, "2024-03-10 02:30:00.250000", None)]
+        if query == "SHOW MASTER STATUS":
+            return [("mariadb-bin.000007", 1234)]
+        if query == "SELECT @@GLOBAL.gtid_binlog_pos":
+            return [("0-1-42",)]
+        return []
+
+
+def dump_engine(stub_handler):
+    # No connection pool to close
+    return MariaDBDumpEngine(mariadb_api=stub_handler(MariaDBApiInstanceHandler, _MariaDBApiInstanceHandler__pool=None), workers=1)
+
+
+def test_temporal_values_are_dumped_as_text_in_utc(tmp_path, stub_handler):
+    engine=dump_engine(stub_handler)
+    connection=FakeConnection()
+    table=MariaDBDumpTable(schema="nextcloud", name="events", data_length=0)
+    table.file_path=str(tmp_path / "nextcloud" / "events.sql.gz")
+    engine._MariaDBDumpEngine__dump_table(connection, table)
+
+    assert connection.queries[-1] == "SELECT `id`,CAST(`created_at` AS CHAR),CAST(`deleted_at` AS CHAR) FROM `nextcloud`.`events` ORDER BY `id`,`created_at`,`deleted_at`"
+    with gzip.open(table.file_path, "rt") as f:
+        content=f.read()
+    assert "SET TIME_ZONE='+00:00';\nSET SQL_MODE='NO_AUTO_VALUE_ON_ZERO';\n" in content
+    assert "(1,'2024-03-10 01:30:00','0000-00-00 00:00:00'),\n(2,'2024-03-10 02:30:00.250000',NULL);\n" in content
+
+
+def test_workers_read_the_snapshot_in_utc(stub_handler):
+    engine=dump_engine(stub_handler)
+    coordinator, worker=FakeConnection(), FakeConnection()
+    position=engine._MariaDBDumpEngine__start_consistent_snapshot(coordinator, [worker])
+    assert position == {"file": "mariadb-bin.000007", "position": 1234, "gtid": "0-1-42"}
+    assert worker.queries[0] == "SET SESSION time_zone='+00:00'"
+    assert worker.queries[-1] == "START TRANSACTION WITH CONSISTENT SNAPSHOT"
@@ -0,0 +1,95 @@
+import pytest
+
+pytest.importorskip("kubernetes")
+pytest.importorskip("mariadb")
+pytest.importorskip("kubencbackup.extlib.longhornlib")
+
+from kubencbackup.apihandlers.kubernetesapi import K8sApiInstanceHandler
+from kubencbackup.apihandlers.longhornapi import LonghornApiInstanceHandler
+from kubencbackup.apihandlers.mariadbapi import MariaDBApiInstanceHandler
+from kubencbackup.apphandlers.nextcloudapp import NextcloudAppConfig, NextcloudAppHandler, NextcloudAppHandlerException
+
+
+class ActivitySamples:
+    # Replies to the activity command with the given "cron-jobs busy-workers queued-connections" samples
+    def __init__(self, samples):
+        self.samples=list(samples)
+        self.commands=[]
+
+    def __call__(self, pod_label, command, timeout=None):
+        self.commands.append(command)
+        return self.samples.pop(0) if len(self.samples) > 1 else self.samples[0]
+
+
+@pytest.fixture(autouse=True)
+def no_sleep(monkeypatch):
+    monkeypatch.setattr("kubencbackup.apphandlers.nextcloudapp.sleep", lambda seconds: None)
+
+
+@pytest.fixture
+def handler(stub_handler):
+    def make_handler(samples, status_url=None, drain_timeout=30, db_sessions=None):
+        config=NextcloudAppConfig(app_name="nextcloud", app_volume_name="nextcloud-data", drain_timeout=drain_timeout,
+            drain_poll_interval=1, status_url=status_url, db_user=None if db_sessions == None else "nextcloud")
+        activity=ActivitySamples(samples)
+        k8s_api=stub_handler(K8sApiInstanceHandler, exec_container_command=activity)
+        mariadb_api=None
+        if db_sessions != None:
+            # The Nextcloud MariaDB sessions of each sample
+            db_sessions=list(db_sessions)
+            mariadb_api=stub_handler(MariaDBApiInstanceHandler, _MariaDBApiInstanceHandler__pool=None,
+                exec_sql_query=lambda query, params: [[db_sessions.pop(0) if len(db_sessions) > 1 else db_sessions[0]]])
+        return NextcloudAppHandler(config=config, k8s_api=k8s_api, longhorn_api=stub_handler(LonghornApiInstanceHandler), mariadb_api=mariadb_api), activity
+    return make_handler
+
+
+def test_idle_needs_consecutive_idle_samples(handler):
+    nc_handler, activity=handler(["0 0 0", "0 2 0", "0 0 0", "1 0 0", "0 0 0", "0 0 0"], status_url="http://127.0.0.1/server-status?auto")
+    nc_handler.wait_until_idle()
+    assert len(activity.commands) == 6
+
+
+def test_busy_workers_are_read_from_the_status_url_only_when_set(handler):
+    nc_handler, activity=handler(["0 -1 3"])
+    assert nc_handler.get_activity() == {"cron-jobs": 0, "queued-connections": 3}
+    assert "php -r" not in activity.commands[0]
+
+    nc_handler, activity=handler(["0 1 3"], status_url="http://127.0.0.1/status")
+    assert nc_handler.get_activity() == {"cron-jobs": 0, "web-requests": 1}
+    assert "http://127.0.0.1/status" in activity.commands[0]
+
+
+def test_drain_timeout_returns_while_busy(handler):
+    nc_handler, activity=handler(["2 0 0"], drain_timeout=0)
+    nc_handler.wait_until_idle()
+    assert len(activity.commands) == 1
+
+
+def test_drain_task_starts_once_the_writes_stopped(handler):
+    nc_handler, activity=handler(["0 1 0", "0 1 0", "0 0 0", "0 0 0"], db_sessions=[2, 0])
+    samples_at_start=[]
+    nc_handler.drain_task=lambda: samples_at_start.append(len(activity.commands))
+    nc_handler.wait_until_idle_running_drain_task()
+    # Started at the second sample, while Nextcloud was still busy, and run once
+    assert samples_at_start == [2]
+    assert len(activity.commands) == 4
+
+
+def test_drain_task_without_db_sessions_starts_once_idle(handler):
+    nc_handler, activity=handler(["0 1 0", "0 0 0", "0 0 0"])
+    samples_at_start=[]
+    nc_handler.drain_task=lambda: samples_at_start.append(len(activity.commands))
+    nc_handler.wait_until_idle_running_drain_task()
+    assert samples_at_start == [3]
+
+
+def test_drain_task_failure_is_reported(handler):
+    nc_handler, activity=handler(["0 0 0"])
+
+    def drain_task():
+        raise RuntimeError("mysqldump failed")
+
+    nc_handler.drain_task=drain_task
+    with pytest.raises(NextcloudAppHandlerException) as e:
+        nc_handler.wait_until_idle_running_drain_task()
+    assert "mysqldump failed" in str(e.value)
@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta
+
+from kubencbackup.common.retention import select_over_retention, select_over_size_budget
+
+
+def hourly_items(count, newest=datetime(2024, 3, 10, 23, 0)):
+    return [(newest - timedelta(hours=hours), "item-" + str(hours)) for hours in range(count)]
+
+
+def test_keeps_the_last_items_without_tiers():
+    items=hourly_items(5)
+    assert select_over_retention(items=items, retain_count=2, tiers={}) == sorted(items)[:3]
+
+
+def test_nothing_to_delete_under_the_retain_count():
+    assert select_over_retention(items=hourly_items(3), retain_count=5, tiers={}) == []
+
+
+def test_keeps_the_newest_item_of_each_day():
+    # Three days of hourly items, from 2024-03-08 00:00 to 2024-03-10 23:00
+    items=hourly_items(72)
+    to_delete=select_over_retention(items=items, retain_count=1, tiers={"DAILY": 3})
+    kept=sorted(set(items) - set(to_delete))
+    assert [name for created, name in kept] == ["item-48", "item-24", "item-0"]
+    assert to_delete == sorted(to_delete)
+
+
+def test_the_tiers_count_only_the_periods_with_items():
+    # One item per week for ten weeks: the monthly tier keeps the newest item of the last two months only
+    newest=datetime(2024, 3, 31, 12, 0)
+    items=[(newest - timedelta(weeks=weeks), "week-" + str(weeks)) for weeks in range(10)]
+    to_delete=select_over_retention(items=items, retain_count=0, tiers={"WEEKLY": 2, "MONTHLY": 2})
+    kept=sorted(set(items) - set(to_delete), reverse=True)
+    assert [name for created, name in kept] == ["week-0", "week-1", "week-5"]
+
+
+def test_items_created_at_the_same_time_are_selected_by_name():
+    created=datetime(2024, 3, 10, 12, 0)
+    items=[(created, "b"), (created, "a"), (created, "c")]
+    assert select_over_retention(items=items, retain_count=1, tiers={}) == [(created, "a"), (created, "b")]
+
+
+def test_size_budget_deletes_the_oldest_items_not_fitting():
+    items=hourly_items(4)
+    sizes={"item-0": 40, "item-1": 30, "item-2": 20, "item-3": 5}
+    # 40 + 30 fit, 40 + 30 + 20 don't: item-2 and every older item go, even if item-3 alone would fit
+    assert select_over_size_budget(items=items, sizes=sizes, budget=80) == sorted(items)[:2]
+
+
+def test_size_budget_always_keeps_the_newest_item():
+    items=hourly_items(2)
+    assert select_over_size_budget(items=items, sizes={"item-0": 100, "item-1": 1}, budget=10) == [items[1]]
+
+
+def test_size_budget_ignores_the_items_of_unknown_size():
+    assert select_over_size_budget(items=hourly_items(3), sizes={}, budget=1) == []
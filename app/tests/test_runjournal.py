@@ -0,0 +1,56 @@
+import pytest
+
+from kubencbackup.common.runjournal import RunJournal
+from kubencbackup.common.runstate import RunState, RunStateException
+
+
+def load_journal(state_path):
+    # A new RunState reading the file, as the next run would
+    return RunJournal(run_state=RunState(file_path=str(state_path)).load())
+
+
+def test_failed_run_is_resumed_from_the_missing_steps(tmp_path):
+    state_path=tmp_path / "state.json"
+    journal=load_journal(state_path)
+    assert journal.resume() == None
+
+    journal.start(set_name="backup-20240310", backup_type="FULL-BACKUP")
+    journal.complete("snapshots", data={"backup_volume_unchanged": True})
+    journal.complete("nextcloud-backup")
+
+    resumed=load_journal(state_path)
+    assert resumed.resume() == "backup-20240310"
+    assert resumed.backup_type == "FULL-BACKUP"
+    assert resumed.is_done("snapshots") and resumed.is_done("nextcloud-backup")
+    assert not resumed.is_done("mariadb-actual-volume-backup")
+    assert resumed.get_step_data("snapshots") == {"backup_volume_unchanged": True}
+    assert resumed.get_step_data("nextcloud-backup") == None
+
+
+def test_finished_set_is_not_resumed(tmp_path):
+    state_path=tmp_path / "state.json"
+    journal=load_journal(state_path)
+    journal.start(set_name="backup-20240310", backup_type="SNAPSHOT")
+    journal.complete("snapshots")
+    journal.finish()
+
+    resumed=load_journal(state_path)
+    assert resumed.resume() == None
+    assert not resumed.is_done("snapshots")
+
+
+def test_new_set_discards_the_incomplete_one(tmp_path):
+    state_path=tmp_path / "state.json"
+    journal=load_journal(state_path)
+    journal.start(set_name="backup-20240310", backup_type="SNAPSHOT")
+    journal.complete("snapshots")
+    journal.start(set_name="backup-20240311", backup_type="SNAPSHOT")
+
+    resumed=load_journal(state_path)
+    assert resumed.get_pending_set() == "backup-20240311"
+    assert not resumed.is_done("snapshots")
+
+
+def test_run_state_is_mandatory():
+    with pytest.raises(RunStateException):
+        RunJournal(run_state=None)
@@ -0,0 +1,49 @@
+from threading import Barrier
+
+import pytest
+
+from kubencbackup.common.workerpool import WorkerPool, WorkerPoolException, WorkerPoolTask
+
+
+def test_tasks_run_concurrently_and_return_their_results():
+    # Released only when the three tasks are running at the same time
+    barrier=Barrier(3, timeout=5)
+
+    def task(value):
+        barrier.wait()
+        return value * 2
+
+    tasks=WorkerPool(max_workers=3).run({name: (lambda value=value: task(value)) for name, value in [("a", 1), ("b", 2), ("c", 3)]})
+    assert {name: task.result for name, task in tasks.items()} == {"a": 2, "b": 4, "c": 6}
+    assert all(task.duration >= 0 for task in tasks.values())
+
+
+def test_errors_of_all_the_tasks_are_collected():
+    ran=[]
+
+    def fail(name):
+        ran.append(name)
+        raise ValueError(name + " failed")
+
+    with pytest.raises(WorkerPoolException) as e:
+        WorkerPool(max_workers=1).run({"a": lambda: fail("a"), "b": lambda: ran.append("b"), "c": lambda: fail("c")})
+    # The tasks after the first failure are run anyway
+    assert sorted(ran) == ["a", "b", "c"]
+    assert e.value.message == "a: a failed; c: c failed"
+    assert e.value.tasks["b"].error == None
+
+
+def test_spread_between_the_first_and_the_last_completion():
+    tasks={}
+    for name, finished_at in [("a", 10.0), ("b", 10.5), ("c", None)]:
+        tasks[name]=WorkerPoolTask(name=name, function=None)
+        tasks[name].finished_at=finished_at
+    assert WorkerPool.spread(tasks) == 0.5
+    assert WorkerPool.spread({}) == 0.0
+
+
+def test_max_workers_must_be_positive():
+    with pytest.raises(WorkerPoolException):
+        WorkerPool(max_workers=0)
+    with pytest.raises(WorkerPoolException):
+        WorkerPool(max_workers="many")